@@ -0,0 +1,141 @@
+import os
+import asyncio
+import tempfile
+from ftrace import Check
+from ftrace import FtraceManager
+from ftrace import ReadBuffer
+from helper import Helpers
+
+
+class TracerWindow:
+    def __init__(self, tracer_name, duration, on_at, off_at, results):
+        self.tracer_name = tracer_name
+        self.duration = duration
+        self.on_at = on_at
+        self.off_at = off_at
+        self.results = results
+
+    def error_ms(self):
+        return (self.off_at - self.on_at) * 1000 - self.duration
+
+    def __str__(self):
+        return 'Tracer: "{}" window: {} ms (error {:+.3f} ms)'.format(self.tracer_name, self.duration, self.error_ms())
+
+
+class TracerRun:
+    def __init__(self, tracer_name, duration, window=None, error=None):
+        self.tracer_name = tracer_name
+        self.duration = duration
+        self.window = window
+        self.error = error
+
+    def __str__(self):
+        if self.error is not None:
+            return 'Tracer: "{}" duration: {} ms FAILED: {}'.format(self.tracer_name, self.duration, self.error)
+        return '{} PASSED'.format(self.window)
+
+
+class AsyncFtraceManager:
+    # Tracer windows scheduled on the backend clock: the off switch happens
+    # duration milliseconds after the on switch, whatever the file writes
+    # cost in between, and other tasks run while the window is open. The
+    # tracefs control writes themselves are short and are issued directly
+    # from the event loop.
+    def __init__(self, config):
+        self.config = config
+        self.manager = FtraceManager(config)
+
+    async def sleep_until(self, deadline):
+        delay = deadline - Helpers.backend.monotonic()
+        if delay > 0:
+            await Helpers.backend.async_sleep(delay)
+
+    async def window(self, tracer_name, duration, tasks=(), start_at=None):
+        # tasks are callables returning awaitables. They start right after
+        # the tracer is switched on and whatever is still running when the
+        # window closes is cancelled.
+        if start_at is not None:
+            await self.sleep_until(start_at)
+        self.manager.tracer_on(tracer_name)
+        on_at = Helpers.backend.monotonic()
+        running = [asyncio.ensure_future(task()) for task in tasks]
+        try:
+            await self.sleep_until(on_at + duration / 1000)
+        finally:
+            self.manager.tracer_off(tracer_name)
+            off_at = Helpers.backend.monotonic()
+            for task in running:
+                if not task.done():
+                    task.cancel()
+        results = await asyncio.gather(*running, return_exceptions=True)
+        return TracerWindow(tracer_name, duration, on_at, off_at, results)
+
+    def capture(self, directory, name):
+        # Copies the trace files to directory so the ring buffer can be reset
+        # while they are verified.
+        filenames = []
+        readbuffer = ReadBuffer(self.config)
+        for k, trace_filename in enumerate(self.config['trace']):
+            filename = os.path.join(directory, '{}-{}.txt'.format(name, k))
+            with open(filename, 'w') as f:
+                f.writelines(readbuffer.iter_lines(trace_filename))
+            filenames.append(filename)
+        return filenames
+
+    def verify(self, filenames):
+        readbuffer = ReadBuffer(self.config)
+        try:
+            Check.content_trace_files(readbuffer.iter_lines(filenames[0]), readbuffer.iter_lines(filenames[1]))
+        finally:
+            for filename in filenames:
+                os.remove(filename)
+
+    async def tracer_matrix(self, tracers, durations, reset=None, directory=None):
+        # Runs one window per (tracer, duration) pair, one after the other
+        # since they share the ring buffer. The contents of every window are
+        # captured and then compared in a worker thread while the next
+        # windows run.
+        if directory is None:
+            with tempfile.TemporaryDirectory(prefix='ftracebt-tracers-') as directory:
+                return await self.tracer_matrix(tracers, durations, reset, directory)
+        runs = []
+        verifications = []
+        for tracer_name in tracers:
+            for duration in durations:
+                run = TracerRun(tracer_name, duration)
+                runs.append(run)
+                try:
+                    run.window = await self.window(tracer_name, duration)
+                    filenames = await asyncio.to_thread(self.capture, directory, '{}-{}'.format(len(runs), tracer_name))
+                except Exception as err:
+                    run.error = str(err)
+                    continue
+                finally:
+                    if reset:
+                        reset()
+                verifications.append((run, asyncio.ensure_future(asyncio.to_thread(self.verify, filenames))))
+        for run, verification in verifications:
+            try:
+                await verification
+            except Exception as err:
+                run.error = str(err)
+        return runs
+
+    @staticmethod
+    def in_thread(function, *args):
+        # Task factory for blocking work inside a window, e.g.
+        # AsyncFtraceManager.in_thread(writebuffer.write_pages, 4, 0, 101).
+        return lambda: asyncio.to_thread(function, *args)
+
+    @staticmethod
+    def started(start, stop):
+        # Task factory for the background helpers with start()/stop(), like
+        # CounterSampler or OnlineChecker: they run for the whole window.
+        async def run():
+            start()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                pass
+            return stop()
+        return run
@@ -0,0 +1,128 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class AnalyticsError(Exception):
+    pass
+
+
+def available():
+    return numpy is not None
+
+
+def _require_numpy():
+    if numpy is None:
+        raise AnalyticsError('The timestamp analytics need NumPy. Install it with "pip install numpy".')
+
+
+def _int64(column):
+    # TraceRecords keeps its integer columns in array('q'), NumPy can use
+    # their memory without a copy.
+    return numpy.frombuffer(column, dtype=numpy.int64) if len(column) else numpy.zeros(0, dtype=numpy.int64)
+
+
+def order_violations(timestamps):
+    return numpy.flatnonzero(timestamps[1:] < timestamps[:-1]) + 1
+
+
+def first_order_violation(records):
+    _require_numpy()
+    violations = order_violations(_int64(records.timestamps))
+    return int(violations[0]) if len(violations) else None
+
+
+def distribution(values):
+    if not len(values):
+        return {'count': 0}
+    p50, p90, p99 = numpy.percentile(values, [50, 90, 99])
+    largest = int(values.max())
+    edges = [0] + [1 << bit for bit in range(max(largest, 1).bit_length() + 1)]
+    counts, _ = numpy.histogram(values, bins=edges)
+    return {
+        'count': int(len(values)),
+        'min': int(values.min()),
+        'mean': float(values.mean()),
+        'p50': float(p50),
+        'p90': float(p90),
+        'p99': float(p99),
+        'max': largest,
+        'histogram': {'edges_ns': edges, 'counts': [int(count) for count in counts]},
+    }
+
+
+class TimestampAnalytics:
+    # Ordering checks and latency figures of a trace, computed on int64
+    # arrays that share memory with the TraceRecords columns. When
+    # page_header is given, every entry containing it starts a page and the
+    # commit duration of a page is the time from its header to its last
+    # entry.
+    def __init__(self, records, page_header=None):
+        _require_numpy()
+        self.records = records
+        self.timestamps = _int64(records.timestamps)
+        self.cpus = _int64(records.cpus)
+        self.page_header = page_header
+        self.headers = None
+        if page_header is not None:
+            self.headers = numpy.fromiter((payload.find(page_header) != -1 for payload in records.payloads), dtype=bool, count=len(records))
+        order = numpy.argsort(self.cpus, kind='stable')
+        cpus, starts = numpy.unique(self.cpus[order], return_index=True)
+        self.per_cpu = dict(zip((int(cpu) for cpu in cpus), numpy.split(order, starts[1:])))
+
+    def global_order_violations(self):
+        return order_violations(self.timestamps)
+
+    def cpu_order_violations(self, cpu):
+        indexes = self.per_cpu.get(cpu, numpy.zeros(0, dtype=numpy.int64))
+        return indexes[order_violations(self.timestamps[indexes])]
+
+    def cpu_gaps(self, cpu):
+        return numpy.diff(self.timestamps[self.per_cpu[cpu]])
+
+    def cpu_page_commit_durations(self, cpu):
+        if self.headers is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+        indexes = self.per_cpu[cpu]
+        timestamps = self.timestamps[indexes]
+        starts = numpy.flatnonzero(self.headers[indexes])
+        ends = numpy.append(starts[1:], len(indexes)) - 1
+        return timestamps[ends] - timestamps[starts]
+
+    def as_dict(self):
+        violations = self.global_order_violations()
+        cpus = {}
+        for cpu in sorted(self.per_cpu):
+            cpu_violations = self.cpu_order_violations(cpu)
+            cpus[str(cpu)] = {
+                'entries': int(len(self.per_cpu[cpu])),
+                'order_violations': int(len(cpu_violations)),
+                'first_order_violation': int(cpu_violations[0]) if len(cpu_violations) else None,
+                'gaps_ns': distribution(self.cpu_gaps(cpu)),
+                'page_commit_ns': distribution(self.cpu_page_commit_durations(cpu)),
+            }
+        return {
+            'entries': int(len(self.timestamps)),
+            'order_violations': int(len(violations)),
+            'first_order_violation': int(violations[0]) if len(violations) else None,
+            'gaps_ns': distribution(numpy.diff(self.timestamps)),
+            'cpus': cpus,
+        }
+
+    @staticmethod
+    def _format_distribution(name, stats):
+        if not stats['count']:
+            return '{}: -'.format(name)
+        return '{}: p50 {:.1f} us p99 {:.1f} us max {:.1f} us'.format(name, stats['p50'] / 1000, stats['p99'] / 1000, stats['max'] / 1000)
+
+    def __str__(self):
+        summary = self.as_dict()
+        lines = ['Entries: {} Order violations: {} {}'.format(summary['entries'], summary['order_violations'],
+                                                             TimestampAnalytics._format_distribution('Gaps', summary['gaps_ns']))]
+        for cpu, stats in summary['cpus'].items():
+            lines.append('CPU#: {:03}\tentries: {:10}\torder violations: {:6}\t{}\t{}'.format(
+                int(cpu), stats['entries'], stats['order_violations'],
+                TimestampAnalytics._format_distribution('gaps', stats['gaps_ns']),
+                TimestampAnalytics._format_distribution('page commit', stats['page_commit_ns'])))
+        return '\n'.join(lines)
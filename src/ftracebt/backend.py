@@ -0,0 +1,119 @@
+import os
+import time
+import asyncio
+
+
+class FdWriter:
+    def __init__(self, filename):
+        self.fd = os.open(filename, os.O_WRONLY | os.O_APPEND)
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def writev(self, buffers):
+        return os.writev(self.fd, buffers)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FdReader:
+    def __init__(self, filename):
+        self.fd = os.open(filename, os.O_RDONLY | os.O_NONBLOCK)
+
+    def read(self, size):
+        while True:
+            try:
+                return os.read(self.fd, size)
+            except BlockingIOError:
+                return b''
+            except InterruptedError:
+                continue
+
+    def readinto(self, buf):
+        while True:
+            try:
+                return os.readv(self.fd, [buf])
+            except BlockingIOError:
+                return 0
+            except InterruptedError:
+                continue
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class CounterFile:
+    # Keeps a counter file open and rereads it from offset 0 with pread().
+    def __init__(self, filename):
+        self.fd = os.open(filename, os.O_RDONLY)
+
+    def read(self):
+        while True:
+            try:
+                return int(os.pread(self.fd, 32, 0))
+            except InterruptedError:
+                continue
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class TracefsBackend:
+    # The real tracefs. Every other backend mirrors these methods.
+    shared_across_processes = True
+
+    def open_text(self, filename, buffering=-1):
+        return open(filename, 'r', buffering=buffering)
+
+    def read_line(self, filename):
+        with open(filename) as f:
+            return f.readline()
+
+    def write(self, filename, mode, text):
+        with open(filename, mode) as f:
+            r = f.write(text)
+            f.flush()
+            return r
+
+    def open_marker(self, filename):
+        return FdWriter(filename)
+
+    def open_counter(self, filename):
+        return CounterFile(filename)
+
+    def open_pipe(self, filename):
+        return FdReader(filename)
+
+    def open_raw(self, filename):
+        return FdReader(filename)
+
+    def exists(self, filename):
+        return os.path.exists(filename)
+
+    def mkdir(self, filename):
+        os.mkdir(filename)
+
+    def rmdir(self, filename):
+        os.rmdir(filename)
+
+    def listdir(self, filename):
+        return sorted(os.listdir(filename))
+
+    def pin(self, cpu):
+        os.sched_setaffinity(0, {cpu})
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def monotonic(self):
+        return time.monotonic()
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
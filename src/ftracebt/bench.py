@@ -0,0 +1,297 @@
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from helper import ArgumentError
+from helper import Helpers
+from backend import TracefsBackend
+from ftrace import Check
+from ftrace import ReadBuffer
+from ftrace import VerifyMode
+from ftrace import WriteBuffer
+from records import TraceRecords
+from simtracefs import SimulatedTracefs
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class BenchmarkFixture:
+    # A synthetic trace of nr_pages marker pages spread evenly over nr_cpus.
+    # Pages are written round robin, one page per CPU at a time, through the
+    # simulated tracefs and the rendered trace is saved to a plain file, so
+    # nothing here touches the kernel.
+    def __init__(self, config, nr_pages, nr_cpus, entries_per_page, directory, write_mode='keep_open'):
+        if nr_pages < nr_cpus:
+            raise ArgumentError('A benchmark trace needs at least one page per CPU. Pages: {} CPUs: {}'.format(nr_pages, nr_cpus))
+        self.config = config
+        self.nr_cpus = nr_cpus
+        self.pages_per_cpu = nr_pages // nr_cpus
+        self.nr_pages = self.pages_per_cpu * nr_cpus
+        self.entries_per_page = entries_per_page
+        self.nr_entries = self.nr_pages * entries_per_page
+        self.write_mode = write_mode
+        self.trace_filename = os.path.join(directory, 'trace-{}-pages-{}-cpus.txt'.format(self.nr_pages, nr_cpus))
+
+    def simulated(self):
+        config = dict(self.config)
+        config['nr_pages_to_fillup_buffer'] = self.pages_per_cpu + 1
+        return SimulatedTracefs(config, self.nr_cpus)
+
+    def write(self, sim):
+        with WriteBuffer(self.config, self.write_mode) as writebuffer:
+            for page_id in range(1, self.pages_per_cpu + 1):
+                for cpu in range(self.nr_cpus):
+                    sim.pin(cpu)
+                    writebuffer.write_page(cpu, page_id, self.entries_per_page)
+
+    def generate(self):
+        if os.path.exists(self.trace_filename):
+            return self
+        sim = self.simulated()
+        with sim:
+            self.write(sim)
+            content = sim.read(self.config['trace'][0])
+        with open(self.trace_filename, 'w') as f:
+            f.write(content)
+        return self
+
+    def records(self):
+        return ReadBuffer(self.config).get_records(self.trace_filename)
+
+
+def _write_to_devnull(fixture, write_mode, write):
+    # The writers write to /dev/null through the real file backend, so the
+    # cases time WriteBuffer and the system calls, not the simulated tracefs.
+    config = dict(fixture.config, marker_file=os.devnull)
+    def run():
+        previous_backend = Helpers.set_backend(TracefsBackend())
+        try:
+            with WriteBuffer(config, write_mode) as writebuffer:
+                write(writebuffer)
+        finally:
+            Helpers.set_backend(previous_backend)
+    return run
+
+
+def _setup_write_entry(fixture):
+    def write(writebuffer):
+        for page_id in range(1, fixture.pages_per_cpu + 1):
+            for cpu in range(fixture.nr_cpus):
+                for entry_nr in range(fixture.entries_per_page):
+                    writebuffer.write_entry(cpu, page_id, entry_nr)
+    return _write_to_devnull(fixture, fixture.write_mode, write)
+
+
+def _setup_write_pages(write_mode):
+    def setup(fixture):
+        def write(writebuffer):
+            for cpu in range(fixture.nr_cpus):
+                writebuffer.write_pages(fixture.pages_per_cpu, cpu, fixture.entries_per_page)
+        return _write_to_devnull(fixture, write_mode, write)
+    return setup
+
+
+def _setup_get_entries_noheader_nc(fixture):
+    readbuffer = ReadBuffer(fixture.config)
+    return lambda: readbuffer.get_entries_noheader_nc(fixture.trace_filename)
+
+
+def _setup_parse_records(fixture):
+    lines = ReadBuffer(fixture.config).get_entries_noheader_nc(fixture.trace_filename)
+    return lambda: TraceRecords.parse(lines)
+
+
+def _setup_exact_marker_pages(fixture, verify_mode=None):
+    records = fixture.records()
+    def run():
+        per_cpu, _ = records.split_per_cpu(range(fixture.nr_cpus))
+        for cpu in range(fixture.nr_cpus):
+            Check.exact_marker_pages(records, fixture.entries_per_page, cpu, fixture.pages_per_cpu, indexes=per_cpu[cpu], verify_mode=verify_mode)
+    return run
+
+
+def _setup_exact_marker_pages_tiered(fixture):
+    return _setup_exact_marker_pages(fixture, VerifyMode('tiered'))
+
+
+def _setup_merged_buffers(fixture):
+    records = fixture.records()
+    return lambda: Check.merged_buffers(records)
+
+
+class Benchmark:
+    cases = {
+        'write_entry': _setup_write_entry,
+        'write_pages_reopen': _setup_write_pages('reopen'),
+        'write_pages_keep_open': _setup_write_pages('keep_open'),
+        'write_pages_batched': _setup_write_pages('batched'),
+        'get_entries_noheader_nc': _setup_get_entries_noheader_nc,
+        'parse_records': _setup_parse_records,
+        'exact_marker_pages': _setup_exact_marker_pages,
+        'exact_marker_pages_tiered': _setup_exact_marker_pages_tiered,
+        'merged_buffers': _setup_merged_buffers,
+    }
+
+    def __init__(self, config, entries_per_page, directory, write_mode='keep_open', repeat=3, memory=True):
+        self.config = config
+        self.entries_per_page = entries_per_page
+        self.directory = directory
+        self.write_mode = write_mode
+        self.repeat = repeat
+        self.memory = memory
+
+    @staticmethod
+    def measure(setup, repeat, memory):
+        durations = []
+        for _ in range(repeat):
+            run = setup()
+            gc.collect()
+            start_ns = time.perf_counter_ns()
+            run()
+            durations.append(time.perf_counter_ns() - start_ns)
+        peak = None
+        if memory:
+            run = setup()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                run()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+        return (durations, peak)
+
+    def run_case(self, name, fixture):
+        setup = Benchmark.cases[name]
+        durations, peak = Benchmark.measure(lambda: setup(fixture), self.repeat, self.memory)
+        best_ns = min(durations)
+        return {
+            'case': name,
+            'pages': fixture.nr_pages,
+            'cpus': fixture.nr_cpus,
+            'entries': fixture.nr_entries,
+            'best_ns': best_ns,
+            'mean_ns': sum(durations) // len(durations),
+            'ns_per_entry': best_ns / fixture.nr_entries,
+            'entries_per_second': fixture.nr_entries * 1000000000 / best_ns if best_ns else 0.0,
+            'peak_memory_bytes': peak,
+        }
+
+    def run(self, pages, cpus, cases, progress=None):
+        results = []
+        for nr_pages in pages:
+            for nr_cpus in cpus:
+                if nr_pages < nr_cpus:
+                    continue
+                fixture = BenchmarkFixture(self.config, nr_pages, nr_cpus, self.entries_per_page, self.directory, self.write_mode).generate()
+                for name in cases:
+                    result = self.run_case(name, fixture)
+                    if progress:
+                        progress(result)
+                    results.append(result)
+        return {
+            'python': platform.python_version(),
+            'entries_per_page': self.entries_per_page,
+            'write_mode': self.write_mode,
+            'repeat': self.repeat,
+            'results': results,
+        }
+
+    @staticmethod
+    def format_result(result):
+        memory = '-' if result['peak_memory_bytes'] is None else '{:.1f} KiB'.format(result['peak_memory_bytes'] / 1024)
+        return '{:<24} pages: {:6} cpus: {:4} entries: {:9} best: {:10.3f} ms {:9.1f} ns/entry {:12.0f} entries/s peak: {}'.format(
+            result['case'], result['pages'], result['cpus'], result['entries'], result['best_ns'] / 1000000,
+            result['ns_per_entry'], result['entries_per_second'], memory)
+
+    @staticmethod
+    def compare(current, baseline, threshold=0.2, memory_threshold=0.2):
+        # Returns the descriptions of the cases that got slower or hungrier than
+        # the baseline by more than the thresholds (fractions, 0.2 is 20%).
+        # Cases missing from either side are ignored.
+        key = lambda result: (result['case'], result['pages'], result['cpus'])
+        baseline_results = {key(result): result for result in baseline['results']}
+        regressions = []
+        for result in current['results']:
+            base = baseline_results.get(key(result))
+            if base is None:
+                continue
+            if result['ns_per_entry'] > base['ns_per_entry'] * (1 + threshold):
+                regressions.append('{} pages: {} cpus: {} latency {:.1f} -> {:.1f} ns/entry (+{:.0%})'.format(
+                    result['case'], result['pages'], result['cpus'], base['ns_per_entry'], result['ns_per_entry'],
+                    result['ns_per_entry'] / base['ns_per_entry'] - 1))
+            if result['peak_memory_bytes'] and base.get('peak_memory_bytes') and result['peak_memory_bytes'] > base['peak_memory_bytes'] * (1 + memory_threshold):
+                regressions.append('{} pages: {} cpus: {} peak memory {} -> {} bytes (+{:.0%})'.format(
+                    result['case'], result['pages'], result['cpus'], base['peak_memory_bytes'], result['peak_memory_bytes'],
+                    result['peak_memory_bytes'] / base['peak_memory_bytes'] - 1))
+        return regressions
+
+
+def _int_list(value, name):
+    try:
+        return [int(x.strip()) for x in value.split(',') if x.strip()]
+    except Exception as err:
+        raise ArgumentError('Error in argument "{}". Details: {}'.format(name, str(err)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the writer, reader and checker hot paths on generated traces. Runs offline: the traces are generated with the simulated tracefs and the writers write to /dev/null.')
+    parser.add_argument("--config-file", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_buffer.ini"), help="Configuration file.")
+    parser.add_argument("--pages", default='1,10,100,1000,10000', help="Sizes of the generated traces in pages. e.g. --pages 1,100")
+    parser.add_argument("--cpus", default='1,16,256', help="Number of CPUs the pages of every trace are spread over. Sizes with fewer pages than CPUs are skipped.")
+    parser.add_argument("--cases", default=','.join(Benchmark.cases), help="Comma separated list of cases to run. Available: {}".format(', '.join(Benchmark.cases)))
+    parser.add_argument("--entries-per-page", type=int, help="Entries per marker page. Defaults to 'marker_entries_per_page' of the configuration file.")
+    parser.add_argument("--write-mode", choices=WriteBuffer.write_modes, default='keep_open', help="Write mode used by the write_entry case and the fixture generation. The write_pages cases use the mode in their name.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per case. The best one is reported.")
+    parser.add_argument("--no-memory", action='store_true', help="Skip the extra tracemalloc run that measures the peak memory of every case.")
+    parser.add_argument("--fixtures-dir", help="Directory where the generated traces are kept and reused. A temporary directory is used by default.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with. Exits with an error when a case regresses.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed per-entry latency increase over the baseline, as a fraction.")
+    parser.add_argument("--memory-threshold", type=float, default=0.2, help="Allowed peak memory increase over the baseline, as a fraction.")
+    return parser.parse_args()
+
+
+def run_benchmarks(args, directory):
+    config = Helpers.get_config(args.config_file)
+    cases = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = [name for name in cases if name not in Benchmark.cases]
+    if unknown:
+        raise ArgumentError('Unknown benchmark cases: {}. Available: {}'.format(', '.join(unknown), ', '.join(Benchmark.cases)))
+    entries_per_page = args.entries_per_page or int(config['marker_entries_per_page'])
+    benchmark = Benchmark(config, entries_per_page, directory, args.write_mode, args.repeat, not args.no_memory)
+    return benchmark.run(_int_list(args.pages, '--pages'), _int_list(args.cpus, '--cpus'), cases,
+                         progress=lambda result: print(Benchmark.format_result(result), flush=True))
+
+
+def main():
+    args = parse_args()
+    if args.fixtures_dir:
+        os.makedirs(args.fixtures_dir, exist_ok=True)
+        results = run_benchmarks(args, args.fixtures_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='ftracebt-bench-') as directory:
+            results = run_benchmarks(args, directory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = Benchmark.compare(results, baseline, args.threshold, args.memory_threshold)
+        if regressions:
+            print('Regressions against {}:\n{}'.format(args.baseline, '\n'.join(regressions)), file=sys.stderr)
+            sys.exit(1)
+        print('No regressions against {}.'.format(args.baseline))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -0,0 +1,258 @@
+import os
+import json
+import math
+import argparse
+from helper import ArgumentError
+from helper import Helpers
+from ftrace import FtraceManager
+from ftrace import WriteBuffer
+from multiwriter import MultiWriter
+from online import OnlineChecker
+from pacing import PacingProfile
+from simtracefs import SimulatedTracefs
+
+
+class CapacityProbe:
+    # One write phase: every CPU of cpus writes at rate entries per second
+    # (flat out when rate is None) while trace_pipe is drained. It fails when
+    # the counters move or when the reader misses marker entries or finds
+    # lines it cannot parse.
+    def __init__(self, cpus, rate, write_report, online_report, counters):
+        self.cpus = cpus
+        self.rate = rate
+        self.write_report = write_report
+        self.online_report = online_report
+        self.counters = counters
+        self.losses = sum(stats[name] for stats in write_report.stats.values() for name in counters)
+        self.reader_losses = online_report.lost() + online_report.unparsed_lines if online_report else 0
+        self.ok = not (self.losses or self.reader_losses)
+
+    def entries_per_second(self):
+        return self.write_report.entries_per_second()
+
+    def as_dict(self):
+        return {
+            'cpus': self.cpus,
+            'rate': self.rate,
+            'entries': self.write_report.nr_entries(),
+            'entries_per_second': self.entries_per_second(),
+            'stats': {str(cpu): stats for cpu, stats in self.write_report.stats.items()},
+            'losses': self.losses,
+            'online_lost': self.online_report.lost() if self.online_report else None,
+            'online_kernel_lost': self.online_report.kernel_lost_events() if self.online_report else None,
+            'online_unparsed_lines': self.online_report.unparsed_lines if self.online_report else None,
+            'ok': self.ok,
+        }
+
+    def __str__(self):
+        return 'CPUs: {:<12} rate: {:>12} entries/s per CPU achieved: {:12.0f} entries/s {}: {:8} reader lost: {:8} {}'.format(
+            ','.join(str(cpu) for cpu in self.cpus), 'flat out' if self.rate is None else '{:.0f}'.format(self.rate),
+            self.entries_per_second(), '+'.join(self.counters), self.losses, self.reader_losses, 'OK' if self.ok else 'OVERFLOW')
+
+
+class CapacityResult:
+    def __init__(self, cpus, best, probes, writer_bound=False):
+        self.cpus = cpus
+        self.best = best
+        self.probes = probes
+        self.writer_bound = writer_bound
+
+    def capacity(self):
+        return self.best.entries_per_second() if self.best else 0.0
+
+    def as_dict(self):
+        return {
+            'cpus': self.cpus,
+            'capacity_entries_per_second': self.capacity(),
+            'rate_per_cpu': self.best.rate if self.best else None,
+            'writer_bound': self.writer_bound,
+            'probes': [probe.as_dict() for probe in self.probes],
+        }
+
+    def __str__(self):
+        if self.best is None:
+            return 'CPUs: {}: no sustainable rate found.'.format(','.join(str(cpu) for cpu in self.cpus))
+        return 'CPUs: {}: {:.0f} entries/s{}'.format(','.join(str(cpu) for cpu in self.cpus), self.capacity(),
+                                                   ' (the writers are the limit)' if self.writer_bound else ' at {:.0f} entries/s per CPU'.format(self.best.rate))
+
+
+class CapacityReport:
+    def __init__(self, results):
+        self.results = results
+
+    def best(self):
+        results = [result for result in self.results if result.best]
+        return max(results, key=CapacityResult.capacity) if results else None
+
+    def as_dict(self):
+        best = self.best()
+        return {
+            'capacity_entries_per_second': best.capacity() if best else 0.0,
+            'cpus': best.cpus if best else None,
+            'results': [result.as_dict() for result in self.results],
+        }
+
+    def __str__(self):
+        best = self.best()
+        lines = [str(result) for result in self.results]
+        lines.append('Capacity: {:.0f} entries/s with {} CPUs.'.format(best.capacity(), len(best.cpus)) if best else 'Capacity: no sustainable rate found.')
+        return '\n'.join(lines)
+
+
+class CapacitySearch:
+    # Finds the highest write rate the ring buffer absorbs with none of the
+    # counters of per_cpu/cpuN/stats moving. A flat out probe comes first:
+    # when it passes the writers, not the buffer, are the limit. Otherwise
+    # the per CPU rate doubles from low until a probe fails and the bracket
+    # is then bisected down to tolerance. CPU counts are tried in order and
+    # the search stops adding CPUs once the capacity stops growing.
+    def __init__(self, config, entries_per_page, duration=0.5, counters=('overrun', 'commit_overrun', 'dropped_events'), reader=True,
+                 per_cpu_pipes=False, write_mode='keep_open', tolerance=0.05, max_probes=12, flat_out_buffers=4):
+        self.config = config
+        self.entries_per_page = entries_per_page
+        self.duration = duration
+        self.counters = list(counters)
+        self.reader = reader
+        self.per_cpu_pipes = per_cpu_pipes
+        self.write_mode = write_mode
+        self.tolerance = tolerance
+        self.max_probes = max_probes
+        self.flat_out_buffers = flat_out_buffers
+        self.manager = FtraceManager(config)
+
+    def reset(self):
+        self.manager.set_tracer('nop')
+        self.manager.clear_buffer()
+        self.manager.set_tracing_on()
+
+    def probe(self, cpus, rate=None):
+        self.reset()
+        if rate is None:
+            nr_pages = self.config['nr_pages_to_fillup_buffer'] * self.flat_out_buffers
+        else:
+            nr_pages = max(1, math.ceil(rate * self.duration / self.entries_per_page))
+        writer = MultiWriter(self.config, self.write_mode, pacing=PacingProfile(rate) if rate else None, stats=True)
+        checker = OnlineChecker(self.config, cpus, self.entries_per_page, per_cpu_pipes=self.per_cpu_pipes) if self.reader else None
+        if checker:
+            checker.start()
+        try:
+            write_report = writer.write_pages(nr_pages, cpus, self.entries_per_page)
+        finally:
+            online_report = checker.stop() if checker else None
+        return CapacityProbe(cpus, rate, write_report, online_report, self.counters)
+
+    def search_rate(self, cpus, low, high, progress=None):
+        probes = []
+        best = None
+        failed = None
+        rate = low
+        while len(probes) < self.max_probes:
+            probe = self.probe(cpus, rate)
+            probes.append(probe)
+            if progress:
+                progress(probe)
+            if not probe.ok:
+                failed = rate
+                break
+            best = probe
+            if rate >= high:
+                break
+            rate = min(rate * 2, high)
+        while failed is not None and len(probes) < self.max_probes:
+            ok_rate = best.rate if best else 0
+            if failed - ok_rate <= self.tolerance * failed:
+                break
+            rate = (ok_rate + failed) / 2
+            probe = self.probe(cpus, rate)
+            probes.append(probe)
+            if progress:
+                progress(probe)
+            if probe.ok:
+                best = probe
+            else:
+                failed = rate
+        return CapacityResult(cpus, best, probes)
+
+    def run(self, cpus, cpu_counts=None, low=1000, progress=None):
+        if cpu_counts is None:
+            cpu_counts = [count for count in (2 ** k for k in range(len(cpus).bit_length())) if count < len(cpus)] + [len(cpus)]
+        results = []
+        for count in cpu_counts:
+            cpu_set = cpus[:count]
+            flat_out = self.probe(cpu_set)
+            if progress:
+                progress(flat_out)
+            if flat_out.ok:
+                result = CapacityResult(cpu_set, flat_out, [flat_out], writer_bound=True)
+            else:
+                high = max(low, flat_out.entries_per_second() / count)
+                result = self.search_rate(cpu_set, low, high, progress)
+                result.probes.insert(0, flat_out)
+            previous = max((r.capacity() for r in results), default=0.0)
+            results.append(result)
+            if results[:-1] and result.capacity() <= previous:
+                break
+        return CapacityReport(results)
+
+
+def _int_list(value, name):
+    try:
+        return [int(x.strip()) for x in value.split(',') if x.strip()]
+    except Exception as err:
+        raise ArgumentError('Error in argument "{}". Details: {}'.format(name, str(err)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Search the highest write rate the ftrace ring buffer sustains without overruns or dropped events.')
+    parser.add_argument("--config-file", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_buffer.ini"), help="Configuration file.")
+    parser.add_argument("--cpus", default='0', help="CPUs the writers may use, in the order they are added, e.g. --cpus 0,1,2,3.")
+    parser.add_argument("--cpu-counts", help="Numbers of writer CPUs to try, e.g. --cpu-counts 1,2,4. Defaults to powers of two up to all of them.")
+    parser.add_argument("--duration", type=float, default=0.5, help="Seconds every paced probe writes for.")
+    parser.add_argument("--low-rate", type=float, default=1000, help="First rate tried, in entries per second per CPU.")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="The search stops when the failing and the passing rates are this close, as a fraction.")
+    parser.add_argument("--max-probes", type=int, default=12, help="Maximum number of paced probes per CPU count.")
+    parser.add_argument("--counters", default='overrun,commit_overrun,dropped_events', help="per_cpu/cpuN/stats counters that must not move.")
+    parser.add_argument("--no-reader", action='store_true', help="Do not drain trace_pipe while writing: the capacity is then the buffer size over the probe duration.")
+    parser.add_argument("--per-cpu-pipes", action='store_true', help="Drain per_cpu/cpuN/trace_pipe instead of trace_pipe.")
+    parser.add_argument("--no-overwrite", action='store_true', help="Switch options/overwrite off during the search, so a full buffer drops events instead of overwriting them.")
+    parser.add_argument("--entries-per-page", type=int, help="Entries per marker page. Defaults to 'marker_entries_per_page' of the configuration file.")
+    parser.add_argument("--write-mode", choices=WriteBuffer.write_modes, default='keep_open', help="How entries reach trace_marker.")
+    parser.add_argument("--backend", choices=['real', 'sim'], default='real', help="'sim' runs the search on the simulated tracefs.")
+    parser.add_argument("--sim-cpus", type=int, default=4, help="Number of CPUs of the simulated tracefs.")
+    parser.add_argument("--output", help="Write every probe and the capacity as JSON to this file.")
+    return parser.parse_args()
+
+
+def run_search(args, config):
+    counters = [name.strip() for name in args.counters.split(',') if name.strip()]
+    entries_per_page = args.entries_per_page or int(config['marker_entries_per_page'])
+    search = CapacitySearch(config, entries_per_page, args.duration, counters, not args.no_reader, args.per_cpu_pipes, args.write_mode,
+                            args.tolerance, args.max_probes)
+    manager = FtraceManager(config)
+    overwrite = manager.get_overwrite()
+    if args.no_overwrite:
+        manager.set_overwrite(False)
+    try:
+        return search.run(_int_list(args.cpus, '--cpus'), _int_list(args.cpu_counts, '--cpu-counts') if args.cpu_counts else None, args.low_rate,
+                          progress=lambda probe: print(probe, flush=True))
+    finally:
+        manager.set_overwrite(overwrite)
+
+
+def main():
+    args = parse_args()
+    config = Helpers.get_config(args.config_file)
+    if args.backend == 'sim':
+        with SimulatedTracefs(config, args.sim_cpus):
+            report = run_search(args, config)
+    else:
+        report = run_search(args, config)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report.as_dict(), f, indent=2)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -0,0 +1,323 @@
+import os
+import re
+import sys
+import json
+import zlib
+import struct
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from ftrace import ReadBuffer
+from ftrace import WriteBuffer
+from records import TraceRecords
+
+
+class CaptureFormatError(Exception):
+    pass
+
+
+class CaptureFormat:
+    # File layout: magic, the compressed chunks one after the other, the
+    # zlib compressed JSON footer (metadata, string table and chunk index),
+    # the footer size as u64 and the magic again. Every chunk holds up to
+    # chunk_size records as one compressed column each, timestamps delta
+    # encoded, so it decodes without touching the others. Marker payloads
+    # are stored as numbers and formatted back on load.
+    magic = b'FTBTCAP1'
+    trailer = struct.Struct('<Q8s')
+    version = 1
+    columns = ['cpus', 'timestamps', 'pids', 'tasks', 'flags', 'kinds', 'prefixes', 'values', 'texts']
+    kind_text = 0
+    kind_entry = 1
+    kind_page_header = 2
+    marker_pattern = re.compile(r'(?P<prefix>.*?)(?:(?P<cpu>[0-9]{3})-(?P<page_id>[0-9]{8})-(?P<entry_nr>[0-9]{3})|' +
+                                re.escape(WriteBuffer.head_entry_beginning) + r'(?P<header_page_id>[0-9]{8}))', re.DOTALL)
+
+    @staticmethod
+    def encode_payload(payload):
+        match = CaptureFormat.marker_pattern.fullmatch(payload)
+        if match is None:
+            return (CaptureFormat.kind_text, None, 0)
+        if match.group('header_page_id') is not None:
+            return (CaptureFormat.kind_page_header, match.group('prefix'), int(match.group('header_page_id')))
+        return (CaptureFormat.kind_entry, match.group('prefix'),
+                int(match.group('cpu')) * 100000000000 + int(match.group('page_id')) * 1000 + int(match.group('entry_nr')))
+
+    @staticmethod
+    def decode_payload(kind, prefix, value):
+        if kind == CaptureFormat.kind_page_header:
+            return prefix + WriteBuffer.generate_page_header_entry(value)
+        cpu, rest = divmod(value, 100000000000)
+        page_id, entry_nr = divmod(rest, 1000)
+        return prefix + WriteBuffer.generate_entry(cpu, page_id, entry_nr)
+
+
+class CaptureWriter:
+    # Streams records into a capture file: records are buffered until a
+    # chunk is full and the index is written by close().
+    def __init__(self, filename, header=(), metadata=None, chunk_size=4096, level=6):
+        self.filename = filename
+        self.header = list(header)
+        self.metadata = metadata or {}
+        self.chunk_size = chunk_size
+        self.level = level
+        self.strings = []
+        self.string_ids = {}
+        self.chunks = []
+        self.nr_records = 0
+        self.nr_annotations = 0
+        self.pending = TraceRecords()
+        self.f = open(filename, 'wb')
+        self.f.write(CaptureFormat.magic)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _string_id(self, s):
+        string_id = self.string_ids.get(s)
+        if string_id is None:
+            string_id = self.string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return string_id
+
+    def append(self, task, pid, cpu, flags, timestamp, payload, frac_digits=6):
+        self.pending.append(task, pid, cpu, flags, timestamp, payload, frac_digits)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def extend(self, records):
+        self.flush()
+        self.nr_annotations += records.nr_annotations
+        for begin in range(0, len(records), self.chunk_size):
+            self._write_chunk(records, begin, min(begin + self.chunk_size, len(records)))
+
+    def flush(self):
+        if len(self.pending):
+            self._write_chunk(self.pending, 0, len(self.pending))
+            self.pending = TraceRecords()
+
+    def _write_chunk(self, records, begin, end):
+        timestamps = records.timestamps[begin:end]
+        deltas = array('q', [timestamps[0]])
+        deltas.extend(timestamps[k] - timestamps[k - 1] for k in range(1, len(timestamps)))
+        kinds = array('b')
+        prefixes = array('q')
+        values = array('q')
+        texts = []
+        for payload in records.payloads[begin:end]:
+            kind, prefix, value = CaptureFormat.encode_payload(payload)
+            kinds.append(kind)
+            if kind == CaptureFormat.kind_text:
+                prefixes.append(-1)
+                texts.append(payload)
+            else:
+                prefixes.append(self._string_id(prefix))
+            values.append(value)
+        cpus = records.cpus[begin:end]
+        columns = [cpus, deltas, records.pids[begin:end],
+                   array('q', [self._string_id(task) for task in records.tasks[begin:end]]),
+                   array('q', [self._string_id(flags) for flags in records.flags[begin:end]]),
+                   kinds, prefixes, values]
+        data = [zlib.compress(column.tobytes(), self.level) for column in columns]
+        data.append(zlib.compress('\n'.join(texts).encode(), self.level))
+        cpu_counts = {}
+        for cpu in cpus:
+            cpu_counts[cpu] = cpu_counts.get(cpu, 0) + 1
+        # The timestamps of a trace file share their precision, the one of
+        # the first record stands for the chunk.
+        self.chunks.append({'offset': self.f.tell(), 'sizes': [len(column) for column in data], 'first': self.nr_records, 'nr': end - begin,
+                            'min_ts': min(timestamps), 'max_ts': max(timestamps), 'cpus': {str(cpu): n for cpu, n in sorted(cpu_counts.items())},
+                            'frac_digits': records.frac_digits[begin]})
+        for column in data:
+            self.f.write(column)
+        self.nr_records += end - begin
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush()
+        footer = {'version': CaptureFormat.version, 'byteorder': sys.byteorder, 'columns': CaptureFormat.columns,
+                  'nr_records': self.nr_records, 'nr_annotations': self.nr_annotations, 'header': self.header,
+                  'metadata': self.metadata, 'strings': self.strings, 'chunks': self.chunks}
+        data = zlib.compress(json.dumps(footer).encode(), self.level)
+        self.f.write(data)
+        self.f.write(CaptureFormat.trailer.pack(len(data), CaptureFormat.magic))
+        self.f.close()
+        self.f = None
+
+
+class TraceCapture:
+    # Read side of a capture. Only the footer is read when opening it, the
+    # chunks are decoded on demand and the index (record range, timestamp
+    # range and records per CPU of every chunk) tells which ones a query
+    # needs.
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        try:
+            self._read_footer()
+        except Exception:
+            self.f.close()
+            raise
+        self.cached = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def __len__(self):
+        return self.nr_records
+
+    def _read_footer(self):
+        if self.f.read(len(CaptureFormat.magic)) != CaptureFormat.magic:
+            raise CaptureFormatError('"{}" is not a trace capture.'.format(self.filename))
+        self.f.seek(-CaptureFormat.trailer.size, os.SEEK_END)
+        size, magic = CaptureFormat.trailer.unpack(self.f.read(CaptureFormat.trailer.size))
+        if magic != CaptureFormat.magic:
+            raise CaptureFormatError('"{}" is truncated: the capture index is missing.'.format(self.filename))
+        self.f.seek(-CaptureFormat.trailer.size - size, os.SEEK_END)
+        footer = json.loads(zlib.decompress(self.f.read(size)))
+        if footer['version'] != CaptureFormat.version:
+            raise CaptureFormatError('"{}": unsupported capture version {}.'.format(self.filename, footer['version']))
+        self.byteswap = footer['byteorder'] != sys.byteorder
+        self.nr_records = footer['nr_records']
+        self.nr_annotations = footer['nr_annotations']
+        self.header = footer['header']
+        self.metadata = footer['metadata']
+        self.strings = footer['strings']
+        self.chunks = footer['chunks']
+        self.chunk_firsts = [chunk['first'] for chunk in self.chunks]
+
+    def cpus(self):
+        counts = {}
+        for chunk in self.chunks:
+            for cpu, n in chunk['cpus'].items():
+                counts[int(cpu)] = counts.get(int(cpu), 0) + n
+        return counts
+
+    def time_range(self):
+        if not self.chunks:
+            return (None, None)
+        return (min(chunk['min_ts'] for chunk in self.chunks), max(chunk['max_ts'] for chunk in self.chunks))
+
+    def _column(self, typecode, data):
+        column = array(typecode)
+        column.frombytes(zlib.decompress(data))
+        if self.byteswap:
+            column.byteswap()
+        return column
+
+    def chunk(self, chunk_nr):
+        # Records of one chunk. The last decoded chunk is kept for the
+        # random accesses that hit the same chunk again.
+        if self.cached[0] == chunk_nr:
+            return self.cached[1]
+        chunk = self.chunks[chunk_nr]
+        self.f.seek(chunk['offset'])
+        data = self.f.read(sum(chunk['sizes']))
+        parts = []
+        offset = 0
+        for size in chunk['sizes']:
+            parts.append(data[offset:offset + size])
+            offset += size
+        cpus, deltas, pids, tasks, flags, kinds, prefixes, values = [self._column('b' if name == 'kinds' else 'q', part)
+                                                                      for name, part in zip(CaptureFormat.columns[:-1], parts)]
+        texts = iter(zlib.decompress(parts[-1]).decode().split('\n'))
+        strings = self.strings
+        records = TraceRecords()
+        records.cpus = cpus
+        records.pids = pids
+        records.timestamps = array('q', accumulate(deltas))
+        records.tasks = [strings[task] for task in tasks]
+        records.flags = [strings[flag] for flag in flags]
+        records.payloads = [next(texts) if kind == CaptureFormat.kind_text else CaptureFormat.decode_payload(kind, strings[prefix], value)
+                            for kind, prefix, value in zip(kinds, prefixes, values)]
+        records.frac_digits = array('b', [chunk.get('frac_digits', 6)]) * len(records.payloads)
+        self.cached = (chunk_nr, records)
+        return records
+
+    def chunk_of(self, i):
+        if not 0 <= i < self.nr_records:
+            raise IndexError('Record {} out of range. The capture has {} records.'.format(i, self.nr_records))
+        return bisect_right(self.chunk_firsts, i) - 1
+
+    def line(self, i):
+        chunk_nr = self.chunk_of(i)
+        return self.chunk(chunk_nr).line(i - self.chunks[chunk_nr]['first'])
+
+    def _selected_chunks(self, cpus, start_ns, end_ns):
+        cpu_keys = None if cpus is None else [str(cpu) for cpu in cpus]
+        for chunk_nr, chunk in enumerate(self.chunks):
+            if start_ns is not None and chunk['max_ts'] < start_ns:
+                continue
+            if end_ns is not None and chunk['min_ts'] >= end_ns:
+                continue
+            if cpu_keys is not None and not any(cpu in chunk['cpus'] for cpu in cpu_keys):
+                continue
+            yield chunk_nr
+
+    def records(self, cpus=None, start_ns=None, end_ns=None):
+        # All the records, or the ones of some CPUs and/or with start_ns <=
+        # timestamp < end_ns, in capture order.
+        records = TraceRecords()
+        records.nr_annotations = self.nr_annotations
+        everything = cpus is None and start_ns is None and end_ns is None
+        for chunk_nr in self._selected_chunks(cpus, start_ns, end_ns):
+            chunk = self.chunk(chunk_nr)
+            if everything:
+                records.tasks.extend(chunk.tasks)
+                records.pids.extend(chunk.pids)
+                records.cpus.extend(chunk.cpus)
+                records.flags.extend(chunk.flags)
+                records.timestamps.extend(chunk.timestamps)
+                records.payloads.extend(chunk.payloads)
+                records.frac_digits.extend(chunk.frac_digits)
+                continue
+            for k in range(len(chunk)):
+                if (cpus is None or chunk.cpus[k] in cpus) and (start_ns is None or chunk.timestamps[k] >= start_ns) and (end_ns is None or chunk.timestamps[k] < end_ns):
+                    records.append(chunk.tasks[k], chunk.pids[k], chunk.cpus[k], chunk.flags[k], chunk.timestamps[k], chunk.payloads[k], chunk.frac_digits[k])
+        return records
+
+    def iter_lines(self):
+        # The trace file again: the header as read and the records formatted
+        # like the kernel does. Annotations are not kept.
+        yield from self.header
+        for chunk_nr in range(len(self.chunks)):
+            chunk = self.chunk(chunk_nr)
+            for k in range(len(chunk)):
+                yield chunk.line(k) + '\n'
+
+    def __str__(self):
+        first_ts, last_ts = self.time_range()
+        lines = ['Capture: {} Source: {} Records: {} Chunks: {} Annotations: {}'.format(
+            self.filename, self.metadata.get('source'), self.nr_records, len(self.chunks), self.nr_annotations)]
+        if first_ts is not None:
+            lines.append('Timestamps: {} .. {} ns'.format(first_ts, last_ts))
+        lines.append('Records per CPU: {}'.format(', '.join('{}: {}'.format(cpu, n) for cpu, n in sorted(self.cpus().items()))))
+        if 'check' in self.metadata:
+            lines.append('Check: {}'.format(json.dumps(self.metadata['check'], sort_keys=True)))
+        return '\n'.join(lines)
+
+
+def save(filename, records, header=(), metadata=None, chunk_size=4096):
+    with CaptureWriter(filename, header, metadata, chunk_size) as writer:
+        writer.extend(records)
+
+
+def read_and_save(config, trace_filename, filename, metadata=None, read_size=65536):
+    # Reads trace_filename like ReadBuffer.get_records() does and saves what
+    # was read, the buffer header included, before any check runs.
+    header = []
+    records = ReadBuffer(config, read_size).get_records(trace_filename, header)
+    metadata = dict(metadata or {})
+    metadata.update({'source': trace_filename, 'config': config})
+    save(filename, records, header, metadata)
+    return records
@@ -1,17 +1,47 @@
+import os
+import time
 import pytest
+import itertools
 import pathlib
+import analytics
 from helper import ArgumentError
 from helper import Helpers
 from ftrace import FtraceManager
 from ftrace import ReadBuffer
 from ftrace import WriteBuffer
 from ftrace import Check
+from ftrace import VerifyMode
+from multiwriter import MultiWriter
+from parallelcheck import ParallelCheck
+from pacing import PacingProfile
+from profiling import SpanReport
+from profiling import Spans
+from sampler import CounterSampler
+from simtracefs import SimulatedTracefs
+
+
+def _pytest_has_option(parser, name):
+    try:
+        return any(name in option.names() for group in parser._groups for option in group.options)
+    except AttributeError:
+        return False
 
 
 def pytest_addoption(parser):
-    parser.addoption("--config-file",
-                     default="test_buffer.ini",
-                     help="Configuration file.")
+    # Newer pytest versions own "--config-file" (an alias of "-c"). There the
+    # value ends up in "inifilename" and "--ftrace-config-file" is the
+    # unambiguous spelling.
+    config_file_names = ["--ftrace-config-file"]
+    if not _pytest_has_option(parser, "--config-file"):
+        config_file_names.append("--config-file")
+    parser.addoption(*config_file_names,
+                     dest="ftrace_config_file",
+                     default=None,
+                     help="Configuration file. Defaults to test_buffer.ini.")
+    parser.addoption("--backend",
+                     choices=['real', 'sim'],
+                     default='real',
+                     help="Tracefs backend. 'real' uses the kernel's tracing files, 'sim' an in-memory simulated ring buffer that needs neither root nor a patched kernel.")
     parser.addoption("--default-cpu",
                      type=int,
                      default=0,
@@ -20,17 +50,133 @@ def pytest_addoption(parser):
                      type=int,
                      default=0,
                      help="Max amount of microsecods to wait between the writting of entries in a CPU buffer.")
+    parser.addoption("--writes-rate",
+                     type=float,
+                     default=0,
+                     help="Target entries per second for every writer. When set the writes are paced with perf_counter_ns deadlines instead of --max-writes-delay.")
+    parser.addoption("--writes-burst",
+                     default='',
+                     help="Burst profile of the paced writers as 'on_ms,off_ms'. e.g. --writes-burst 5,20")
+    parser.addoption("--writes-ramp-ms",
+                     type=float,
+                     default=0,
+                     help="Milliseconds the paced writers take to ramp up to --writes-rate.")
+    parser.addoption("--writes-jitter",
+                     choices=PacingProfile.jitter_distributions,
+                     default='none',
+                     help="Distribution of the jitter applied to the paced writes.")
+    parser.addoption("--writes-jitter-us",
+                     type=float,
+                     default=0,
+                     help="Jitter width (uniform) or standard deviation (normal) in microseconds.")
+    parser.addoption("--writes-seed",
+                     type=int,
+                     default=0,
+                     help="Seed of the pacing jitter.")
+    parser.addoption("--write-mode",
+                     choices=WriteBuffer.write_modes,
+                     default='keep_open',
+                     help="How the writers send entries to trace_marker: 'reopen', 'keep_open' or 'batched'.")
+    parser.addoption("--writer-engine",
+                     choices=['inprocess', 'popen'],
+                     default=None,
+                     help="How the multiple CPUs tests start their writers: 'inprocess' forks one pinned worker per CPU released by a shared barrier, 'popen' runs the 'writer_command' for each CPU. Defaults to 'popen', or to 'inprocess' with '--backend sim', whose buffer the writer processes can't see.")
+    parser.addoption("--fail-fast-checks",
+                     action='store_true',
+                     help="Stop checking the marker pages at the first problem instead of reporting every missing, torn, out of sequence page and extra entry.")
+    parser.addoption("--verify-mode",
+                     choices=VerifyMode.modes,
+                     default='full',
+                     help="How the marker pages are verified. 'full' compares every line, 'tiered' checks the header, the number of entries and a CRC32 of every page and only compares line by line the pages that do not match and a random sample of the ones that do.")
+    parser.addoption("--verify-sample",
+                     type=float,
+                     default=0.01,
+                     help="Fraction of the pages that match their hash that '--verify-mode tiered' still compares line by line.")
+    parser.addoption("--verify-seed",
+                     type=int,
+                     default=0,
+                     help="Seed of the pages sampled by '--verify-mode tiered'.")
+    parser.addoption("--check-workers",
+                     type=int,
+                     default=1,
+                     help="Number of forked workers that read and check the trace files and the per-CPU streams in parallel. 0 uses one worker per available CPU.")
+    parser.addoption("--soak-seconds",
+                     type=float,
+                     default=0,
+                     help="Run the online soak test for this many seconds: the writers keep going while trace_pipe is drained and verified. 0 skips it.")
+    parser.addoption("--soak-per-cpu-pipes",
+                     action='store_true',
+                     help="Make the soak test read per_cpu/cpuN/trace_pipe instead of trace_pipe.")
+    parser.addoption("--sample-counters-us",
+                     type=float,
+                     default=0,
+                     help="Sample nr_readable_pages, commit_page_nr_entries and commit_page_commit of the CPUs in use every this many microseconds during each test. 0 disables the sampler.")
+    parser.addoption("--sample-counters-dir",
+                     default='counters',
+                     help="Directory where the counter samples of every test are exported, one CSV file per test.")
+    parser.addoption("--timestamp-analytics",
+                     action='store_true',
+                     help="Print ordering, inter-entry gap and page commit time figures per CPU after the multiple CPUs checks. Needs NumPy.")
+    parser.addoption("--capture-dir",
+                     default=None,
+                     help="Save every trace file the checks read to this directory as a compressed capture, one per file and check, named after the test. Replay them with replay.py.")
+    parser.addoption("--ftrace-instances",
+                     action='store_true',
+                     help="Run every test on an ftrace instance of its own, instances/<name> of the tracing directory, created before the test and removed after it. The tests then share no buffer and can run in parallel, e.g. with pytest-xdist.")
+    parser.addoption("--profile-spans",
+                     action='store_true',
+                     help="Time the write, read and check phases of every test and print a per phase breakdown at the end of the run.")
+    parser.addoption("--profile-spans-output",
+                     default=None,
+                     help="Export the phases of every test measured with '--profile-spans' to this JSON file.")
     parser.addoption("--cpus-to-use",
                      default='0',
                      help="List of cpus numbers that the test will use to write in their ftrace's buffer. e.g. --cpu 0,1,3,5")
 
+span_report_key = pytest.StashKey()
+instance_numbers = itertools.count(1)
+
+
+def pytest_configure(config):
+    if config.getoption("--profile-spans"):
+        Spans.enable()
+        config.stash[span_report_key] = SpanReport()
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    # Setup, call and teardown of a test, so the spans of its fixtures
+    # (e.g. reset_rb) are included.
+    report = item.config.stash.get(span_report_key, None)
+    if report is None:
+        yield
+        return
+    Spans.reset()
+    start = time.perf_counter_ns()
+    yield
+    report.add(item.nodeid, time.perf_counter_ns() - start, *Spans.take())
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    report = config.stash.get(span_report_key, None)
+    if report is None:
+        return
+    terminalreporter.section('profiling spans')
+    for line in report.summary_lines():
+        terminalreporter.write_line(line)
+    output = config.getoption("--profile-spans-output")
+    if output:
+        report.export(output)
+        terminalreporter.write_line('Phases of every test exported to {}'.format(output))
+
+
 @pytest.fixture(scope='session')
 def cwd(request):
     return pathlib.Path(__file__).parent
 
 @pytest.fixture(scope='session')
 def config_filename(request):
-    return request.config.getoption("--config-file")
+    return request.config.getoption("ftrace_config_file") or request.config.getoption("inifilename", None) or "test_buffer.ini"
 
 
 @pytest.fixture(scope='session')
@@ -43,6 +189,72 @@ def max_writes_delay(request):
     return request.config.getoption("--max-writes-delay")
 
 
+@pytest.fixture(scope='session')
+def pacing_profile(request):
+    rate = request.config.getoption("--writes-rate")
+    if not rate:
+        return None
+    try:
+        burst = [float(x.strip()) for x in request.config.getoption("--writes-burst").split(',') if x.strip()] or [0, 0]
+        burst_on_ms, burst_off_ms = burst
+    except Exception as err:
+        raise ArgumentError('Error in argument "--writes-burst". Details: {}'.format(str(err)))
+    return PacingProfile(rate, burst_on_ms, burst_off_ms, request.config.getoption("--writes-ramp-ms"), 0,
+                         request.config.getoption("--writes-jitter"), request.config.getoption("--writes-jitter-us"),
+                         request.config.getoption("--writes-seed"))
+
+
+@pytest.fixture(scope='session')
+def write_mode(request):
+    return request.config.getoption("--write-mode")
+
+
+@pytest.fixture(scope='session')
+def writer_engine(request, tracefs_backend):
+    writer_engine = request.config.getoption("--writer-engine")
+    if writer_engine is None:
+        writer_engine = 'popen' if tracefs_backend.shared_across_processes else 'inprocess'
+    if writer_engine == 'popen' and not tracefs_backend.shared_across_processes:
+        raise ArgumentError('The "popen" writer engine needs a tracefs backend shared across processes. Use "--writer-engine inprocess".')
+    return writer_engine
+
+
+@pytest.fixture(scope='session')
+def fail_fast_checks(request):
+    return request.config.getoption("--fail-fast-checks")
+
+
+@pytest.fixture(scope='session')
+def check_workers(request):
+    check_workers = request.config.getoption("--check-workers")
+    if check_workers < 0:
+        raise ArgumentError('Error in argument "--check-workers". It must be 0 or a positive number: {}'.format(check_workers))
+    return check_workers
+
+
+@pytest.fixture(scope='session')
+def verify_mode(request):
+    return VerifyMode(request.config.getoption("--verify-mode"), request.config.getoption("--verify-sample"), request.config.getoption("--verify-seed"))
+
+
+@pytest.fixture(scope='session')
+def soak_seconds(request):
+    return request.config.getoption("--soak-seconds")
+
+
+@pytest.fixture(scope='session')
+def soak_per_cpu_pipes(request):
+    return request.config.getoption("--soak-per-cpu-pipes")
+
+
+@pytest.fixture(scope='session')
+def timestamp_analytics(request):
+    timestamp_analytics = request.config.getoption("--timestamp-analytics")
+    if timestamp_analytics and not analytics.available():
+        raise ArgumentError('"--timestamp-analytics" needs NumPy. Install it with "pip install numpy".')
+    return timestamp_analytics
+
+
 @pytest.fixture(scope='session')
 def cpus_to_use(request):
     try:
@@ -52,30 +264,106 @@ def cpus_to_use(request):
 
 
 @pytest.fixture(scope='session')
-def config(config_filename):
-    return Helpers.get_config(config_filename)
+def tracefs_backend(request, config_filename, default_cpu, cpus_to_use):
+    if request.config.getoption("--backend") == 'real':
+        yield Helpers.backend
+        return
+    nr_cpus = max([default_cpu] + cpus_to_use) + 1
+    with SimulatedTracefs(Helpers.get_config(config_filename), max(nr_cpus, 4), default_cpu) as backend:
+        yield backend
 
 
-@pytest.fixture(scope='session')
-def writebuffer(config):
-    return WriteBuffer(config)
+@pytest.fixture(autouse=True)
+def counter_sampler(request):
+    interval_us = request.config.getoption("--sample-counters-us")
+    if not interval_us:
+        yield None
+        return
+    cpus = sorted(set(request.getfixturevalue('cpus_to_use') + [request.getfixturevalue('default_cpu')]))
+    sampler = CounterSampler(request.getfixturevalue('config'), cpus, interval_us / 1000000)
+    with sampler:
+        yield sampler
+    directory = pathlib.Path(request.config.getoption("--sample-counters-dir"))
+    directory.mkdir(parents=True, exist_ok=True)
+    sampler.export(str(directory / '{}.csv'.format(request.node.nodeid.replace('/', '_').replace('::', '.'))))
+
+
+@pytest.fixture(autouse=True)
+def capture_name(request):
+    if not request.config.getoption("--capture-dir"):
+        yield None
+        return
+    name = request.node.nodeid.replace('/', '_').replace('::', '.')
+    request.getfixturevalue('parallelcheck').set_capture_name(name)
+    yield name
+
+
+@pytest.fixture
+def sim_config(cwd):
+    # Configuration of the unit tests, which run on the sim fixture.
+    return Helpers.get_config(str(cwd / 'test_buffer.ini'))
+
+
+@pytest.fixture
+def sim(request, sim_config):
+    # A simulated tracefs of 2 CPUs. Tests needing more ask for them with an
+    # indirect parameter: @pytest.mark.parametrize('sim', [4], indirect=True)
+    with SimulatedTracefs(sim_config, getattr(request, 'param', 2)) as sim:
+        yield sim
 
 
 @pytest.fixture(scope='session')
+def global_config(config_filename, tracefs_backend):
+    return Helpers.get_config(config_filename)
+
+
+@pytest.fixture
+def ftrace_instance(request, global_config):
+    if not request.config.getoption("--ftrace-instances"):
+        yield None
+        return
+    # The pid keeps the names of parallel workers apart.
+    name = 'ftracebt-{}-{}'.format(os.getpid(), next(instance_numbers))
+    with FtraceManager(global_config).create_instance(name) as instance:
+        yield instance
+
+
+@pytest.fixture
+def config(global_config, ftrace_instance):
+    return ftrace_instance.config if ftrace_instance else global_config
+
+
+@pytest.fixture
+def writebuffer(config, write_mode):
+    with WriteBuffer(config, write_mode) as writebuffer:
+        yield writebuffer
+
+
+@pytest.fixture
+def multiwriter(config, write_mode, pacing_profile):
+    return MultiWriter(config, write_mode, pacing=pacing_profile)
+
+
+@pytest.fixture
 def buffercheck(config):
     return Check
 
 
-@pytest.fixture(scope='session')
+@pytest.fixture
+def parallelcheck(request, config, check_workers, verify_mode):
+    return ParallelCheck(config, check_workers, capture_dir=request.config.getoption("--capture-dir"), verify_mode=verify_mode)
+
+
+@pytest.fixture
 def readbuffer(config):
     return ReadBuffer(config)
 
 
-@pytest.fixture(scope='session')
+@pytest.fixture
 def ftrace_manager(config):
     return FtraceManager(config)
 
 
-@pytest.fixture(scope='session')
+@pytest.fixture
 def marker_entries_per_page(config):
     return int(config['marker_entries_per_page'])
@@ -0,0 +1,119 @@
+import sys
+import zlib
+import threading
+from array import array
+from collections import OrderedDict
+
+
+class EntryBlock:
+    # The marker entries of pages first_page_id .. first_page_id + nr_pages - 1
+    # of one CPU. They are formatted once and kept both as one contiguous
+    # bytes buffer with the offsets of every entry (for the writers) and as
+    # str objects (for the checkers). The CRC32 of every page is computed
+    # the first time it is asked for with a given payload prefix.
+    def __init__(self, cpu, first_page_id, nr_pages, entries_per_page, strings):
+        self.cpu = cpu
+        self.first_page_id = first_page_id
+        self.nr_pages = nr_pages
+        self.entries_per_page = entries_per_page
+        self.strings = strings
+        self.data = ''.join(strings).encode()
+        self.offsets = array('q', [0])
+        for s in strings:
+            self.offsets.append(self.offsets[-1] + len(s))
+        self.view = memoryview(self.data)
+        self.hashes = {}
+        self.nbytes = len(self.data) + self.offsets.itemsize * len(self.offsets) + sum(sys.getsizeof(s) for s in strings)
+
+    def index(self, page_id, entry_nr=0):
+        return (page_id - self.first_page_id) * self.entries_per_page + entry_nr
+
+    @staticmethod
+    def page_hash(payloads):
+        # payloads of one page, as they are in the trace.
+        return zlib.crc32('\n'.join(payloads).encode())
+
+    def page_hashes(self, prefix):
+        hashes = self.hashes.get(prefix)
+        if hashes is None:
+            epp = self.entries_per_page
+            hashes = array('I', (EntryBlock.page_hash([prefix + s for s in self.strings[k:k + epp]]) for k in range(0, len(self.strings), epp)))
+            self.hashes[prefix] = hashes
+        return hashes
+
+    def buffers(self, begin, end):
+        view = self.view
+        offsets = self.offsets
+        for i in range(begin, end):
+            yield view[offsets[i]:offsets[i + 1]]
+
+
+class ExpectedEntryCache:
+    # format_page(cpu, page_id, entries_per_page) gives the entries of a page.
+    # Blocks are aligned to pages_per_block pages, so any page range maps to a
+    # few blocks found with a dict lookup. The least recently used blocks are
+    # dropped once the cache holds more than max_bytes.
+    def __init__(self, format_page, pages_per_block=16, max_bytes=32 * 1024 * 1024):
+        self.format_page = format_page
+        self.pages_per_block = pages_per_block
+        self.max_bytes = max_bytes
+        self.blocks = OrderedDict()
+        self.nr_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def after_fork(self):
+        # The child of a fork only has the thread that forked, the lock may
+        # be held by a thread that is not there to release it.
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.nr_bytes = 0
+
+    def block(self, cpu, page_id, entries_per_page):
+        first_page_id = (page_id - 1) // self.pages_per_block * self.pages_per_block + 1
+        key = (cpu, first_page_id, self.pages_per_block, entries_per_page)
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+        strings = [entry for page_id in range(first_page_id, first_page_id + self.pages_per_block)
+                   for entry in self.format_page(cpu, page_id, entries_per_page)]
+        block = EntryBlock(cpu, first_page_id, self.pages_per_block, entries_per_page, strings)
+        with self.lock:
+            if key not in self.blocks:
+                self.blocks[key] = block
+                self.nr_bytes += block.nbytes
+                while self.nr_bytes > self.max_bytes and len(self.blocks) > 1:
+                    _, evicted = self.blocks.popitem(last=False)
+                    self.nr_bytes -= evicted.nbytes
+        return block
+
+    def ranges(self, cpu, first_page_id, nr_pages, entries_per_page):
+        # (block, begin, end) entry index ranges that cover the pages in order.
+        page_id = first_page_id
+        last_page_id = first_page_id + nr_pages - 1
+        while page_id <= last_page_id:
+            block = self.block(cpu, page_id, entries_per_page)
+            block_last_page_id = min(block.first_page_id + block.nr_pages - 1, last_page_id)
+            yield (block, block.index(page_id), block.index(block_last_page_id + 1))
+            page_id = block_last_page_id + 1
+
+    def buffers(self, cpu, first_page_id, nr_pages, entries_per_page):
+        for block, begin, end in self.ranges(cpu, first_page_id, nr_pages, entries_per_page):
+            yield from block.buffers(begin, end)
+
+    def page_strings(self, cpu, page_id, entries_per_page):
+        block = self.block(cpu, page_id, entries_per_page)
+        begin = block.index(page_id)
+        return block.strings[begin:begin + entries_per_page]
+
+    def page_hash(self, cpu, page_id, entries_per_page, prefix):
+        block = self.block(cpu, page_id, entries_per_page)
+        return block.page_hashes(prefix)[page_id - block.first_page_id]
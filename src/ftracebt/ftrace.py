@@ -1,16 +1,43 @@
+import os
 import time
 import random
+import analytics
+from array import array
+from contextlib import closing
+from itertools import chain
+from itertools import islice
+from entrycache import EntryBlock
+from entrycache import ExpectedEntryCache
+from helper import ArgumentError
+from helper import FileWriteError
 from helper import Helpers
+from profiling import Spans
+from records import TraceRecords
+from tracediff import TraceDiff
 
 
 class ParsingBufferHeadError(Exception):
     pass
 
 
+class ParsingStatsError(Exception):
+    pass
+
+
 class CheckingMarkerPagesError(Exception):
     pass
 
 
+class MarkerPagesReportError(CheckingMarkerPagesError):
+    def __init__(self, reports):
+        super().__init__(' '.join(str(report) for report in reports))
+        self.reports = reports
+
+
+class UnexpectedCpuEntriesError(Exception):
+    pass
+
+
 class CheckingEntriesOrderError(Exception):
     pass
 
@@ -19,7 +46,13 @@ class CompareTraceFiles(Exception):
     pass
 
 
+class FtraceInstanceError(Exception):
+    pass
+
+
 class BufferInternals:
+    stats_counters = ['overrun', 'commit_overrun', 'dropped_events', 'read_events']
+
     def __init__(self, config):
         self.config = config
 
@@ -42,6 +75,34 @@ class BufferInternals:
             'commit_page_commit': self.get_commit_page_commit(cpu)
         }
 
+    def get_stats(self, cpu):
+        # per_cpu/cpuN/stats as a dict: 'entries', 'overrun', 'commit_overrun',
+        # 'bytes', 'dropped_events', 'read_events' and the two timestamps in
+        # seconds, 'oldest_event_ts' and 'now_ts'.
+        filename = self.config['per_cpu_stats_file'].format(cpu)
+        stats = {}
+        with Helpers.backend.open_text(filename) as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                value = value.strip()
+                if not value:
+                    continue
+                try:
+                    stats[name.strip().replace(' ', '_')] = float(value) if '.' in value else int(value)
+                except ValueError:
+                    raise ParsingStatsError('Error while parsing "{}". Line: {}'.format(filename, line))
+        return stats
+
+    def snapshot_stats(self, cpus):
+        return {cpu: self.get_stats(cpu) for cpu in cpus}
+
+    @staticmethod
+    def diff_stats(before, after):
+        # Per CPU change of the counters between two snapshots. 'entries' and
+        # 'bytes' are levels, not counters, so they are left out.
+        return {cpu: {name: after[cpu][name] - value for name, value in stats.items() if name in BufferInternals.stats_counters}
+                for cpu, stats in before.items()}
+
     def print_info(self, cpu):
         info = self.get_info(cpu)
         print('CPU#: {:03}\tnr_readable_pages: {:13}'.format(
@@ -52,10 +113,90 @@ class BufferInternals:
             cpu, info['commit_page_commit']))
 
 
+class StatsPhase:
+    # Snapshots per_cpu/cpuN/stats of some CPUs when entered and again when
+    # left, e.g. around a write phase.
+    def __init__(self, config, cpus):
+        self.internals = BufferInternals(config)
+        self.cpus = cpus
+        self.before = None
+        self.after = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.before = self.internals.snapshot_stats(self.cpus)
+
+    def stop(self):
+        self.after = self.internals.snapshot_stats(self.cpus)
+
+    def delta(self):
+        return BufferInternals.diff_stats(self.before, self.after)
+
+    def total(self, name):
+        return sum(stats[name] for stats in self.delta().values())
+
+
+class MarkerFile:
+    # trace_marker only implements write(), so a writev() is split by the VFS
+    # into one write() per iovec: every buffer still becomes its own entry.
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            self.handle = Helpers.backend.open_marker(filename)
+        except Exception as err:
+            raise FileWriteError(filename, 'a', '', err)
+
+    def write(self, data):
+        try:
+            return self.handle.write(data)
+        except Exception as err:
+            raise FileWriteError(self.filename, 'a', bytes(data), err)
+
+    def writev(self, buffers):
+        try:
+            return self.handle.writev(buffers)
+        except Exception as err:
+            raise FileWriteError(self.filename, 'a', b''.join(buffers), err)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
 class WriteBuffer:
     head_entry_beginning = 'CPU#-PAGE_ID#-ENTRY#              PAGE_ID:'
-    def __init__(self, config):
+    write_modes = ['reopen', 'keep_open', 'batched']
+
+    def __init__(self, config, write_mode='keep_open', batch_size=None):
+        if write_mode not in WriteBuffer.write_modes:
+            raise ArgumentError('Unknown write mode: "{}". Valid modes: {}'.format(write_mode, ', '.join(WriteBuffer.write_modes)))
         self.config = config
+        self.write_mode = write_mode
+        self.batch_size = batch_size or os.sysconf('SC_IOV_MAX')
+        self.marker = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if self.marker is None:
+            self.marker = MarkerFile(self.config['marker_file'])
+        return self.marker
+
+    def close(self):
+        if self.marker is not None:
+            self.marker.close()
+            self.marker = None
 
     @staticmethod
     def generate_entry(cpu, page_id, entry_nr):
@@ -65,108 +206,488 @@ class WriteBuffer:
     def generate_page_header_entry(page_id):
         return '{}{:08}'.format(WriteBuffer.head_entry_beginning, page_id)
 
+    @staticmethod
+    def generate_page_entries(cpu, page_id, entries_per_page):
+        yield WriteBuffer.generate_page_header_entry(page_id)
+        for entry_nr in range(1, entries_per_page):
+            yield WriteBuffer.generate_entry(cpu, page_id, entry_nr)
+
     def write_string(self, s):
-        filename = self.config['marker_file']
-        return Helpers.append2file(filename, s)
+        if self.write_mode == 'reopen':
+            filename = self.config['marker_file']
+            return Helpers.append2file(filename, s)
+        return self.open().write(s.encode())
+
+    def write_bytes(self, data):
+        if self.write_mode == 'reopen':
+            return self.write_string(str(data, 'ascii'))
+        return self.open().write(data)
+
+    def write_strings(self, strings, pacer=None):
+        return self.write_buffers((s.encode() for s in strings), pacer=pacer)
+
+    @Spans.span('write')
+    def write_buffers(self, buffers, entries_per_page=0, delay=0, pacer=None):
+        # Without a pacer, delay sleeps before every entry but the page
+        # headers, before every entry when entries_per_page is not given
+        # (one write per entry, also in batched mode).
+        if self.write_mode == 'batched' and (pacer or not delay):
+            marker = self.open()
+            buffers = iter(buffers)
+            while True:
+                batch = list(islice(buffers, self.batch_size))
+                if not batch:
+                    break
+                if pacer:
+                    pacer.wait(len(batch))
+                marker.writev(batch)
+            return
+        for k, data in enumerate(buffers):
+            if pacer:
+                pacer.wait()
+            elif delay and (not entries_per_page or k % entries_per_page):
+                time.sleep(random.randint(0, delay) / 1000000)
+            self.write_bytes(data)
 
     def write_entry(self, cpu, page_id, entry_nr):
         return self.write_string(WriteBuffer.generate_entry(cpu, page_id, entry_nr))
 
-    def write_page(self, cpu, page_id, entries_per_page, delay=0):
-        self.write_string(WriteBuffer.generate_page_header_entry(page_id))
-        for entry_nr in range(1, entries_per_page):
-            if delay:
-                time.sleep(random.randint(0, delay) / 1000000)
-            self.write_entry(cpu, page_id, entry_nr)
+    def write_page(self, cpu, page_id, entries_per_page, delay=0, pacer=None):
+        return self.write_pages(1, cpu, entries_per_page, page_id, delay, pacer)
+
+    def write_pages(self, nr_pages, cpu, entries_per_page, first_page_id=1, delay=0, pacer=None):
+        buffers = WriteBuffer.entry_cache.buffers(cpu, first_page_id, nr_pages, entries_per_page)
+        Spans.count('write.entries', nr_pages * entries_per_page)
+        return self.write_buffers(buffers, entries_per_page, delay, pacer)
 
-    def write_pages(self, nr_pages, cpu, entries_per_page, first_page_id=1, delay=0):
-        for i in range(0, nr_pages):
-            self.write_page(cpu, first_page_id + i, entries_per_page, delay)
+
+# Expected marker entries shared by the writers and the checkers.
+WriteBuffer.entry_cache = ExpectedEntryCache(WriteBuffer.generate_page_entries)
+os.register_at_fork(after_in_child=WriteBuffer.entry_cache.after_fork)
 
 
 class ReadBuffer:
-    def __init__(self, config):
+    def __init__(self, config, read_size=65536):
         self.config = config
+        self.read_size = read_size
+
+    def iter_lines(self, trace_filename):
+        with Helpers.backend.open_text(trace_filename, self.read_size) as f:
+            yield from f
 
+    @Spans.span('read')
     def complete_read_nc(self, trace_filename):
-        return open(trace_filename, 'r').readlines()
+        return list(self.iter_lines(trace_filename))
 
     def is_empty(self):
-        lines = self.complete_read_nc(self.config['trace'][0])
-        return lines[0].startswith('# tracer: ') and len(lines) == 11
+        with closing(self.iter_lines(self.config['trace'][0])) as lines:
+            lines = list(islice(lines, 12))
+        return len(lines) == 11 and lines[0].startswith('# tracer: ')
+
+    def iter_entries_noheader(self, trace_filename, nr_entries=None, header=None):
+        # The lines before the first marker page header are left out. They
+        # are appended to header when a list is given.
+        lines = self.iter_lines(trace_filename)
+        with Spans.timed('read.header'):
+            for line in lines:
+                if line.find(WriteBuffer.head_entry_beginning) != -1:
+                    break
+                if header is not None:
+                    header.append(line)
+            else:
+                raise ParsingBufferHeadError("Error while trying to ignore the buffer header. No first entry pattern found.")
+        yield from islice(chain((line,), lines), nr_entries)
 
     def get_entries_noheader_nc(self, trace_filename, nr_entries=None):
-        lines = self.complete_read_nc(trace_filename)
-        entries_to_ignore = 0
-        nr_lines = len(lines)
-        while lines[entries_to_ignore].find(WriteBuffer.head_entry_beginning) == -1:
-            entries_to_ignore += 1
-            if entries_to_ignore == nr_lines:
-                raise ParsingBufferHeadError("Error while trying to ignore the buffer header. No first entry pattern found.") 
-        return lines[entries_to_ignore:nr_entries]
+        return list(self.iter_entries_noheader(trace_filename, nr_entries))
+
+    @Spans.span('read')
+    def get_records(self, trace_filename, header=None):
+        records = TraceRecords.parse(self.iter_entries_noheader(trace_filename, header=header))
+        Spans.count('read.records', len(records))
+        return records
 
 
 class FtraceManager:
     def __init__(self, config):
         self.config = config
 
+    @staticmethod
+    def tracing_dir(config):
+        return config.get('tracing_dir') or os.path.dirname(config['marker_file'])
+
+    def instances_dir(self):
+        return os.path.join(FtraceManager.tracing_dir(self.config), 'instances')
+
+    def list_instances(self):
+        return Helpers.backend.listdir(self.instances_dir())
+
+    def create_instance(self, name, buffer_size_kb=None):
+        # The kernel gives a new instance its default buffer size, not the
+        # one of the top level buffer. It is set to buffer_size_kb, or to
+        # the size of this buffer when None, so nr_pages_to_fillup_buffer
+        # still holds.
+        if buffer_size_kb is None:
+            buffer_size_kb = self.get_buffer_size_kb()
+        instance = FtraceInstance(self.config, name)
+        try:
+            Helpers.backend.mkdir(instance.path)
+        except OSError as err:
+            raise FtraceInstanceError('Error creating the ftrace instance "{}". Details: {}'.format(instance.path, str(err)))
+        instance.drop_missing_files()
+        manager = FtraceManager(instance.config)
+        try:
+            manager.set_buffer_size_kb(buffer_size_kb)
+            manager.set_tracer('nop')
+            manager.set_tracing_on()
+        except FileWriteError:
+            self.remove_instance(name)
+            raise
+        return instance
+
+    def remove_instance(self, name):
+        path = os.path.join(self.instances_dir(), name)
+        try:
+            Helpers.backend.rmdir(path)
+        except OSError as err:
+            raise FtraceInstanceError('Error removing the ftrace instance "{}". Details: {}'.format(path, str(err)))
+
+    @Spans.span('ftrace.set_tracer')
     def set_tracer(self, tracer_name):
         Helpers.write2file(self.config['current_tracer'], tracer_name)
 
+    @Spans.span('ftrace.clear_buffer')
     def clear_buffer(self):
         Helpers.write2file(self.config['trace'][0], ' ')
 
+    @Spans.span('ftrace.set_tracing_on')
     def set_tracing_on(self):
         Helpers.write2file(self.config['tracing_on'], '1')
 
+    @Spans.span('ftrace.set_tracing_off')
     def set_tracing_off(self):
         Helpers.write2file(self.config['tracing_on'], '0')
 
+    @Spans.span('ftrace.set_events_on')
     def set_events_on(self):
         Helpers.write2file(self.config['events'], '1')
 
+    @Spans.span('ftrace.set_events_off')
     def set_events_off(self):
         Helpers.write2file(self.config['events'], '0')
 
-    def activate_tracer(self, tracer_name, duration):
+    @Spans.span('ftrace.set_buffer_size_kb')
+    def set_buffer_size_kb(self, size_kb):
+        Helpers.write2file(self.config['buffer_size_kb_file'], str(size_kb))
+
+    def get_buffer_size_kb(self):
+        return Helpers.read_int_from_file(self.config['buffer_size_kb_file'])
+
+    def set_overwrite(self, overwrite):
+        Helpers.write2file(self.config['overwrite_file'], '1' if overwrite else '0')
+
+    def get_overwrite(self):
+        return bool(Helpers.read_int_from_file(self.config['overwrite_file']))
+
+    @staticmethod
+    def nr_pages_to_fillup(size_kb, page_size):
+        # Like ring_buffer_resize(): buffer_size_kb over the data size of a
+        # page, the page less its 16 bytes header, and at least two pages.
+        return max(2, -(-size_kb * 1024 // (page_size - 16)))
+
+    def tracer_on(self, tracer_name):
         if tracer_name in ['function', 'function_graph']:
             self.set_tracing_on()
             self.set_tracer(tracer_name)
-            time.sleep(duration/1000)
-            self.set_tracing_off()
         elif tracer_name == 'events':
             self.set_tracer('nop')
             self.set_tracing_on()
             self.set_events_on()
-            time.sleep(duration/1000)
+
+    def tracer_off(self, tracer_name):
+        if tracer_name in ['function', 'function_graph']:
+            self.set_tracing_off()
+        elif tracer_name == 'events':
             self.set_events_off()
             self.set_tracing_off()
 
+    @Spans.span('ftrace.activate_tracer')
+    def activate_tracer(self, tracer_name, duration):
+        if tracer_name in ['function', 'function_graph', 'events']:
+            self.tracer_on(tracer_name)
+            Helpers.backend.sleep(duration/1000)
+            self.tracer_off(tracer_name)
+
+
+class FtraceInstance:
+    # instances/<name> of the tracing directory: a ring buffer of its own
+    # with its own trace, trace_marker, tracing_on and per_cpu files. config
+    # is the same configuration with every tracing file moved into the
+    # instance, so WriteBuffer, ReadBuffer, Check... work on it unchanged.
+    # Use FtraceManager.create_instance() to make one, exiting the context
+    # removes it.
+    def __init__(self, config, name):
+        self.name = name
+        self.path = os.path.join(FtraceManager.tracing_dir(config), 'instances', name)
+        self.config = FtraceInstance.instance_config(config, name)
+
+    @staticmethod
+    def instance_config(config, name):
+        tracing_dir = FtraceManager.tracing_dir(config)
+        current = os.path.join(tracing_dir, 'instances', config['instance']) if config.get('instance') else tracing_dir
+        path = os.path.join(tracing_dir, 'instances', name)
+
+        def move(value):
+            if isinstance(value, str) and value.startswith(current + os.sep):
+                return path + value[len(current):]
+            return value
+
+        instance_config = {key: [move(x) for x in value] if isinstance(value, list) else move(value) for key, value in config.items()}
+        instance_config['tracing_dir'] = tracing_dir
+        instance_config['instance'] = name
+        return instance_config
+
+    def drop_missing_files(self):
+        # The files of the patched kernel (persistent and the commit page
+        # counters of per_cpu) may exist only at the top level. The missing
+        # ones are left out of trace and out of the configuration, so the
+        # tests needing them skip or fail on them instead of reading the
+        # files of another buffer.
+        self.config['trace'] = [filename for filename in self.config['trace'] if Helpers.backend.exists(filename)]
+        for key, value in list(self.config.items()):
+            if isinstance(value, str) and value.startswith(self.path + os.sep) and not Helpers.backend.exists(value.replace('{}', '0')):
+                del self.config[key]
+
+    def remove(self):
+        FtraceManager(self.config).remove_instance(self.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.remove()
+
+
+class MarkerPagesReport:
+    def __init__(self, records, cpu, nr_pages, first_page_id, entries_per_page, fail_fast=False):
+        self.records = records
+        self.cpu = cpu
+        self.nr_pages = nr_pages
+        self.first_page_id = first_page_id
+        self.entries_per_page = entries_per_page
+        self.fail_fast = fail_fast
+        self.source = None
+        self.pages_found = 0
+        self.pages_hashed = 0
+        self.pages_sampled = 0
+        self.missing_pages = []
+        self.torn_pages = []
+        self.out_of_sequence = []
+        self.extra_entries = array('q')
+
+    def ok(self):
+        return not (self.missing_pages or self.torn_pages or self.out_of_sequence or self.extra_entries)
+
+    def add_torn_page(self, page_id, missing_entries, wrong_entries):
+        self.torn_pages.append((page_id, missing_entries, wrong_entries))
+        if self.fail_fast:
+            raise CheckingMarkerPagesError('Torn page. CPU: {} PAGE_ID: {} Missing entries: {} Wrong lines: {}'.format(self.cpu, page_id, missing_entries, [self.records.line(i) for i in wrong_entries]))
+
+    def add_out_of_sequence(self, page_id, expected_page_id):
+        self.out_of_sequence.append((page_id, expected_page_id))
+        if self.fail_fast:
+            raise CheckingMarkerPagesError('Page out of sequence. CPU: {} PAGE_ID: {} Expected PAGE_ID: {}'.format(self.cpu, page_id, expected_page_id))
+
+    def add_extra_entry(self, index):
+        self.extra_entries.append(index)
+        if self.fail_fast:
+            raise CheckingMarkerPagesError('There is extra entries. First extra entry: {}'.format(self.records.line(index)))
+
+    def set_missing_pages(self, missing_pages):
+        self.missing_pages = missing_pages
+        if self.fail_fast and missing_pages:
+            raise CheckingMarkerPagesError('Missing pages. CPU: {} PAGE_IDs: {}'.format(self.cpu, missing_pages))
+
+    def __str__(self):
+        source = '{}: '.format(self.source) if self.source else ''
+        hashed = ' Pages verified by hash: {} ({} sampled pages verified line by line).'.format(self.pages_hashed, self.pages_sampled) if self.pages_hashed or self.pages_sampled else ''
+        if self.ok():
+            return '{}CPU: {} PAGE_IDs: {}-{} OK.{}'.format(source, self.cpu, self.first_page_id, self.first_page_id + self.nr_pages - 1, hashed)
+        details = ['{}CPU: {} PAGE_IDs: {}-{} Pages found: {}.{}'.format(source, self.cpu, self.first_page_id, self.first_page_id + self.nr_pages - 1, self.pages_found, hashed)]
+        if self.missing_pages:
+            details.append('Missing pages: {}.'.format(self.missing_pages))
+        for page_id, missing_entries, wrong_entries in self.torn_pages:
+            details.append('Torn page {}: missing entries: {}, wrong lines: {}.'.format(page_id, missing_entries, len(wrong_entries)))
+            if wrong_entries:
+                details.append('First wrong line: {}'.format(self.records.line(wrong_entries[0])))
+        if self.out_of_sequence:
+            details.append('Pages out of sequence (found, expected): {}.'.format(self.out_of_sequence))
+        if self.extra_entries:
+            details.append('Extra entries: {}. First extra entry: {}'.format(len(self.extra_entries), self.records.line(self.extra_entries[0])))
+        return ' '.join(details)
+
+
+class VerifyMode:
+    # 'full' compares every line of every page. 'tiered' first checks the
+    # header, the number of entries and the CRC32 of every page against the
+    # expected one and only compares line by line the pages that do not
+    # match, plus a seeded random sample of the ones that do. Either way the
+    # report points at the same pages and entries.
+    modes = ['full', 'tiered']
+
+    def __init__(self, mode='full', sample=0.0, seed=0):
+        if mode not in VerifyMode.modes:
+            raise ArgumentError('Unknown verify mode: "{}". Valid modes: {}'.format(mode, ', '.join(VerifyMode.modes)))
+        if not 0 <= sample <= 1:
+            raise ArgumentError('The verify sample must be between 0 and 1: {}'.format(sample))
+        self.mode = mode
+        self.sample = sample
+        self.seed = seed
+
+    @Spans.span('check.hash')
+    def hashed_pages(self, records, entries_per_page, cpu, first_page_id, last_page_id, indexes):
+        # Returns ({position in indexes: PAGE_ID} of the pages verified by
+        # their hash, number of matching pages left for the full check).
+        verified = {}
+        if self.mode == 'full':
+            return (verified, 0)
+        payloads = records.payloads
+        header_length = len(WriteBuffer.head_entry_beginning) + 8
+        rng = random.Random('{}-{}'.format(self.seed, cpu))
+        nr_sampled = 0
+        nr_indexes = len(indexes)
+        k = 0
+        while k + entries_per_page <= nr_indexes:
+            header = payloads[indexes[k]]
+            if header[-header_length:-8] != WriteBuffer.head_entry_beginning or not header[-8:].isdigit():
+                k += 1
+                continue
+            page_id = int(header[-8:])
+            page = indexes[k:k + entries_per_page]
+            if not first_page_id <= page_id <= last_page_id or \
+                    EntryBlock.page_hash(map(payloads.__getitem__, page)) != WriteBuffer.entry_cache.page_hash(cpu, page_id, entries_per_page, header[:-header_length]):
+                k += 1
+                continue
+            end = k + entries_per_page
+            # An entry of the same page right after it makes it torn.
+            if end < nr_indexes:
+                next_page_id, next_entry_nr = Check._marker_position(payloads[indexes[end]], cpu)
+                if next_page_id == page_id and next_entry_nr:
+                    k += 1
+                    continue
+            if self.sample and rng.random() < self.sample:
+                nr_sampled += 1
+            else:
+                verified[k] = page_id
+            k = end
+        return (verified, nr_sampled)
+
 
 class Check:
     @staticmethod
-    def marker_page(buffer_content, entries_per_page, cpu, page_id):
-        if len(buffer_content) < entries_per_page:
-            raise CheckingMarkerPagesError('Not enough entries. CPU: {} PAGE_ID: {} Entries expected: {} Entries in this page: {}'.format(cpu, page_id, entries_per_page, len(buffer_content)))
-        if buffer_content[0].find(WriteBuffer.generate_page_header_entry(page_id)) == -1:
-            raise CheckingMarkerPagesError('First line do not match. PAGE_ID: {} Line: {}'.format(page_id, buffer_content[0]))
+    def marker_page(records, entries_per_page, cpu, page_id, indexes=None, begin=0):
+        records = TraceRecords.from_content(records)
+        if indexes is None:
+            indexes = range(len(records))
+        payloads = records.payloads
+        expected = WriteBuffer.entry_cache.page_strings(cpu, page_id, entries_per_page)
+        nr_entries = len(indexes) - begin
+        if nr_entries < entries_per_page:
+            raise CheckingMarkerPagesError('Not enough entries. CPU: {} PAGE_ID: {} Entries expected: {} Entries in this page: {}'.format(cpu, page_id, entries_per_page, nr_entries))
+        if not payloads[indexes[begin]].endswith(expected[0]):
+            raise CheckingMarkerPagesError('First line do not match. PAGE_ID: {} Line: {}'.format(page_id, records.line(indexes[begin])))
         for entry_nr in range (1, entries_per_page):
-            if buffer_content[entry_nr].find(WriteBuffer.generate_entry(cpu, page_id, entry_nr)) == -1:
-                raise CheckingMarkerPagesError('Line do not match. CPU: {} PAGE_ID: {} ENTRY: {}. Line: {}'.format(cpu, page_id, entry_nr, buffer_content[entry_nr]))
+            i = indexes[begin + entry_nr]
+            if not payloads[i].endswith(expected[entry_nr]):
+                raise CheckingMarkerPagesError('Line do not match. CPU: {} PAGE_ID: {} ENTRY: {}. Line: {}'.format(cpu, page_id, entry_nr, records.line(i)))
         return (entries_per_page, page_id + 1)
 
     @staticmethod
-    def exact_marker_pages(content_no_header, entries_per_page, cpu, nr_pages, first_page_id=1, extra_entries=0):
-        begin = 0
+    def _marker_position(payload, cpu):
+        # (PAGE_ID, ENTRY#) of an entry of cpu, ENTRY# 0 for a page header.
+        # The CPU field gets wider than 3 digits from CPU 1000 on, it is
+        # read up to its '-'.
+        try:
+            if payload[-8 - len(WriteBuffer.head_entry_beginning):-8] == WriteBuffer.head_entry_beginning:
+                return (int(payload[-8:]), 0)
+            cpu_field, separator, tail = payload[payload.rfind(' ') + 1:].partition('-')
+            if separator and len(tail) >= 12 and tail[8] == '-' and int(cpu_field) == cpu:
+                return (int(tail[:8]), int(tail[9:]))
+        except ValueError:
+            pass
+        return (None, None)
+
+    @staticmethod
+    @Spans.span('check.marker_pages')
+    def marker_pages_report(records, entries_per_page, cpu, nr_pages, first_page_id=1, indexes=None, fail_fast=False, verify_mode=None):
+        records = TraceRecords.from_content(records)
+        if indexes is None:
+            indexes = range(len(records))
+        payloads = records.payloads
+        report = MarkerPagesReport(records, cpu, nr_pages, first_page_id, entries_per_page, fail_fast)
+        last_page_id = first_page_id + nr_pages - 1
+        verified = {}
+        if verify_mode is not None:
+            verified, report.pages_sampled = verify_mode.hashed_pages(records, entries_per_page, cpu, first_page_id, last_page_id, indexes)
+            report.pages_hashed = len(verified)
+        expected_page_id = first_page_id
+        pages_seen = set()
+        k = 0
+        nr_indexes = len(indexes)
+        while k < nr_indexes:
+            page_id = verified.get(k)
+            if page_id is not None:
+                report.pages_found += 1
+                if page_id in pages_seen or page_id != expected_page_id:
+                    report.add_out_of_sequence(page_id, expected_page_id)
+                pages_seen.add(page_id)
+                expected_page_id = page_id + 1
+                k += entries_per_page
+                continue
+            page_id, _ = Check._marker_position(payloads[indexes[k]], cpu)
+            if page_id is None or not first_page_id <= page_id <= last_page_id:
+                report.add_extra_entry(indexes[k])
+                k += 1
+                continue
+            expected = WriteBuffer.entry_cache.page_strings(cpu, page_id, entries_per_page)
+            missing_entries = []
+            wrong_entries = []
+            entry_nr = 0
+            while k < nr_indexes:
+                payload = payloads[indexes[k]]
+                if entry_nr < entries_per_page and payload.endswith(expected[entry_nr]):
+                    entry_nr += 1
+                    k += 1
+                    continue
+                line_page_id, line_entry_nr = Check._marker_position(payload, cpu)
+                if line_page_id != page_id or (line_entry_nr == 0 and entry_nr):
+                    break
+                if entry_nr < line_entry_nr < entries_per_page:
+                    missing_entries.extend(range(entry_nr, line_entry_nr))
+                    entry_nr = line_entry_nr + 1
+                else:
+                    wrong_entries.append(indexes[k])
+                k += 1
+            if entry_nr < entries_per_page:
+                missing_entries.extend(range(entry_nr, entries_per_page))
+            report.pages_found += 1
+            if page_id in pages_seen or page_id != expected_page_id:
+                report.add_out_of_sequence(page_id, expected_page_id)
+            if missing_entries or wrong_entries:
+                report.add_torn_page(page_id, missing_entries, wrong_entries)
+            pages_seen.add(page_id)
+            expected_page_id = page_id + 1
+        report.set_missing_pages([page_id for page_id in range(first_page_id, last_page_id + 1) if page_id not in pages_seen])
+        Spans.count('check.pages', report.pages_found)
+        return report
+
+    @staticmethod
+    def exact_marker_pages(records, entries_per_page, cpu, nr_pages, first_page_id=1, extra_entries=0, indexes=None, fail_fast=False, verify_mode=None):
         if extra_entries: raise NotImplementedError('Parameter "extra_entries" is not supported yet.')
-        next_page_id = first_page_id
-        for i in range(1, nr_pages + 1):
-            entries, next_page_id = Check.marker_page(content_no_header[begin:], entries_per_page, cpu, next_page_id)
-            begin += entries
-        if content_no_header[begin:]:
-            raise CheckingMarkerPagesError('There is extra entries. First extra entry: {}'.format(content_no_header[begin]))
+        report = Check.marker_pages_report(records, entries_per_page, cpu, nr_pages, first_page_id, indexes, fail_fast, verify_mode)
+        if not report.ok():
+            raise MarkerPagesReportError([report])
         return True
-
     
     @staticmethod
     def _get_nr_pages_from(config, writer_name):
@@ -186,42 +707,37 @@ class Check:
         return (nr_pages, first_page_id)
 
     @staticmethod
-    def per_cpu_content(config, writer_name, content_no_header, cpus_to_use, entries_per_page):
-        for cpu in cpus_to_use:
-            filtered_content = [x for x in content_no_header if x.find(' [{:03}] '.format(cpu)) != -1]
-            pages_written = Check._get_nr_pages_from(config, writer_name)
-            nr_pages, first_page_id = Check.get_nr_pages_and_first_page_id(config, pages_written)
-            Check.exact_marker_pages(filtered_content, entries_per_page, cpu, nr_pages, first_page_id)
-
-    @staticmethod
-    def merged_buffers(content_no_header):
-        prev_time = [-1,-1]
-        prev_line = None
-        for line in content_no_header:
-            if line.find(' buffer started ####') != -1: continue
-            try:
-                current_time = list(int(x) for x in line.split()[3].strip(':').split('.'))
-            except Exception as err:
-                raise CheckingEntriesOrderError('Error while trying to get time stamp of line: {}'.format(line))
-            if current_time < prev_time:
-                raise CheckingEntriesOrderError('Entries out of order. Entry x: {}. Entry x+1: {}'.format(prev_line, line))
-            prev_line = line
-            prev_time = current_time
-
-    @staticmethod
-    def content_trace_files(trace_content, persistent_content):
-        i2 = 0
-        for i1, trace_line in enumerate(trace_content):
-            try:
-                if trace_line.find('# entries-in-buffer/entries-written: ') != -1 and i1 == 2:
-                    i2 += 1
-                    continue
-                if trace_line.find(' buffer started ####') != -1: continue
-                if trace_line != persistent_content[i2]:
-                    raise CompareTraceFiles('Error while comparing trace and persistent content. A line doesn\'t match. Line index at trace content: {}. Line index at persistent content: {}. Line of trace content: "{}". Line of persistent content: "{}".'.format(i1, i2, trace_line, persistent_content[i2]))
-                i2 += 1
-            except IndexError:
-                raise CompareTraceFiles('Error while comparing trace content and persistent content. Trace content is longer than persistent content. First extra line index: {}. Line content: "{}"'.format(i1, trace_line))
-        if len(persistent_content) > i2:
-            raise CompareTraceFiles('Error while comparing trace content and and persistent content. Persistent content is longer than trace content. First extra line index: {}. Line content: "{}"'.format(i2, persistent_content[i2]))
+    @Spans.span('check.per_cpu_content')
+    def per_cpu_content(config, writer_name, records, cpus_to_use, entries_per_page, fail_fast=False, verify_mode=None):
+        records = TraceRecords.from_content(records)
+        per_cpu, unexpected = records.split_per_cpu(cpus_to_use)
+        if unexpected:
+            raise UnexpectedCpuEntriesError('There are {} entries that do not belong to the CPUs in use {}. First one at index {}: {}'.format(len(unexpected), cpus_to_use, unexpected[0], records.line(unexpected[0])))
+        pages_written = Check._get_nr_pages_from(config, writer_name)
+        nr_pages, first_page_id = Check.get_nr_pages_and_first_page_id(config, pages_written)
+        reports = [Check.marker_pages_report(records, entries_per_page, cpu, nr_pages, first_page_id, per_cpu[cpu], fail_fast, verify_mode) for cpu in cpus_to_use]
+        failed = [report for report in reports if not report.ok()]
+        if failed:
+            raise MarkerPagesReportError(failed)
+
+    @staticmethod
+    @Spans.span('check.order')
+    def merged_buffers(records):
+        records = TraceRecords.from_content(records)
+        if analytics.available():
+            i = analytics.first_order_violation(records)
+            if i is not None:
+                raise CheckingEntriesOrderError('Entries out of order. Entry x: {}. Entry x+1: {}'.format(records.line(i - 1), records.line(i)))
+            return
+        timestamps = records.timestamps
+        for i in range(1, len(timestamps)):
+            if timestamps[i] < timestamps[i - 1]:
+                raise CheckingEntriesOrderError('Entries out of order. Entry x: {}. Entry x+1: {}'.format(records.line(i - 1), records.line(i)))
 
+    @staticmethod
+    @Spans.span('check.compare')
+    def content_trace_files(trace_content, persistent_content, diff=None):
+        report = (diff or TraceDiff()).compare(trace_content, persistent_content)
+        if not report.ok():
+            raise CompareTraceFiles('Error while comparing trace content and persistent content. {}'.format(report))
+        return report
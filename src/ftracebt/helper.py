@@ -1,5 +1,6 @@
 import configparser
 import os
+from backend import TracefsBackend
 
 
 class ArgumentError(Exception):
@@ -26,6 +27,14 @@ class FileWriteError(Exception):
 
 
 class Helpers:
+    backend = TracefsBackend()
+
+    @staticmethod
+    def set_backend(backend):
+        previous = Helpers.backend
+        Helpers.backend = backend
+        return previous
+
     @staticmethod
     def get_config(filename):
         config = configparser.ConfigParser()
@@ -43,19 +52,14 @@ class Helpers:
     @staticmethod
     def read_int_from_file(filename):
         try:
-            with open(filename) as f:
-                i = int(open(filename, 'r').readline())
-            return i
+            return int(Helpers.backend.read_line(filename))
         except Exception as err:
             raise IntFromFileError(filename, err)
 
     @staticmethod
     def _filewrite(filename, mode, text):
         try:
-            with open(filename, mode) as f:
-                r = f.write(text)
-                f.flush()
-                return r
+            return Helpers.backend.write(filename, mode, text)
         except Exception as err:
             raise FileWriteError(filename, mode, text, err)
 
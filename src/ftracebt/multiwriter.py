@@ -0,0 +1,216 @@
+import time
+import queue
+import threading
+import multiprocessing
+from threading import BrokenBarrierError
+from helper import Helpers
+from ftrace import Check
+from ftrace import StatsPhase
+from ftrace import WriteBuffer
+from pacing import Pacer
+from profiling import Spans
+
+
+class MultiWriterError(Exception):
+    pass
+
+
+class WriterResult:
+    def __init__(self, cpu, nr_entries, start_ns, end_ns, error=None, pacing=None):
+        self.cpu = cpu
+        self.nr_entries = nr_entries
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.error = error
+        self.pacing = pacing
+
+    def duration_ns(self):
+        return self.end_ns - self.start_ns
+
+    def entries_per_second(self):
+        duration = self.duration_ns()
+        return self.nr_entries * 1000000000 / duration if duration else 0.0
+
+
+class MultiWriterReport:
+    def __init__(self, results, stats=None):
+        self.results = sorted(results, key=lambda result: result.cpu)
+        self.stats = stats
+
+    def errors(self):
+        return [result for result in self.results if result.error is not None]
+
+    def nr_entries(self):
+        return sum(result.nr_entries for result in self.results)
+
+    def start_skew_ns(self):
+        starts = [result.start_ns for result in self.results]
+        return max(starts) - min(starts) if starts else 0
+
+    def duration_ns(self):
+        if not self.results:
+            return 0
+        return max(result.end_ns for result in self.results) - min(result.start_ns for result in self.results)
+
+    def entries_per_second(self):
+        duration = self.duration_ns()
+        return self.nr_entries() * 1000000000 / duration if duration else 0.0
+
+    def __str__(self):
+        lines = ['Writers: {} Entries: {} Duration: {:.3f} ms Start skew: {:.3f} ms Rate: {:.0f} entries/s'.format(
+            len(self.results), self.nr_entries(), self.duration_ns() / 1000000, self.start_skew_ns() / 1000000, self.entries_per_second())]
+        for result in self.results:
+            if result.error is not None:
+                lines.append('CPU#: {:03}\tERROR: {}'.format(result.cpu, result.error))
+            else:
+                lines.append('CPU#: {:03}\tentries: {:10}\tduration: {:10.3f} ms\trate: {:12.0f} entries/s'.format(
+                    result.cpu, result.nr_entries, result.duration_ns() / 1000000, result.entries_per_second()))
+                if result.pacing:
+                    lines[-1] += '\ttarget: {:12.0f} entries/s\tmax late: {:10.1f} us'.format(result.pacing['target_rate'], result.pacing['max_late_ns'] / 1000)
+                if self.stats:
+                    lines[-1] += '\t' + '\t'.join('{}: {}'.format(name, value) for name, value in self.stats[result.cpu].items())
+        return '\n'.join(lines)
+
+
+def _writer_worker(config, write_mode, batch_size, pacing, cpu, nr_pages, entries_per_page, first_page_id, delay, barrier, results):
+    try:
+        Helpers.backend.pin(cpu)
+        pacer = None
+        if pacing:
+            pacer = Pacer(pacing.with_seed(None if pacing.seed is None else pacing.seed + cpu))
+        with WriteBuffer(config, write_mode, batch_size) as writebuffer:
+            if write_mode != 'reopen':
+                writebuffer.open()
+            barrier.wait()
+            start_ns = time.perf_counter_ns()
+            writebuffer.write_pages(nr_pages, cpu, entries_per_page, first_page_id, delay, pacer)
+            end_ns = time.perf_counter_ns()
+        results.put((cpu, nr_pages * entries_per_page, start_ns, end_ns, None, pacer.report().as_dict() if pacer else None))
+    except BrokenBarrierError:
+        results.put((cpu, 0, 0, 0, 'Start barrier broken by another writer.'))
+    except Exception as err:
+        barrier.abort()
+        results.put((cpu, 0, 0, 0, '{}: {}'.format(type(err).__name__, err)))
+
+
+class ThreadContext:
+    # Backends that live in this process' memory (e.g. the simulated tracefs)
+    # can't be shared with forked workers, so their writers run as threads.
+    Barrier = threading.Barrier
+    Queue = queue.Queue
+
+    @staticmethod
+    def Process(target, args):
+        return threading.Thread(target=target, args=args, daemon=True)
+
+
+class MultiWriter:
+    # With stats the per_cpu/cpuN/stats counters of the writer CPUs are
+    # snapshotted around the write phase and their change is reported.
+    # timeout bounds the start barrier and the wait for the results, in
+    # seconds. The workers are polled every poll_interval seconds, so one
+    # that dies without a result (killed, crashed) fails the write instead
+    # of hanging it.
+    def __init__(self, config, write_mode='keep_open', batch_size=None, pacing=None, start_method='fork', timeout=None, stats=False, poll_interval=0.05):
+        self.config = config
+        self.stats = stats
+        self.write_mode = write_mode
+        self.batch_size = batch_size
+        self.pacing = pacing
+        self.start_method = start_method
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+
+    @property
+    def context(self):
+        if not Helpers.backend.shared_across_processes:
+            return ThreadContext
+        return multiprocessing.get_context(self.start_method)
+
+    @Spans.span('write.multiwriter')
+    def write_pages(self, nr_pages, cpus, entries_per_page, first_page_id=1, delay=0):
+        context = self.context
+        barrier = context.Barrier(len(cpus) + 1, timeout=self.timeout)
+        results = context.Queue()
+        workers = [context.Process(target=_writer_worker,
+                                        args=(self.config, self.write_mode, self.batch_size, self.pacing, cpu, nr_pages, entries_per_page, first_page_id, delay or 0, barrier, results))
+                   for cpu in cpus]
+        for worker in workers:
+            worker.start()
+        phase = StatsPhase(self.config, cpus) if self.stats else None
+        try:
+            if phase:
+                phase.start()
+            self._start(barrier, workers)
+            writer_results = self._results(cpus, workers, results)
+        except BaseException:
+            # Writers still waiting at the barrier would wait forever.
+            barrier.abort()
+            self._stop(workers)
+            raise
+        for worker in workers:
+            worker.join()
+        if phase:
+            phase.stop()
+        report = MultiWriterReport(writer_results, phase.delta() if phase else None)
+        if report.errors():
+            raise MultiWriterError('Error while writing with multiple CPUs.\n{}'.format(report))
+        return report
+
+    def _start(self, barrier, workers):
+        # A writer that dies before the barrier breaks it instead of
+        # leaving everybody else waiting.
+        released = threading.Event()
+
+        def watch():
+            while not released.wait(self.poll_interval):
+                if not all(worker.is_alive() for worker in workers):
+                    barrier.abort()
+                    return
+
+        watcher = threading.Thread(target=watch, daemon=True)
+        watcher.start()
+        try:
+            barrier.wait()
+        except BrokenBarrierError:
+            pass
+        finally:
+            released.set()
+            watcher.join()
+
+    def _results(self, cpus, workers, results):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        writer_results = []
+        pending = list(zip(cpus, workers))
+        dead = []
+        while pending:
+            try:
+                result = WriterResult(*results.get(timeout=self.poll_interval))
+            except queue.Empty:
+                # A dead worker gets one more poll for a result in flight.
+                lost = [(cpu, worker) for cpu, worker in pending if not worker.is_alive()]
+                gone = [(cpu, worker) for cpu, worker in lost if (cpu, worker) in dead]
+                if gone:
+                    raise MultiWriterError('Writers died without a result: {}.'.format(
+                        ', '.join('CPU {} (exit code: {})'.format(cpu, getattr(worker, 'exitcode', None)) for cpu, worker in gone)))
+                dead = lost
+                if deadline is not None and time.monotonic() > deadline:
+                    raise MultiWriterError('Timeout after {} s waiting for the writers of CPUs {}.'.format(self.timeout, [cpu for cpu, _ in pending]))
+                continue
+            writer_results.append(result)
+            for k, (cpu, _) in enumerate(pending):
+                if cpu == result.cpu:
+                    del pending[k]
+                    break
+        return writer_results
+
+    def _stop(self, workers):
+        for worker in workers:
+            if worker.is_alive() and hasattr(worker, 'terminate'):
+                worker.terminate()
+        for worker in workers:
+            worker.join(self.poll_interval)
+
+    def write(self, writer_name, cpus, entries_per_page, delay=0):
+        nr_pages = Check._get_nr_pages_from(self.config, writer_name)
+        return self.write_pages(nr_pages, cpus, entries_per_page, delay=delay)
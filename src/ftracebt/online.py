@@ -0,0 +1,288 @@
+import re
+import time
+import argparse
+import threading
+from helper import ArgumentError
+from helper import Helpers
+from ftrace import Check
+from ftrace import WriteBuffer
+from multiwriter import MultiWriter
+from records import TraceRecords
+
+
+class OnlineCheckError(Exception):
+    pass
+
+
+class CpuSequence:
+    # Expected position of the next marker entry of one CPU. A position is
+    # (page_id - first_page_id) * entries_per_page + entry_nr. Entries after
+    # the expected position mean the ones in between were lost. Entries
+    # before it were either lost before and arrive late (reordered) or were
+    # already seen (duplicated). Only the last max_gaps gaps are remembered
+    # to tell both apart, so memory does not grow with the length of the run.
+    def __init__(self, cpu, entries_per_page, first_page_id=1, max_gaps=1024):
+        self.cpu = cpu
+        self.entries_per_page = entries_per_page
+        self.first_page_id = first_page_id
+        self.max_gaps = max_gaps
+        self.gaps = []
+        self.expected = 0
+        self.entries = 0
+        self.lost = 0
+        self.duplicated = 0
+        self.reordered = 0
+        self.timestamp_regressions = 0
+        self.foreign = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def _take_from_gaps(self, position):
+        for k, (start, end) in enumerate(self.gaps):
+            if start <= position < end:
+                del self.gaps[k]
+                if position + 1 < end:
+                    self.gaps.insert(k, (position + 1, end))
+                if start < position:
+                    self.gaps.insert(k, (start, position))
+                return True
+        return False
+
+    def feed(self, timestamp, payload):
+        page_id, entry_nr = Check._marker_position(payload, self.cpu)
+        if page_id is None or page_id < self.first_page_id or entry_nr >= self.entries_per_page:
+            self.foreign += 1
+            return
+        self.entries += 1
+        if self.first_timestamp is None:
+            self.first_timestamp = timestamp
+        elif timestamp < self.last_timestamp:
+            self.timestamp_regressions += 1
+        self.last_timestamp = timestamp if self.last_timestamp is None else max(self.last_timestamp, timestamp)
+        position = (page_id - self.first_page_id) * self.entries_per_page + entry_nr
+        if position == self.expected:
+            self.expected += 1
+        elif position > self.expected:
+            self.lost += position - self.expected
+            self.gaps.append((self.expected, position))
+            if len(self.gaps) > self.max_gaps:
+                del self.gaps[0]
+            self.expected = position + 1
+        elif self._take_from_gaps(position):
+            self.lost -= 1
+            self.reordered += 1
+        else:
+            self.duplicated += 1
+
+    def ok(self, allow_lost=False):
+        return not (self.duplicated or self.reordered or self.timestamp_regressions or self.foreign or (self.lost and not allow_lost))
+
+    def __str__(self):
+        return 'CPU#: {:03}\tentries: {:10}\tlost: {:8}\tduplicated: {:6}\treordered: {:6}\ttimestamp regressions: {:6}\tforeign: {:6}\tnext PAGE_ID: {}'.format(
+            self.cpu, self.entries, self.lost, self.duplicated, self.reordered, self.timestamp_regressions, self.foreign,
+            self.first_page_id + self.expected // self.entries_per_page)
+
+
+class OnlineReport:
+    # kernel_lost holds, per CPU, the events the kernel reported as lost
+    # with 'CPU:N [LOST M EVENTS]' lines: the ones overwritten before the
+    # reader got to them, marker entries or not.
+    def __init__(self, sequences, unexpected_cpus, unparsed_lines, elapsed_ns, kernel_lost=None):
+        self.sequences = sequences
+        self.unexpected_cpus = unexpected_cpus
+        self.unparsed_lines = unparsed_lines
+        self.elapsed_ns = elapsed_ns
+        self.kernel_lost = kernel_lost or {}
+
+    def entries(self):
+        return sum(sequence.entries for sequence in self.sequences)
+
+    def lost(self):
+        return sum(sequence.lost for sequence in self.sequences)
+
+    def kernel_lost_events(self):
+        return sum(self.kernel_lost.values())
+
+    def entries_per_second(self):
+        return self.entries() * 1000000000 / self.elapsed_ns if self.elapsed_ns else 0.0
+
+    def ok(self, allow_lost=False):
+        if self.unexpected_cpus or self.unparsed_lines or (self.kernel_lost and not allow_lost):
+            return False
+        return all(sequence.ok(allow_lost) for sequence in self.sequences)
+
+    def __str__(self):
+        lines = ['Online check. Entries: {} Lost: {} Lost events reported by the kernel: {} Duration: {:.3f} s Throughput: {:.0f} entries/s Entries from unexpected CPUs: {} Unparsed lines: {}'.format(
+            self.entries(), self.lost(), self.kernel_lost_events(), self.elapsed_ns / 1000000000, self.entries_per_second(), sum(self.unexpected_cpus.values()), self.unparsed_lines)]
+        lines.extend(str(sequence) for sequence in self.sequences)
+        return '\n'.join(lines)
+
+
+class OnlineChecker:
+    # Drains trace_pipe (or the per-CPU trace_pipe files) from a background
+    # thread while the writers run and feeds every entry to the sequence of
+    # its CPU. Reading trace_pipe consumes the entries, so the ring buffer
+    # keeps room for the writers and runs can be as long as needed.
+    lost_events_pattern = re.compile(r'^CPU:(\d+) \[LOST (\d+) EVENTS\]$')
+
+    def __init__(self, config, cpus, entries_per_page, first_page_id=1, per_cpu_pipes=False, read_size=65536, poll_interval=0.001):
+        self.config = config
+        self.cpus = list(cpus)
+        self.per_cpu_pipes = per_cpu_pipes
+        self.read_size = read_size
+        self.poll_interval = poll_interval
+        self.sequences = {cpu: CpuSequence(cpu, entries_per_page, first_page_id) for cpu in self.cpus}
+        self.unexpected_cpus = {}
+        self.unparsed_lines = 0
+        self.kernel_lost = {}
+        self.partial = {}
+        self.pipes = []
+        self.thread = None
+        self.stopping = threading.Event()
+        self.error = None
+        self.start_ns = None
+        self.end_ns = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _open_pipes(self):
+        if self.per_cpu_pipes:
+            filename = self.config['per_cpu_trace_pipe_file']
+            return [Helpers.backend.open_pipe(filename.format(cpu)) for cpu in self.cpus]
+        return [Helpers.backend.open_pipe(self.config['trace_pipe_file'])]
+
+    def start(self):
+        if self.thread is not None:
+            raise OnlineCheckError('The online checker is already running.')
+        self.pipes = self._open_pipes()
+        self.stopping.clear()
+        self.start_ns = time.perf_counter_ns()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return self.report()
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        for pipe in self.pipes:
+            pipe.close()
+        self.pipes = []
+        self.end_ns = time.perf_counter_ns()
+        if self.error is not None:
+            raise OnlineCheckError('Error while reading the trace pipes: {}'.format(self.error))
+        return self.report()
+
+    def _run(self):
+        try:
+            while True:
+                stopping = self.stopping.is_set()
+                nr_bytes = self.drain()
+                # Keep reading after the stop request until the pipes are empty.
+                if stopping and not nr_bytes:
+                    break
+                if not nr_bytes:
+                    time.sleep(self.poll_interval)
+        except Exception as err:
+            self.error = '{}: {}'.format(type(err).__name__, err)
+
+    def drain(self):
+        nr_bytes = 0
+        for k, pipe in enumerate(self.pipes):
+            data = pipe.read(self.read_size)
+            if data:
+                nr_bytes += len(data)
+                self.feed(k, data)
+        return nr_bytes
+
+    def feed(self, pipe_nr, data):
+        lines = (self.partial.pop(pipe_nr, b'') + data).split(b'\n')
+        if lines[-1]:
+            self.partial[pipe_nr] = lines[-1]
+        for line in lines[:-1]:
+            self.feed_line(line.decode(errors='replace'))
+
+    def feed_line(self, line):
+        if not line or line.startswith('#') or line.find(TraceRecords.annotation) != -1:
+            return
+        match = TraceRecords.line_pattern.match(line)
+        if match is None:
+            lost = OnlineChecker.lost_events_pattern.match(line)
+            if lost is None:
+                self.unparsed_lines += 1
+                return
+            cpu = int(lost.group(1))
+            self.kernel_lost[cpu] = self.kernel_lost.get(cpu, 0) + int(lost.group(2))
+            return
+        cpu = int(match.group('cpu'))
+        sequence = self.sequences.get(cpu)
+        if sequence is None:
+            self.unexpected_cpus[cpu] = self.unexpected_cpus.get(cpu, 0) + 1
+            return
+        sequence.feed(TraceRecords.timestamp_ns(match.group('sec'), match.group('frac')), match.group('payload'))
+
+    def report(self):
+        end_ns = self.end_ns if self.thread is None and self.end_ns else time.perf_counter_ns()
+        elapsed_ns = end_ns - self.start_ns if self.start_ns else 0
+        return OnlineReport([self.sequences[cpu] for cpu in self.cpus], dict(self.unexpected_cpus), self.unparsed_lines, elapsed_ns, dict(self.kernel_lost))
+
+
+def soak(config, cpus, entries_per_page, duration, pages_per_round=None, write_mode='keep_open', pacing=None, per_cpu_pipes=False, progress=None):
+    # Keeps the writers going in rounds of pages_per_round pages per CPU, with
+    # increasing PAGE_IDs, until duration seconds have passed while an
+    # OnlineChecker verifies everything that comes out of the pipes.
+    if duration <= 0:
+        raise ArgumentError('The soak duration must be a positive number of seconds: {}'.format(duration))
+    pages_per_round = pages_per_round or config['nr_pages_to_fillup_buffer']
+    multiwriter = MultiWriter(config, write_mode, pacing=pacing)
+    checker = OnlineChecker(config, cpus, entries_per_page, per_cpu_pipes=per_cpu_pipes)
+    first_page_id = 1
+    deadline = time.monotonic() + duration
+    checker.start()
+    try:
+        while time.monotonic() < deadline:
+            multiwriter.write_pages(pages_per_round, cpus, entries_per_page, first_page_id)
+            first_page_id += pages_per_round
+            if progress:
+                progress(checker.report())
+    finally:
+        report = checker.stop()
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Soak the ftrace ring buffer: write marker pages for a while and verify them online from trace_pipe.')
+    parser.add_argument("--config-file", default="test_buffer.ini", help="Configuration file.")
+    parser.add_argument("--cpus", default='0', help="List of CPUs to write to at the same time, e.g. --cpus 0,1,3.")
+    parser.add_argument("--duration", type=float, required=True, help="Seconds to keep writing.")
+    parser.add_argument("--entries-per-page", type=int, default=101, help="The number of entries to write per page.")
+    parser.add_argument("--pages-per-round", type=int, help="Pages every writer writes before the next round starts. Defaults to 'nr_pages_to_fillup_buffer'.")
+    parser.add_argument("--write-mode", choices=WriteBuffer.write_modes, default='keep_open', help="How entries reach trace_marker.")
+    parser.add_argument("--per-cpu-pipes", action='store_true', help="Read per_cpu/cpuN/trace_pipe instead of trace_pipe.")
+    parser.add_argument("--allow-lost", action='store_true', help="Do not fail when entries were lost, e.g. overwritten because the reader could not keep up.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = Helpers.get_config(args.config_file)
+    try:
+        cpus = [int(cpu.strip()) for cpu in args.cpus.split(',')]
+    except Exception as err:
+        raise ArgumentError('Error in argument "--cpus". Details: {}'.format(str(err)))
+    report = soak(config, cpus, args.entries_per_page, args.duration, args.pages_per_round, args.write_mode, per_cpu_pipes=args.per_cpu_pipes,
+                  progress=lambda report: print(str(report).split('\n', 1)[0], flush=True))
+    print(report)
+    if not report.ok(args.allow_lost):
+        raise OnlineCheckError('The online check failed.')
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
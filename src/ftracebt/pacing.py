@@ -0,0 +1,170 @@
+import copy
+import math
+import time
+import random
+from helper import ArgumentError
+
+
+class PacingProfile:
+    jitter_distributions = ['none', 'uniform', 'normal', 'poisson']
+
+    def __init__(self, rate, burst_on_ms=0, burst_off_ms=0, ramp_ms=0, ramp_from=0, jitter='none', jitter_us=0, seed=None):
+        if rate <= 0:
+            raise ArgumentError('The pacing rate must be a positive number of entries per second. Rate: {}'.format(rate))
+        if jitter not in PacingProfile.jitter_distributions:
+            raise ArgumentError('Unknown jitter distribution: "{}". Valid distributions: {}'.format(jitter, ', '.join(PacingProfile.jitter_distributions)))
+        if bool(burst_on_ms) != bool(burst_off_ms):
+            raise ArgumentError('Bursts need both an on and an off period. On: {} ms. Off: {} ms.'.format(burst_on_ms, burst_off_ms))
+        self.rate = rate
+        self.burst_on_ns = int(burst_on_ms * 1000000)
+        self.burst_off_ns = int(burst_off_ms * 1000000)
+        self.ramp_ns = int(ramp_ms * 1000000)
+        self.ramp_from = ramp_from
+        self.jitter = jitter
+        self.jitter_ns = int(jitter_us * 1000)
+        self.seed = seed
+
+    def with_seed(self, seed):
+        profile = copy.copy(self)
+        profile.seed = seed
+        return profile
+
+    def rate_at(self, elapsed_ns):
+        if self.ramp_ns and elapsed_ns < self.ramp_ns:
+            return self.ramp_from + (self.rate - self.ramp_from) * elapsed_ns / self.ramp_ns
+        return self.rate
+
+    def entries_at(self, elapsed_ns):
+        # Entries due in the first elapsed_ns, the integral of rate_at().
+        if self.ramp_ns and elapsed_ns < self.ramp_ns:
+            return (self.ramp_from + self.rate_at(elapsed_ns)) / 2 * elapsed_ns / 1000000000
+        return ((self.ramp_from + self.rate) / 2 * self.ramp_ns + self.rate * (elapsed_ns - self.ramp_ns)) / 1000000000
+
+    def time_of(self, nr_entries):
+        # The inverse of entries_at(): when nr_entries entries are due. A
+        # ramp from 0 does not stall on its first entries this way.
+        ramp_entries = self.entries_at(self.ramp_ns)
+        if not self.ramp_ns or nr_entries >= ramp_entries:
+            return self.ramp_ns + (nr_entries - ramp_entries) * 1000000000 / self.rate
+        start = self.ramp_from / 1000000000
+        slope = (self.rate - self.ramp_from) / 1000000000 / self.ramp_ns
+        # Root of slope / 2 * t^2 + start * t = nr_entries, written so it
+        # also holds for a flat or a descending ramp.
+        return 2 * nr_entries / (start + math.sqrt(max(start * start + 2 * slope * nr_entries, 0.0)))
+
+    def next_on(self, elapsed_ns):
+        if not self.burst_on_ns:
+            return elapsed_ns
+        period = self.burst_on_ns + self.burst_off_ns
+        phase = elapsed_ns % period
+        if phase < self.burst_on_ns:
+            return elapsed_ns
+        return elapsed_ns - phase + period
+
+    def __str__(self):
+        details = ['rate: {} entries/s'.format(self.rate)]
+        if self.burst_on_ns:
+            details.append('bursts: {}/{} ms on/off'.format(self.burst_on_ns / 1000000, self.burst_off_ns / 1000000))
+        if self.ramp_ns:
+            details.append('ramp: {} ms from {} entries/s'.format(self.ramp_ns / 1000000, self.ramp_from))
+        if self.jitter != 'none':
+            details.append('jitter: {} {} us seed {}'.format(self.jitter, self.jitter_ns / 1000, self.seed))
+        return ', '.join(details)
+
+
+class PacingReport:
+    def __init__(self, profile, nr_entries, scheduled_ns, elapsed_ns, late_ns, max_late_ns):
+        self.profile = profile
+        self.nr_entries = nr_entries
+        self.scheduled_ns = scheduled_ns
+        self.elapsed_ns = elapsed_ns
+        self.late_ns = late_ns
+        self.max_late_ns = max_late_ns
+
+    def target_rate(self):
+        return self.nr_entries * 1000000000 / self.scheduled_ns if self.scheduled_ns else 0.0
+
+    def achieved_rate(self):
+        return self.nr_entries * 1000000000 / self.elapsed_ns if self.elapsed_ns else 0.0
+
+    def as_dict(self):
+        return {
+            'nr_entries': self.nr_entries,
+            'target_rate': self.target_rate(),
+            'achieved_rate': self.achieved_rate(),
+            'mean_late_ns': self.late_ns / self.nr_entries if self.nr_entries else 0.0,
+            'max_late_ns': self.max_late_ns
+        }
+
+    def __str__(self):
+        report = self.as_dict()
+        return 'Pacing ({}). Entries: {} Target: {:.0f} entries/s Achieved: {:.0f} entries/s Mean late: {:.1f} us Max late: {:.1f} us'.format(
+            self.profile, report['nr_entries'], report['target_rate'], report['achieved_rate'], report['mean_late_ns'] / 1000, report['max_late_ns'] / 1000)
+
+
+class Pacer:
+    # now_ns and sleep are the clock, time.perf_counter_ns and time.sleep
+    # unless a test replaces them.
+    def __init__(self, profile, spin_ns=200000, now_ns=time.perf_counter_ns, sleep=time.sleep):
+        self.profile = profile
+        self.spin_ns = spin_ns
+        self.now_ns = now_ns
+        self.sleep = sleep
+        self.random = random.Random(profile.seed)
+        self.start_ns = None
+
+    def start(self):
+        self.start_ns = self.now_ns()
+        self.schedule_ns = 0
+        self.due_entries = 0.0
+        self.active_ns = 0
+        self.nr_entries = 0
+        self.late_ns = 0
+        self.max_late_ns = 0
+
+    def _interval_ns(self, nr_entries):
+        # The schedule follows the entries due by the profile over the
+        # time spent in the on periods, so a ramp paces every entry at the
+        # rate of its own moment. With poisson jitter the entries are
+        # counted with exponential intervals of mean one.
+        if self.profile.jitter == 'poisson':
+            self.due_entries += sum(self.random.expovariate(1.0) for i in range(nr_entries))
+        else:
+            self.due_entries += nr_entries
+        active_ns = int(self.profile.time_of(self.due_entries))
+        interval_ns = active_ns - self.active_ns
+        self.active_ns = active_ns
+        return interval_ns
+
+    def _jitter_ns(self):
+        if self.profile.jitter == 'uniform':
+            return int(self.random.uniform(-self.profile.jitter_ns, self.profile.jitter_ns))
+        if self.profile.jitter == 'normal':
+            return int(self.random.gauss(0, self.profile.jitter_ns))
+        return 0
+
+    def _wait_until(self, deadline_ns):
+        remaining = deadline_ns - self.now_ns()
+        if remaining > self.spin_ns:
+            self.sleep((remaining - self.spin_ns) / 1000000000)
+        now = self.now_ns()
+        while now < deadline_ns:
+            now = self.now_ns()
+        return now
+
+    def wait(self, nr_entries=1):
+        if self.start_ns is None:
+            self.start()
+        self.schedule_ns = self.profile.next_on(self.schedule_ns)
+        deadline_ns = self.start_ns + max(self.schedule_ns + self._jitter_ns(), 0)
+        now = self._wait_until(deadline_ns)
+        late = now - deadline_ns
+        self.late_ns += late * nr_entries
+        self.max_late_ns = max(self.max_late_ns, late)
+        self.nr_entries += nr_entries
+        self.schedule_ns += self._interval_ns(nr_entries)
+
+    def report(self):
+        if self.start_ns is None:
+            return PacingReport(self.profile, 0, 0, 0, 0, 0)
+        return PacingReport(self.profile, self.nr_entries, self.schedule_ns, self.now_ns() - self.start_ns, self.late_ns, self.max_late_ns)
@@ -0,0 +1,180 @@
+import os
+import itertools
+import contextlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from capture import read_and_save
+from ftrace import Check
+from ftrace import CheckingEntriesOrderError
+from ftrace import CheckingMarkerPagesError
+from ftrace import MarkerPagesReportError
+from ftrace import ReadBuffer
+from ftrace import UnexpectedCpuEntriesError
+from profiling import Spans
+
+
+class _Shared:
+    # Records and per-CPU indexes of the checks in progress, by check id. The
+    # check workers are forked after they are set, so they inherit them
+    # instead of receiving pickled copies. Every check has its own id, so
+    # checks running in other threads don't overwrite them.
+    checks = {}
+    ids = itertools.count()
+
+
+def _read_records(config, read_size, trace_filename, capture_filename=None, metadata=None):
+    if capture_filename is not None:
+        return read_and_save(config, trace_filename, capture_filename, metadata, read_size)
+    return ReadBuffer(config, read_size).get_records(trace_filename)
+
+
+def _check_marker_pages(check_id, file_nr, cpu, entries_per_page, nr_pages, first_page_id, fail_fast, verify_mode):
+    records, per_cpu = _Shared.checks[check_id]
+    try:
+        report = Check.marker_pages_report(records[file_nr], entries_per_page, cpu, nr_pages, first_page_id,
+                                           per_cpu[file_nr][cpu], fail_fast, verify_mode)
+    except CheckingMarkerPagesError as err:
+        return (None, str(err))
+    # The records are attached again by the parent, don't send them back.
+    report.records = None
+    return (report, None)
+
+
+def _check_order(check_id, file_nr):
+    records, _ = _Shared.checks[check_id]
+    try:
+        Check.merged_buffers(records[file_nr])
+    except CheckingEntriesOrderError as err:
+        return str(err)
+    return None
+
+
+class ParallelCheckReport:
+    def __init__(self, trace_filenames, records, marker_reports, fail_fast_errors, order_errors):
+        self.trace_filenames = trace_filenames
+        self.records = records
+        self.marker_reports = marker_reports
+        self.fail_fast_errors = fail_fast_errors
+        self.order_errors = order_errors
+
+    def failed_marker_reports(self):
+        return [report for report in self.marker_reports if not report.ok()]
+
+    def ok(self):
+        return not (self.failed_marker_reports() or self.fail_fast_errors or self.order_errors)
+
+    def raise_errors(self):
+        if self.fail_fast_errors:
+            raise CheckingMarkerPagesError(' '.join(self.fail_fast_errors))
+        failed = self.failed_marker_reports()
+        if failed:
+            raise MarkerPagesReportError(failed)
+        if self.order_errors:
+            raise CheckingEntriesOrderError(' '.join(self.order_errors))
+
+    def __str__(self):
+        lines = [str(report) for report in self.marker_reports]
+        lines.extend(self.fail_fast_errors)
+        lines.extend(self.order_errors)
+        return '\n'.join(lines)
+
+
+class ParallelCheck:
+    # Reads every trace file in its own thread and then fans out the per-CPU
+    # page verification and the ordering checks over one pool of forked
+    # workers. The workers are forked once the files are read and only
+    # check records, so no lock of the tracefs backend, e.g. the one of
+    # SimulatedTracefs taken by a sampler thread, is needed in them. Results are merged in file and CPU order, so the report does
+    # not depend on which worker finished first. With one worker everything
+    # runs in this process. With a capture_dir every file read is also saved
+    # there as a capture, named after capture_name, so the checks can be
+    # replayed offline with replay.py. verify_mode is a VerifyMode, None
+    # compares every line.
+    def __init__(self, config, workers=None, read_size=65536, capture_dir=None, verify_mode=None):
+        self.config = config
+        self.verify_mode = verify_mode
+        self.workers = workers or os.cpu_count()
+        self.read_size = read_size
+        self.capture_dir = capture_dir
+        self.capture_name = 'check'
+        self.nr_captures = 0
+
+    def set_capture_name(self, name):
+        self.capture_name = name
+        self.nr_captures = 0
+
+    def capture_filenames(self, trace_filenames):
+        if not self.capture_dir:
+            return [None] * len(trace_filenames)
+        os.makedirs(self.capture_dir, exist_ok=True)
+        self.nr_captures += 1
+        return [os.path.join(self.capture_dir, '{}-{}-{}.ftcap'.format(self.capture_name, self.nr_captures, os.path.basename(trace_filename)))
+                for trace_filename in trace_filenames]
+
+    def _pool(self, nr_tasks, pool_class):
+        # A pool for nr_tasks tasks, None when they run in this thread.
+        if self.workers <= 1 or nr_tasks <= 1:
+            return contextlib.nullcontext()
+        return pool_class(min(self.workers, nr_tasks))
+
+    def _map(self, pool, function, tasks):
+        if pool is None:
+            return [function(*task) for task in tasks]
+        return pool.starmap(function, tasks, chunksize=max(1, len(tasks) // (min(self.workers, len(tasks)) * 4)))
+
+    @Spans.span('parallelcheck.read')
+    def read_records(self, trace_filenames, metadata=None):
+        capture_filenames = self.capture_filenames(trace_filenames)
+        tasks = [(self.config, self.read_size, trace_filename, capture_filename, metadata)
+                 for trace_filename, capture_filename in zip(trace_filenames, capture_filenames)]
+        with self._pool(len(tasks), ThreadPool) as pool:
+            return self._map(pool, _read_records, tasks)
+
+    def check(self, trace_filenames, cpus, entries_per_page, nr_pages, first_page_id=1, merged=True, fail_fast=False):
+        metadata = {'check': {'cpus': cpus, 'entries_per_page': entries_per_page, 'nr_pages': nr_pages, 'first_page_id': first_page_id, 'merged': merged}}
+        records = self.read_records(trace_filenames, metadata)
+        return self.check_records(trace_filenames, records, cpus, entries_per_page, nr_pages, first_page_id, merged, fail_fast)
+
+    @Spans.span('parallelcheck.check')
+    def check_records(self, trace_filenames, records, cpus, entries_per_page, nr_pages, first_page_id=1, merged=True, fail_fast=False):
+        per_cpu = []
+        for trace_filename, file_records in zip(trace_filenames, records):
+            cpu_indexes, unexpected = file_records.split_per_cpu(cpus)
+            if unexpected:
+                raise UnexpectedCpuEntriesError('{}: There are {} entries that do not belong to the CPUs in use {}. First one at index {}: {}'.format(
+                    trace_filename, len(unexpected), cpus, unexpected[0], file_records.line(unexpected[0])))
+            per_cpu.append(cpu_indexes)
+        check_id = next(_Shared.ids)
+        marker_tasks = [(check_id, file_nr, cpu, entries_per_page, nr_pages, first_page_id, fail_fast, self.verify_mode) for file_nr in range(len(records)) for cpu in cpus]
+        order_tasks = [(check_id, file_nr) for file_nr in range(len(records))] if merged else []
+        _Shared.checks[check_id] = (records, per_cpu)
+        try:
+            with self._pool(len(marker_tasks) + len(order_tasks), multiprocessing.get_context('fork').Pool) as pool:
+                results = self._map(pool, _check_marker_pages, marker_tasks)
+                order_results = self._map(pool, _check_order, order_tasks)
+        finally:
+            del _Shared.checks[check_id]
+        marker_reports = []
+        fail_fast_errors = []
+        for (_, file_nr, *_), (report, error) in zip(marker_tasks, results):
+            if error is not None:
+                fail_fast_errors.append('{}: {}'.format(trace_filenames[file_nr], error))
+                continue
+            report.records = records[file_nr]
+            report.source = trace_filenames[file_nr]
+            marker_reports.append(report)
+        order_errors = ['{}: {}'.format(trace_filenames[file_nr], error) for (_, file_nr), error in zip(order_tasks, order_results) if error is not None]
+        return ParallelCheckReport(trace_filenames, records, marker_reports, fail_fast_errors, order_errors)
+
+    def exact_marker_pages(self, trace_filenames, entries_per_page, cpu, pages_written, fail_fast=False):
+        nr_pages, first_page_id = Check.get_nr_pages_and_first_page_id(self.config, pages_written)
+        report = self.check(trace_filenames, [cpu], entries_per_page, nr_pages, first_page_id, merged=False, fail_fast=fail_fast)
+        report.raise_errors()
+        return report
+
+    def per_cpu_content(self, trace_filenames, writer_name, cpus_to_use, entries_per_page, fail_fast=False):
+        pages_written = Check._get_nr_pages_from(self.config, writer_name)
+        nr_pages, first_page_id = Check.get_nr_pages_and_first_page_id(self.config, pages_written)
+        report = self.check(trace_filenames, cpus_to_use, entries_per_page, nr_pages, first_page_id, merged=True, fail_fast=fail_fast)
+        report.raise_errors()
+        return report
@@ -0,0 +1,179 @@
+import os
+import json
+import time
+import threading
+from functools import wraps
+
+
+class _Timer:
+    def __init__(self, name):
+        self.name = name
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        Spans.add(self.name, time.perf_counter_ns() - self.start)
+        return False
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Spans:
+    # Timing and counter spans around the write, read and check phases.
+    # Disabled, which is the default, a span costs a function call and one
+    # flag test. Enabled, every span adds its perf_counter_ns duration to
+    # the calls, total and max of its name. Spans nest, e.g. 'read' includes
+    # 'read.header'. Forked workers keep their spans, the span of the parent
+    # around the fan out accounts for them.
+    enabled = False
+    lock = threading.Lock()
+    totals = {}
+    counters = {}
+    no_timer = _NoTimer()
+
+    @staticmethod
+    def enable():
+        Spans.enabled = True
+
+    @staticmethod
+    def disable():
+        Spans.enabled = False
+
+    @staticmethod
+    def after_fork():
+        # The lock may be held by a thread of the parent that the child
+        # doesn't have.
+        Spans.lock = threading.Lock()
+
+    @staticmethod
+    def reset():
+        with Spans.lock:
+            Spans.totals = {}
+            Spans.counters = {}
+
+    @staticmethod
+    def take():
+        # The spans and counters since the last reset, which starts again.
+        with Spans.lock:
+            totals, counters = Spans.totals, Spans.counters
+            Spans.totals = {}
+            Spans.counters = {}
+        return (totals, counters)
+
+    @staticmethod
+    def add(name, duration_ns):
+        with Spans.lock:
+            total = Spans.totals.get(name)
+            if total is None:
+                Spans.totals[name] = [1, duration_ns, duration_ns]
+                return
+            total[0] += 1
+            total[1] += duration_ns
+            if duration_ns > total[2]:
+                total[2] = duration_ns
+
+    @staticmethod
+    def count(name, n=1):
+        if not Spans.enabled:
+            return
+        with Spans.lock:
+            Spans.counters[name] = Spans.counters.get(name, 0) + n
+
+    @staticmethod
+    def timed(name):
+        # with Spans.timed('read.header'): ...
+        return _Timer(name) if Spans.enabled else Spans.no_timer
+
+    @staticmethod
+    def span(name):
+        # Decorator timing every call of a function. Generator functions
+        # are timed up to the creation of the generator only, time the
+        # loop that consumes them instead.
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not Spans.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter_ns()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    Spans.add(name, time.perf_counter_ns() - start)
+            return wrapper
+        return decorator
+
+
+os.register_at_fork(after_in_child=Spans.after_fork)
+
+
+class SpanReport:
+    # Spans and counters collected per test, see the --profile-spans option
+    # of conftest.py.
+    def __init__(self):
+        self.tests = {}
+
+    def add(self, test_name, duration_ns, totals, counters):
+        self.tests[test_name] = {
+            'duration_ns': duration_ns,
+            'spans': {name: {'calls': calls, 'total_ns': total_ns, 'max_ns': max_ns} for name, (calls, total_ns, max_ns) in sorted(totals.items())},
+            'counters': dict(sorted(counters.items())),
+        }
+
+    def phases(self):
+        phases = {}
+        for test in self.tests.values():
+            for name, span in test['spans'].items():
+                phase = phases.setdefault(name, {'calls': 0, 'total_ns': 0, 'max_ns': 0})
+                phase['calls'] += span['calls']
+                phase['total_ns'] += span['total_ns']
+                phase['max_ns'] = max(phase['max_ns'], span['max_ns'])
+        return phases
+
+    def counters(self):
+        counters = {}
+        for test in self.tests.values():
+            for name, value in test['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+        return counters
+
+    def as_dict(self):
+        return {
+            'duration_ns': sum(test['duration_ns'] for test in self.tests.values()),
+            'phases': self.phases(),
+            'counters': self.counters(),
+            'tests': self.tests,
+        }
+
+    def export(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def summary_lines(self, slowest=5):
+        duration_ns = sum(test['duration_ns'] for test in self.tests.values())
+        lines = ['{:<36} {:>8} {:>12} {:>7} {:>12} {:>12}'.format('Phase', 'Calls', 'Total ms', '% time', 'Mean us', 'Max ms')]
+        for name, phase in sorted(self.phases().items(), key=lambda item: -item[1]['total_ns']):
+            lines.append('{:<36} {:>8} {:>12.3f} {:>7.1f} {:>12.1f} {:>12.3f}'.format(
+                name, phase['calls'], phase['total_ns'] / 1e6, 100 * phase['total_ns'] / duration_ns if duration_ns else 0,
+                phase['total_ns'] / phase['calls'] / 1e3, phase['max_ns'] / 1e6))
+        counters = self.counters()
+        if counters:
+            lines.append('Counters:')
+        for name, value in sorted(counters.items()):
+            lines.append('{:<36} {:>8}'.format(name, value))
+        tests = sorted(self.tests.items(), key=lambda item: -item[1]['duration_ns'])[:slowest]
+        if tests:
+            lines.append('Slowest tests:')
+        for test_name, test in tests:
+            phases = sorted(test['spans'].items(), key=lambda item: -item[1]['total_ns'])[:3]
+            lines.append('{:10.3f} ms {} ({})'.format(test['duration_ns'] / 1e6, test_name,
+                                                    ', '.join('{} {:.3f} ms'.format(name, span['total_ns'] / 1e6) for name, span in phases) or 'no spans'))
+        return lines
@@ -0,0 +1,252 @@
+import os
+import heapq
+import struct
+from helper import Helpers
+from records import TraceRecords
+
+
+class RawPageError(Exception):
+    pass
+
+
+class RawPage:
+    # struct buffer_data_page: u64 time_stamp; local_t commit; then the events.
+    header = struct.Struct('<QQ')
+    missed_events_flag = 1 << 31
+    missed_stored_flag = 1 << 30
+
+    def __init__(self, timestamp, size, missed_events, data):
+        self.timestamp = timestamp
+        self.size = size
+        self.missed_events = missed_events
+        self.data = data
+
+    @staticmethod
+    def decode(page):
+        if len(page) < RawPage.header.size:
+            raise RawPageError('Page too short: {} bytes.'.format(len(page)))
+        timestamp, commit = RawPage.header.unpack_from(page)
+        size = commit & ~(RawPage.missed_events_flag | RawPage.missed_stored_flag)
+        end = RawPage.header.size + size
+        if end > len(page):
+            raise RawPageError('Page commit ({}) is bigger than the page ({} bytes).'.format(size, len(page)))
+        missed_events = None
+        if commit & RawPage.missed_stored_flag:
+            missed_events = struct.unpack_from('<Q', page, end)[0]
+        elif commit & RawPage.missed_events_flag:
+            missed_events = -1
+        return RawPage(timestamp, size, missed_events, page[RawPage.header.size:end])
+
+
+class RawEvents:
+    # Ring buffer event header: u32 type_len:5, time_delta:27, then array[].
+    data_type_len_max = 28
+    padding = 29
+    time_extend = 30
+    time_stamp = 31
+    ts_shift = 27
+    ts_msb = 0xf << 59
+
+    @staticmethod
+    def iter_page(page):
+        ts = page.timestamp
+        data = page.data
+        offset = 0
+        size = len(data)
+        while offset + 4 <= size:
+            type_len_ts = struct.unpack_from('<I', data, offset)[0]
+            type_len = type_len_ts & 0x1f
+            time_delta = type_len_ts >> 5
+            if type_len == RawEvents.padding:
+                if not time_delta:
+                    return
+                offset += 4 + struct.unpack_from('<I', data, offset + 4)[0]
+            elif type_len == RawEvents.time_extend:
+                ts += (struct.unpack_from('<I', data, offset + 4)[0] << RawEvents.ts_shift) | time_delta
+                offset += 8
+            elif type_len == RawEvents.time_stamp:
+                abs_ts = (struct.unpack_from('<I', data, offset + 4)[0] << RawEvents.ts_shift) | time_delta
+                if abs_ts < ts:
+                    abs_ts |= ts & RawEvents.ts_msb
+                ts = abs_ts
+                offset += 8
+            else:
+                ts += time_delta
+                if type_len:
+                    begin = offset + 4
+                    length = type_len * 4
+                else:
+                    begin = offset + 8
+                    length = struct.unpack_from('<I', data, offset + 4)[0] - 4
+                if begin + length > size:
+                    raise RawPageError('Event at offset {} goes beyond the page commit ({}).'.format(offset, size))
+                yield (ts, data[begin:begin + length])
+                offset = begin + length
+
+
+class RawPrint:
+    # struct trace_entry followed by the ftrace/print fields (ip, buf[]).
+    entry = struct.Struct('<HBBi')
+    ip = struct.Struct('<Q')
+    buf_offset = entry.size + ip.size
+    event_id = 5
+    irqs_off = 0x01
+    irqs_nosupport = 0x02
+    need_resched = 0x04
+    hardirq = 0x08
+    softirq = 0x10
+    preempt_resched = 0x20
+    nmi = 0x40
+
+    @staticmethod
+    def lat_flags(flags, preempt_count):
+        irqs = 'd' if flags & RawPrint.irqs_off else 'X' if flags & RawPrint.irqs_nosupport else '.'
+        if flags & RawPrint.need_resched and flags & RawPrint.preempt_resched:
+            resched = 'N'
+        elif flags & RawPrint.need_resched:
+            resched = 'n'
+        elif flags & RawPrint.preempt_resched:
+            resched = 'p'
+        else:
+            resched = '.'
+        hardirq = flags & RawPrint.hardirq
+        softirq = flags & RawPrint.softirq
+        if flags & RawPrint.nmi:
+            irq = 'Z' if hardirq else 'z'
+        else:
+            irq = 'H' if hardirq and softirq else 'h' if hardirq else 's' if softirq else '.'
+        return irqs + resched + irq + ('{:x}'.format(preempt_count & 0xf) if preempt_count & 0xf else '.')
+
+    @staticmethod
+    def decode(data):
+        event_type, flags, preempt_count, pid = RawPrint.entry.unpack_from(data)
+        buf = bytes(data[RawPrint.buf_offset:])
+        end = buf.find(b'\0')
+        if end != -1:
+            buf = buf[:end]
+        return (event_type, flags, preempt_count, pid, buf.rstrip(b'\n').decode(errors='replace'))
+
+    @staticmethod
+    def encode(pid, text, flags=0, preempt_count=0, ip=0, event_id=None):
+        if event_id is None:
+            event_id = RawPrint.event_id
+        payload = text.encode()
+        if not payload.endswith(b'\n'):
+            payload += b'\n'
+        return RawPrint.entry.pack(event_id, flags, preempt_count, pid) + RawPrint.ip.pack(ip) + payload + b'\0'
+
+
+class RawPageBuilder:
+    max_small_data = RawEvents.data_type_len_max * 4
+
+    def __init__(self, page_size, timestamp):
+        self.page = bytearray(page_size)
+        self.timestamp = timestamp
+        self.last_timestamp = timestamp
+        self.offset = RawPage.header.size
+        self.missed_events = None
+
+    @staticmethod
+    def event_length(length):
+        length = (length + 3) & ~3
+        return length + (8 if length > RawPageBuilder.max_small_data else 4)
+
+    def fits(self, length, timestamp):
+        delta = timestamp - self.last_timestamp
+        extend = 8 if delta >= 1 << RawEvents.ts_shift else 0
+        return self.offset + extend + RawPageBuilder.event_length(length) <= len(self.page)
+
+    def add_event(self, timestamp, body):
+        if not self.fits(len(body), timestamp):
+            return False
+        delta = timestamp - self.last_timestamp
+        if delta < 0:
+            raise RawPageError('Timestamps must not go backwards inside a page.')
+        if delta >= 1 << RawEvents.ts_shift:
+            struct.pack_into('<II', self.page, self.offset, RawEvents.time_extend | ((delta & ((1 << RawEvents.ts_shift) - 1)) << 5), delta >> RawEvents.ts_shift)
+            self.offset += 8
+            delta = 0
+        length = (len(body) + 3) & ~3
+        if length > RawPageBuilder.max_small_data:
+            struct.pack_into('<II', self.page, self.offset, delta << 5, length + 4)
+            self.offset += 8
+        else:
+            struct.pack_into('<I', self.page, self.offset, (length // 4) | (delta << 5))
+            self.offset += 4
+        self.page[self.offset:self.offset + len(body)] = body
+        self.offset += length
+        self.last_timestamp = timestamp
+        return True
+
+    def add_print(self, timestamp, pid, text, flags=0, preempt_count=0, event_id=None):
+        return self.add_event(timestamp, RawPrint.encode(pid, text, flags, preempt_count, event_id=event_id))
+
+    def add_padding(self, length, discarded=True):
+        if self.offset + length > len(self.page) or length < 8:
+            raise RawPageError('Padding of {} bytes does not fit.'.format(length))
+        struct.pack_into('<II', self.page, self.offset, RawEvents.padding | ((1 if discarded else 0) << 5), length - 4)
+        self.offset += length
+
+    def to_bytes(self):
+        commit = self.offset - RawPage.header.size
+        if self.missed_events is not None:
+            struct.pack_into('<Q', self.page, self.offset, self.missed_events)
+            commit |= RawPage.missed_events_flag | RawPage.missed_stored_flag
+        RawPage.header.pack_into(self.page, 0, self.timestamp, commit)
+        return bytes(self.page)
+
+
+class RawBufferReader:
+    def __init__(self, config, page_size=None, print_event_id=None):
+        self.config = config
+        self.page_size = page_size or os.sysconf('SC_PAGE_SIZE')
+        self.print_event_id = print_event_id or self.get_print_event_id()
+
+    def get_print_event_id(self):
+        with Helpers.backend.open_text(self.config['print_event_format_file']) as f:
+            for line in f:
+                if line.startswith('ID:'):
+                    return int(line.split(':')[1])
+        raise RawPageError('No event ID in: "{}"'.format(self.config['print_event_format_file']))
+
+    def iter_pages(self, raw_filename):
+        raw = Helpers.backend.open_raw(raw_filename)
+        try:
+            page = bytearray(self.page_size)
+            view = memoryview(page)
+            while True:
+                nr_bytes = raw.readinto(page)
+                if not nr_bytes:
+                    return
+                yield RawPage.decode(view[:nr_bytes])
+        finally:
+            raw.close()
+
+    def iter_prints(self, raw_filename):
+        for page in self.iter_pages(raw_filename):
+            for ts, data in RawEvents.iter_page(page):
+                if len(data) < RawPrint.buf_offset or RawPrint.entry.unpack_from(data)[0] != self.print_event_id:
+                    continue
+                _, flags, preempt_count, pid, text = RawPrint.decode(data)
+                yield (ts, pid, RawPrint.lat_flags(flags, preempt_count), text)
+
+    def read_records(self, raw_filename, cpu, records=None):
+        if records is None:
+            records = TraceRecords()
+        for ts, pid, flags, text in self.iter_prints(raw_filename):
+            records.append('<...>', pid, cpu, flags, ts, 'tracing_mark_write: ' + text)
+        return records
+
+    def read_cpu(self, cpu):
+        return self.read_records(self.config['trace_pipe_raw_file'].format(cpu), cpu)
+
+    def _iter_cpu_prints(self, cpu):
+        for ts, pid, flags, text in self.iter_prints(self.config['trace_pipe_raw_file'].format(cpu)):
+            yield (ts, cpu, pid, flags, text)
+
+    def read_cpus(self, cpus):
+        per_cpu = [self._iter_cpu_prints(cpu) for cpu in cpus]
+        records = TraceRecords()
+        for ts, cpu, pid, flags, text in heapq.merge(*per_cpu):
+            records.append('<...>', pid, cpu, flags, ts, 'tracing_mark_write: ' + text)
+        return records
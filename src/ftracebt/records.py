@@ -0,0 +1,85 @@
+import re
+import sys
+from array import array
+
+
+class ParsingTraceRecordError(Exception):
+    pass
+
+
+class TraceRecords:
+    line_pattern = re.compile(r'\s*(?P<task>.*?)-(?P<pid>\d+)\s+(?:\(\s*[\d-]+\)\s+)?\[(?P<cpu>\d+)\]\s+(?:(?P<flags>\S{4,6})\s+)?(?P<sec>\d+)\.(?P<frac>\d{1,9}):\s(?P<payload>.*)')
+    annotation = ' buffer started ####'
+
+    def __init__(self):
+        self.tasks = []
+        self.pids = array('q')
+        self.cpus = array('q')
+        self.flags = []
+        self.timestamps = array('q')
+        self.payloads = []
+        # Digits of the fraction of second of every timestamp, e.g. 9 with
+        # the counter clocks, to show it as the kernel wrote it.
+        self.frac_digits = array('b')
+        self.nr_annotations = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def parse(lines):
+        records = TraceRecords()
+        for line in lines:
+            records.append_line(line)
+        return records
+
+    @staticmethod
+    def from_content(content):
+        if isinstance(content, TraceRecords):
+            return content
+        return TraceRecords.parse(content)
+
+    @staticmethod
+    def timestamp_ns(sec, frac):
+        return int(sec) * 1000000000 + int(frac) * 10 ** (9 - len(frac))
+
+    def append(self, task, pid, cpu, flags, timestamp, payload, frac_digits=6):
+        self.tasks.append(sys.intern(task))
+        self.pids.append(pid)
+        self.cpus.append(cpu)
+        self.flags.append(sys.intern(flags) if flags else '')
+        self.timestamps.append(timestamp)
+        self.payloads.append(payload)
+        self.frac_digits.append(frac_digits)
+
+    def append_line(self, line):
+        if line.find(TraceRecords.annotation) != -1:
+            self.nr_annotations += 1
+            return
+        match = TraceRecords.line_pattern.match(line.rstrip('\n'))
+        if match is None:
+            raise ParsingTraceRecordError('Error while parsing trace record number {}. Line: {}'.format(len(self), line))
+        frac = match.group('frac')
+        self.append(match.group('task'), int(match.group('pid')), int(match.group('cpu')), match.group('flags'),
+                    TraceRecords.timestamp_ns(match.group('sec'), frac), match.group('payload'), len(frac))
+
+    def split_per_cpu(self, cpus):
+        per_cpu = {cpu: array('q') for cpu in cpus}
+        unexpected = array('q')
+        for i, cpu in enumerate(self.cpus):
+            cpu_indexes = per_cpu.get(cpu)
+            if cpu_indexes is None:
+                unexpected.append(i)
+            else:
+                cpu_indexes.append(i)
+        return (per_cpu, unexpected)
+
+    @staticmethod
+    def format_line(task, pid, cpu, flags, timestamp, payload, frac_digits=6):
+        # Without flags the trace had no irq-info column.
+        sec, nsec = divmod(timestamp, 1000000000)
+        return '{:>16}-{:<7} [{:03}] {}{:5}.{:0{}}: {}'.format(task, pid, cpu, flags + ' ' if flags else '', sec,
+                                                            nsec // 10 ** (9 - frac_digits), frac_digits, payload)
+
+    def line(self, i):
+        return TraceRecords.format_line(self.tasks[i], self.pids[i], self.cpus[i], self.flags[i], self.timestamps[i], self.payloads[i], self.frac_digits[i])
@@ -0,0 +1,80 @@
+import argparse
+from capture import TraceCapture
+from ftrace import Check
+from helper import ArgumentError
+from parallelcheck import ParallelCheck
+
+
+class CaptureReplayError(Exception):
+    pass
+
+
+def replay(filenames, cpus=None, entries_per_page=None, nr_pages=None, first_page_id=None, merged=None, workers=1, fail_fast=False):
+    # Runs the checks again on the captures. Whatever is not given comes
+    # from the parameters recorded with the first capture.
+    captures = [TraceCapture(filename) for filename in filenames]
+    try:
+        recorded = captures[0].metadata.get('check', {})
+        cpus = cpus if cpus is not None else recorded.get('cpus')
+        entries_per_page = entries_per_page or recorded.get('entries_per_page')
+        nr_pages = nr_pages or recorded.get('nr_pages')
+        first_page_id = first_page_id or recorded.get('first_page_id', 1)
+        merged = merged if merged is not None else recorded.get('merged', True)
+        if cpus is None or entries_per_page is None or nr_pages is None:
+            raise CaptureReplayError('The captures do not record the check parameters. Give the CPUs, the entries per page and the number of pages.')
+        records = [capture.records() for capture in captures]
+        config = captures[0].metadata.get('config', {})
+    finally:
+        for capture in captures:
+            capture.close()
+    return ParallelCheck(config, workers).check_records(filenames, records, cpus, entries_per_page, nr_pages, first_page_id, merged, fail_fast)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inspect trace captures and replay the buffer checks on them offline.')
+    parser.add_argument("captures", nargs='+', help="Capture files, e.g. the ones written by pytest --capture-dir.")
+    parser.add_argument("--action", choices=['replay', 'info', 'dump', 'compare'], default='replay',
+                        help="'replay' runs the marker page and ordering checks again, 'info' prints the index, 'dump' prints the records and 'compare' compares a trace capture with a persistent capture.")
+    parser.add_argument("--cpus", help="CPUs to check, e.g. --cpus 0,1. Defaults to the ones recorded with the capture. For 'dump' the CPUs to print.")
+    parser.add_argument("--entries-per-page", type=int, help="Entries per marker page. Defaults to the recorded value.")
+    parser.add_argument("--nr-pages", type=int, help="Number of pages expected per CPU. Defaults to the recorded value.")
+    parser.add_argument("--first-page-id", type=int, help="PAGE_ID of the first page expected. Defaults to the recorded value.")
+    parser.add_argument("--no-order", action='store_true', help="Skip the check of the ordering of the merged buffers.")
+    parser.add_argument("--fail-fast", action='store_true', help="Stop checking a CPU at the first problem.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of forked workers used by the checks.")
+    parser.add_argument("--start-ns", type=int, help="'dump' only prints records with a timestamp from this one on.")
+    parser.add_argument("--end-ns", type=int, help="'dump' only prints records with a timestamp before this one.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        cpus = [int(cpu.strip()) for cpu in args.cpus.split(',')] if args.cpus else None
+    except Exception as err:
+        raise ArgumentError('Error in argument "--cpus". Details: {}'.format(str(err)))
+    if args.action == 'info':
+        for filename in args.captures:
+            with TraceCapture(filename) as capture:
+                print(capture)
+    elif args.action == 'dump':
+        for filename in args.captures:
+            with TraceCapture(filename) as capture:
+                records = capture.records(cpus, args.start_ns, args.end_ns)
+            for i in range(len(records)):
+                print(records.line(i))
+    elif args.action == 'compare':
+        if len(args.captures) != 2:
+            raise ArgumentError('"--action compare" needs two captures: the trace one and the persistent one.')
+        with TraceCapture(args.captures[0]) as trace, TraceCapture(args.captures[1]) as persistent:
+            print(Check.content_trace_files(trace.iter_lines(), persistent.iter_lines()))
+    else:
+        report = replay(args.captures, cpus, args.entries_per_page, args.nr_pages, args.first_page_id,
+                        False if args.no_order else None, args.workers, args.fail_fast)
+        print(report)
+        report.raise_errors()
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
@@ -0,0 +1,164 @@
+import csv
+import json
+import time
+import threading
+from array import array
+from helper import ArgumentError
+from helper import Helpers
+
+
+class CounterSamplerError(Exception):
+    pass
+
+
+class CounterSampler:
+    # Samples the BufferInternals counters of a set of CPUs from a background
+    # thread. Every counter file is opened once and reread with pread(), and
+    # the samples go to a ring of preallocated arrays: one for the timestamps
+    # and one per (cpu, counter). When the ring is full the oldest samples
+    # are overwritten. By default the counters whose files the configuration
+    # lacks, e.g. the ones of the patched kernel on an ftrace instance, are
+    # not sampled.
+    counters = ['nr_readable_pages', 'nr_entries_commit_page', 'commit_page_commit']
+
+    def __init__(self, config, cpus, interval=0.0001, capacity=100000, counters=None):
+        if counters is None:
+            counters = [counter for counter in CounterSampler.counters if '{}_file'.format(counter) in config]
+        counters = list(counters)
+        unknown = [counter for counter in counters if counter not in CounterSampler.counters]
+        if unknown:
+            raise ArgumentError('Unknown counters: {}. Valid counters: {}'.format(', '.join(unknown), ', '.join(CounterSampler.counters)))
+        missing = [counter for counter in counters if '{}_file'.format(counter) not in config]
+        if missing:
+            raise ArgumentError('The configuration has no file for the counters: {}'.format(', '.join(missing)))
+        if capacity <= 0:
+            raise ArgumentError('The sampler capacity must be a positive number of samples: {}'.format(capacity))
+        self.config = config
+        self.cpus = list(cpus)
+        self.counters = counters
+        self.interval_ns = int(interval * 1000000000)
+        self.capacity = capacity
+        self.timestamps = array('q', bytes(8 * capacity))
+        self.values = {(cpu, counter): array('q', bytes(8 * capacity)) for cpu in self.cpus for counter in counters}
+        self.nr_samples = 0
+        self.lock = threading.Lock()
+        self.handles = []
+        self.thread = None
+        self.stopping = threading.Event()
+        self.error = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def open(self):
+        if not self.handles:
+            for cpu in self.cpus:
+                for counter in self.counters:
+                    filename = self.config['{}_file'.format(counter)].format(cpu)
+                    self.handles.append((self.values[(cpu, counter)], Helpers.backend.open_counter(filename)))
+
+    def close(self):
+        for _, handle in self.handles:
+            handle.close()
+        self.handles = []
+
+    def sample(self):
+        timestamp = time.perf_counter_ns()
+        with self.lock:
+            slot = self.nr_samples % self.capacity
+            self.timestamps[slot] = timestamp
+            for values, handle in self.handles:
+                values[slot] = handle.read()
+            self.nr_samples += 1
+
+    def start(self):
+        if self.thread is not None:
+            raise CounterSamplerError('The sampler is already running.')
+        self.open()
+        self.stopping.clear()
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.close()
+        if self.error is not None:
+            raise CounterSamplerError('Error while sampling the counters: {}'.format(self.error))
+
+    def _run(self):
+        try:
+            deadline = time.perf_counter_ns()
+            while not self.stopping.is_set():
+                self.sample()
+                deadline += self.interval_ns
+                wait_ns = deadline - time.perf_counter_ns()
+                if wait_ns > 0:
+                    self.stopping.wait(wait_ns / 1000000000)
+                else:
+                    # Too slow for the interval: don't try to catch up.
+                    deadline = time.perf_counter_ns()
+        except Exception as err:
+            self.error = '{}: {}'.format(type(err).__name__, err)
+
+    def dropped(self):
+        return max(self.nr_samples - self.capacity, 0)
+
+    def _order(self):
+        # Slots of the samples still in the ring, oldest first.
+        if self.nr_samples <= self.capacity:
+            return range(self.nr_samples)
+        first = self.nr_samples % self.capacity
+        return list(range(first, self.capacity)) + list(range(first))
+
+    def series(self, cpu, counter, start_ns=None, end_ns=None):
+        if (cpu, counter) not in self.values:
+            raise ArgumentError('Counter "{}" of CPU {} is not sampled.'.format(counter, cpu))
+        values = self.values[(cpu, counter)]
+        timestamps = array('q')
+        series = array('q')
+        with self.lock:
+            for slot in self._order():
+                timestamp = self.timestamps[slot]
+                if (start_ns is None or timestamp >= start_ns) and (end_ns is None or timestamp < end_ns):
+                    timestamps.append(timestamp)
+                    series.append(values[slot])
+        return (timestamps, series)
+
+    def changes(self, cpu, counter):
+        timestamps, series = self.series(cpu, counter)
+        return [(timestamps[i], series[i]) for i in range(len(series)) if i == 0 or series[i] != series[i - 1]]
+
+    def as_dict(self):
+        with self.lock:
+            order = list(self._order())
+            return {
+                'cpus': self.cpus,
+                'counters': self.counters,
+                'interval_ns': self.interval_ns,
+                'dropped': self.dropped(),
+                'timestamps_ns': [self.timestamps[slot] for slot in order],
+                'values': {str(cpu): {counter: [self.values[(cpu, counter)][slot] for slot in order] for counter in self.counters} for cpu in self.cpus},
+            }
+
+    def export(self, filename):
+        # JSON when the file name ends with ".json", CSV with one column per
+        # (cpu, counter) otherwise.
+        samples = self.as_dict()
+        if filename.endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump(samples, f)
+            return
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['timestamp_ns'] + ['cpu{}_{}'.format(cpu, counter) for cpu in self.cpus for counter in self.counters])
+            for i, timestamp in enumerate(samples['timestamps_ns']):
+                writer.writerow([timestamp] + [samples['values'][str(cpu)][counter][i] for cpu in self.cpus for counter in self.counters])
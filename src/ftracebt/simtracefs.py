@@ -0,0 +1,586 @@
+import io
+import os
+import time
+import asyncio
+import errno
+import heapq
+import threading
+from collections import deque
+from helper import Helpers
+from backend import TracefsBackend
+from rawtrace import RawPage
+from rawtrace import RawPageBuilder
+from rawtrace import RawPrint
+from records import TraceRecords
+
+
+def _os_error(code, filename):
+    return OSError(code, os.strerror(code), filename)
+
+
+class SimulatedEvent:
+    __slots__ = ('timestamp', 'pid', 'task', 'flags', 'payload', 'marker_text', 'length')
+
+    def __init__(self, timestamp, pid, task, flags, payload, marker_text, length):
+        self.timestamp = timestamp
+        self.pid = pid
+        self.task = task
+        self.flags = flags
+        self.payload = payload
+        self.marker_text = marker_text
+        self.length = length
+
+
+class SimulatedCpuBuffer:
+    # Pages are filled like the kernel does it: an event that doesn't fit in
+    # the commit page moves the writer to a new page and, once all the pages
+    # are in use, the oldest page is overwritten.
+    def __init__(self, cpu, nr_pages, page_size):
+        self.cpu = cpu
+        self.nr_pages = nr_pages
+        self.page_size = page_size
+        self.page_data_size = page_size - RawPage.header.size
+        self.overwrite = True
+        self.reset()
+
+    def resize(self, nr_pages):
+        self.nr_pages = nr_pages
+        self.reset()
+
+    def size_kb(self):
+        # Like the kernel: the data size of the pages, not what was written
+        # to buffer_size_kb.
+        return self.nr_pages * self.page_data_size // 1024
+
+    def reset(self):
+        self.pages = deque()
+        self.reader_page = deque()
+        self.commit_page = []
+        self.commit = 0
+        self.entries_written = 0
+        self.overrun = 0
+        self.overrun_reported = 0
+        self.dropped = 0
+        self.read_events = 0
+
+    def add(self, event):
+        if self.commit + event.length > self.page_data_size:
+            # Without overwrite a full buffer drops the new events instead.
+            if not self.overwrite and len(self.pages) + 2 > self.nr_pages:
+                self.dropped += 1
+                return
+            self.pages.append(self.commit_page)
+            while len(self.pages) + 1 > self.nr_pages:
+                self.overrun += len(self.pages.popleft())
+            self.commit_page = []
+            self.commit = 0
+        self.commit_page.append(event)
+        self.commit += event.length
+        self.entries_written += 1
+
+    def events(self):
+        yield from self.reader_page
+        for page in self.pages:
+            yield from page
+        yield from self.commit_page
+
+    def sorting_events(self):
+        for event in self.events():
+            yield (event.timestamp, self.cpu, event)
+
+    def nr_entries(self):
+        return len(self.reader_page) + sum(len(page) for page in self.pages) + len(self.commit_page)
+
+    def stats(self, now):
+        events = list(self.events())
+        oldest = events[0].timestamp if events else 0
+        return ('entries: {}\n'
+                'overrun: {}\n'
+                'commit overrun: 0\n'
+                'bytes: {}\n'
+                'oldest event ts: {:5}.{:06}\n'
+                'now ts: {:5}.{:06}\n'
+                'dropped events: {}\n'
+                'read events: {}\n').format(len(events), self.overrun, sum(event.length for event in events),
+                                             oldest // 1000000000, oldest % 1000000000 // 1000, now // 1000000000, now % 1000000000 // 1000,
+                                             self.dropped, self.read_events)
+
+    def nr_readable_pages(self):
+        return len(self.pages) + (1 if self.commit_page else 0)
+
+    def consume_page(self):
+        # Whatever is left of a page that trace_pipe started to read goes
+        # first. It was already counted as read when it was taken.
+        if self.reader_page:
+            page = list(self.reader_page)
+            self.reader_page.clear()
+            return page
+        if self.pages:
+            page = self.pages.popleft()
+        elif self.commit_page:
+            page = self.commit_page
+            self.commit_page = []
+            self.commit = 0
+        else:
+            return None
+        self.read_events += len(page)
+        return page
+
+    def peek_event(self):
+        if not self.reader_page:
+            page = self.consume_page()
+            if page is None:
+                return None
+            self.reader_page.extend(page)
+        return self.reader_page[0]
+
+    def read_event(self):
+        event = self.peek_event()
+        if event is not None:
+            self.reader_page.popleft()
+        return event
+
+    def raw_page(self, page):
+        builder = RawPageBuilder(self.page_size, page[0].timestamp)
+        for event in page:
+            if event.marker_text is not None:
+                builder.add_print(event.timestamp, event.pid, event.marker_text)
+            else:
+                builder.add_event(event.timestamp, RawPrint.entry.pack(1, 0, 0, event.pid) + bytes(16))
+        return builder.to_bytes()
+
+
+class SimulatedRingBuffer:
+    header = ['#\n',
+              '#                              _-----=> irqs-off\n',
+              '#                             / _----=> need-resched\n',
+              '#                            | / _---=> hardirq/softirq\n',
+              '#                            || / _--=> preempt-depth\n',
+              '#                            ||| /     delay\n',
+              '#           TASK-PID   CPU#  ||||    TIMESTAMP  FUNCTION\n',
+              '#              | |       |   ||||       |         |\n']
+
+    def __init__(self, nr_cpus, nr_pages, page_size):
+        self.cpus = [SimulatedCpuBuffer(cpu, nr_pages, page_size) for cpu in range(nr_cpus)]
+        self.tracer = 'nop'
+        self.tracing_on = True
+        self.events_on = False
+
+    def clear(self):
+        for cpu_buffer in self.cpus:
+            cpu_buffer.reset()
+
+    def render(self, annotate):
+        nr_entries = sum(cpu_buffer.nr_entries() for cpu_buffer in self.cpus)
+        entries_written = sum(cpu_buffer.entries_written for cpu_buffer in self.cpus)
+        lines = ['# tracer: {}\n'.format(self.tracer),
+                 '#\n',
+                 '# entries-in-buffer/entries-written: {}/{}   #P:{}\n'.format(nr_entries, entries_written, len(self.cpus))]
+        lines.extend(SimulatedRingBuffer.header)
+        annotate = annotate and any(cpu_buffer.overrun for cpu_buffer in self.cpus)
+        started = set()
+        per_cpu = [cpu_buffer.sorting_events() for cpu_buffer in self.cpus]
+        for i, (timestamp, cpu, event) in enumerate(heapq.merge(*per_cpu, key=lambda item: item[:2])):
+            if annotate and cpu not in started:
+                started.add(cpu)
+                if i:
+                    lines.append('##### CPU {} buffer started ####\n'.format(cpu))
+            lines.append(TraceRecords.format_line(event.task, event.pid, cpu, event.flags, timestamp, event.payload) + '\n')
+        return lines
+
+
+class SimulatedPipeReader:
+    def __init__(self, tracefs, buffer, cpu):
+        self.tracefs = tracefs
+        self.buffer = buffer
+        self.cpu = cpu
+
+    def read(self, size):
+        return self.tracefs.consume_text(self.buffer, self.cpu, size).encode()
+
+    def close(self):
+        pass
+
+
+class SimulatedCounter:
+    def __init__(self, tracefs, filename):
+        self.tracefs = tracefs
+        self.filename = filename
+
+    def read(self):
+        return int(self.tracefs.read(self.filename))
+
+    def close(self):
+        pass
+
+
+class SimulatedMarker:
+    def __init__(self, tracefs, buffer, filename):
+        self.tracefs = tracefs
+        self.buffer = buffer
+        self.filename = filename
+
+    def write(self, data):
+        self.tracefs.marker_write(self.buffer, self.filename, data)
+        return len(data)
+
+    def writev(self, buffers):
+        return sum(self.write(data) for data in buffers)
+
+    def close(self):
+        pass
+
+
+class SimulatedRawReader:
+    def __init__(self, tracefs, buffer, cpu):
+        self.tracefs = tracefs
+        self.buffer = buffer
+        self.cpu = cpu
+
+    def readinto(self, buf):
+        page = self.tracefs.consume_raw_page(self.buffer, self.cpu)
+        if page is None:
+            return 0
+        buf[:len(page)] = page
+        return len(page)
+
+    def close(self):
+        pass
+
+
+class SimulatedTracefs:
+    # In-memory stand-in for the tracefs files used by the suite. Install it
+    # with Helpers.set_backend() or use it as a context manager. Every
+    # directory made in instances/ gets its own ring buffer and files, the
+    # tracer activity is recorded in every buffer tracing it.
+    shared_across_processes = False
+    print_format = ('name: print\n'
+                    'ID: {}\n'
+                    'format:\n'
+                    '\tfield:unsigned short common_type;\toffset:0;\tsize:2;\tsigned:0;\n'
+                    '\tfield:unsigned char common_flags;\toffset:2;\tsize:1;\tsigned:0;\n'
+                    '\tfield:unsigned char common_preempt_count;\toffset:3;\tsize:1;\tsigned:0;\n'
+                    '\tfield:int common_pid;\toffset:4;\tsize:4;\tsigned:1;\n'
+                    '\n'
+                    '\tfield:unsigned long ip;\toffset:8;\tsize:8;\tsigned:0;\n'
+                    '\tfield:char buf[];\toffset:16;\tsize:0;\tsigned:1;\n').format(RawPrint.event_id)
+    tracers = ['nop', 'function', 'function_graph']
+    files = ['trace', 'persistent', 'trace_marker', 'trace_pipe', 'current_tracer', 'tracing_on', 'events/enable',
+             'events/ftrace/print/format', 'options/overwrite', 'buffer_size_kb']
+    per_cpu_files = ['nr_readable_pages', 'commit_page_nr_entries', 'commit_page_commit', 'buffer_size_kb', 'stats', 'trace_pipe', 'trace_pipe_raw']
+    # Files of the patched kernel, only the top level buffer has them.
+    patched_files = ['persistent', 'nr_readable_pages', 'commit_page_nr_entries', 'commit_page_commit']
+
+    def __init__(self, config, nr_cpus=None, default_cpu=0, page_size=4096):
+        self.root = os.path.dirname(config['marker_file'])
+        self.nr_cpus = nr_cpus or os.cpu_count()
+        self.default_cpu = default_cpu
+        self.page_size = page_size
+        self.nr_pages = config['nr_pages_to_fillup_buffer']
+        self.buffer = SimulatedRingBuffer(self.nr_cpus, self.nr_pages, page_size)
+        self.instances = {}
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.clock_offset = 0
+        self.last_timestamp = 0
+        self.previous_backend = None
+        self.files = TracefsBackend()
+
+    def __enter__(self):
+        self.previous_backend = Helpers.set_backend(self)
+        return self
+
+    def __exit__(self, *exc):
+        Helpers.set_backend(self.previous_backend)
+
+    def _relative(self, filename):
+        relative = os.path.relpath(os.path.abspath(filename), self.root)
+        if relative == '..' or relative.startswith('../'):
+            return None
+        return relative
+
+    def _resolve(self, filename):
+        # The ring buffer a file belongs to and its path relative to the
+        # top of the tracing directory or of its instance. None when the
+        # file is not in the tracing directory.
+        relative = self._relative(filename)
+        if relative is None or not relative.startswith('instances/'):
+            return (self.buffer, relative)
+        parts = relative.split('/', 2)
+        if len(parts) != 3 or parts[1] not in self.instances or parts[2].rsplit('/', 1)[-1] in SimulatedTracefs.patched_files:
+            raise _os_error(errno.ENOENT, filename)
+        return (self.instances[parts[1]], parts[2])
+
+    def _instance_name(self, filename):
+        relative = self._relative(filename)
+        if relative is None:
+            return None
+        parts = relative.split('/')
+        if len(parts) != 2 or parts[0] != 'instances' or not parts[1]:
+            raise _os_error(errno.ENOENT if len(parts) > 2 else errno.EPERM, filename)
+        return parts[1]
+
+    def _per_cpu(self, buffer, relative, filename):
+        parts = relative.split('/')
+        if len(parts) != 3 or parts[0] != 'per_cpu' or not parts[1].startswith('cpu') or not parts[1][3:].isdigit():
+            raise _os_error(errno.ENOENT, filename)
+        cpu = int(parts[1][3:])
+        if cpu >= self.nr_cpus:
+            raise _os_error(errno.ENOENT, filename)
+        return (buffer.cpus[cpu], parts[2])
+
+    def _nr_pages(self, size_kb, filename):
+        # Like the kernel: the size is rounded up to whole pages of data, at
+        # least two.
+        try:
+            size = int(size_kb) * 1024
+        except ValueError:
+            raise _os_error(errno.EINVAL, filename)
+        if size <= 0:
+            raise _os_error(errno.EINVAL, filename)
+        return max(2, -(-size // (self.page_size - RawPage.header.size)))
+
+    def now(self):
+        timestamp = max(time.monotonic_ns() + self.clock_offset, self.last_timestamp)
+        self.last_timestamp = timestamp
+        return timestamp
+
+    def current_cpu(self):
+        return getattr(self.local, 'cpu', self.default_cpu)
+
+    def pin(self, cpu):
+        if not 0 <= cpu < self.nr_cpus:
+            raise _os_error(errno.EINVAL, None)
+        self.local.cpu = cpu
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.clock_offset += int(seconds * 1000000000)
+            self._activity('schedule')
+
+    def monotonic(self):
+        return time.monotonic() + self.clock_offset / 1000000000
+
+    async def async_sleep(self, seconds):
+        # Virtual time, but still let the other tasks run.
+        self.sleep(seconds)
+        await asyncio.sleep(0)
+
+    def _record(self, buffer, payload, marker_text, length):
+        cpu_buffer = buffer.cpus[self.current_cpu()]
+        cpu_buffer.add(SimulatedEvent(self.now(), threading.get_native_id(), '<...>', '....', payload, marker_text, length))
+
+    def _activity(self, function):
+        for buffer in [self.buffer] + list(self.instances.values()):
+            if not buffer.tracing_on:
+                continue
+            if buffer.tracer in ['function', 'function_graph']:
+                self._record(buffer, '{} <-{}'.format(function, 'ksys_' + function), None, RawPageBuilder.event_length(24))
+            if buffer.events_on:
+                self._record(buffer, 'sys_{}: (simulated)'.format(function), None, RawPageBuilder.event_length(24))
+
+    def marker_write(self, buffer, filename, data):
+        text = bytes(data).decode(errors='replace')
+        if text.endswith('\n'):
+            text = text[:-1]
+        with self.lock:
+            if not buffer.tracing_on:
+                raise _os_error(errno.EBADF, filename)
+            self._record(buffer, 'tracing_mark_write: ' + text, text, RawPageBuilder.event_length(RawPrint.buf_offset + len(text.encode()) + 2))
+
+    def consume_raw_page(self, buffer, cpu):
+        with self.lock:
+            cpu_buffer = buffer.cpus[cpu]
+            page = cpu_buffer.consume_page()
+            return None if page is None else cpu_buffer.raw_page(page)
+
+    def consume_text(self, buffer, cpu, size):
+        # trace_pipe: events are consumed in timestamp order across the CPU
+        # buffers (or from one of them) until about size bytes are read.
+        with self.lock:
+            cpu_buffers = buffer.cpus if cpu is None else [buffer.cpus[cpu]]
+            lines = []
+            nr_bytes = 0
+            while nr_bytes < size:
+                oldest = None
+                for cpu_buffer in cpu_buffers:
+                    event = cpu_buffer.peek_event()
+                    if event is not None and (oldest is None or event.timestamp < oldest[1].timestamp):
+                        oldest = (cpu_buffer, event)
+                if oldest is None:
+                    break
+                cpu_buffer, event = oldest
+                # Like the kernel, the events overwritten since the last read
+                # of a CPU are reported before its next event.
+                if cpu_buffer.overrun != cpu_buffer.overrun_reported:
+                    lines.append('CPU:{} [LOST {} EVENTS]\n'.format(cpu_buffer.cpu, cpu_buffer.overrun - cpu_buffer.overrun_reported))
+                    cpu_buffer.overrun_reported = cpu_buffer.overrun
+                cpu_buffer.read_event()
+                lines.append(TraceRecords.format_line(event.task, event.pid, cpu_buffer.cpu, event.flags, event.timestamp, event.payload) + '\n')
+                nr_bytes += len(lines[-1])
+            return ''.join(lines)
+
+    def read(self, filename):
+        with self.lock:
+            buffer, relative = self._resolve(filename)
+        if relative is None:
+            with self.files.open_text(filename) as f:
+                return f.read()
+        with self.lock:
+            self._activity('read')
+            if relative == 'trace':
+                return ''.join(buffer.render(annotate=True))
+            if relative == 'persistent':
+                return ''.join(buffer.render(annotate=False))
+            if relative == 'current_tracer':
+                return buffer.tracer + '\n'
+            if relative == 'tracing_on':
+                return '{}\n'.format(int(buffer.tracing_on))
+            if relative == 'events/enable':
+                return '{}\n'.format(int(buffer.events_on))
+            if relative == 'events/ftrace/print/format':
+                return SimulatedTracefs.print_format
+            if relative == 'options/overwrite':
+                return '{}\n'.format(int(buffer.cpus[0].overwrite))
+            if relative == 'buffer_size_kb':
+                sizes = {cpu_buffer.size_kb() for cpu_buffer in buffer.cpus}
+                return '{}\n'.format(sizes.pop() if len(sizes) == 1 else 'X')
+            if relative.startswith('per_cpu/'):
+                cpu_buffer, name = self._per_cpu(buffer, relative, filename)
+                if name == 'nr_readable_pages':
+                    return '{}\n'.format(cpu_buffer.nr_readable_pages())
+                if name == 'commit_page_nr_entries':
+                    return '{}\n'.format(len(cpu_buffer.commit_page))
+                if name == 'commit_page_commit':
+                    return '{}\n'.format(cpu_buffer.commit)
+                if name == 'buffer_size_kb':
+                    return '{}\n'.format(cpu_buffer.size_kb())
+                if name == 'stats':
+                    return cpu_buffer.stats(self.now())
+            if relative == 'trace_marker':
+                raise _os_error(errno.EINVAL, filename)
+        raise _os_error(errno.ENOENT, filename)
+
+    def write(self, filename, mode, text):
+        with self.lock:
+            buffer, relative = self._resolve(filename)
+        if relative is None:
+            return self.files.write(filename, mode, text)
+        value = text.strip()
+        with self.lock:
+            self._activity('write')
+            if relative == 'trace_marker':
+                self.marker_write(buffer, filename, text.encode())
+            elif relative == 'trace':
+                if 'w' in mode:
+                    buffer.clear()
+            elif relative == 'current_tracer':
+                if value not in SimulatedTracefs.tracers:
+                    raise _os_error(errno.EINVAL, filename)
+                buffer.tracer = value
+            elif relative == 'tracing_on':
+                buffer.tracing_on = bool(int(value))
+            elif relative == 'events/enable':
+                buffer.events_on = bool(int(value))
+            elif relative == 'options/overwrite':
+                for cpu_buffer in buffer.cpus:
+                    cpu_buffer.overwrite = bool(int(value))
+            elif relative == 'buffer_size_kb' or relative.startswith('per_cpu/'):
+                cpu_buffers = buffer.cpus
+                if relative != 'buffer_size_kb':
+                    cpu_buffer, name = self._per_cpu(buffer, relative, filename)
+                    if name != 'buffer_size_kb':
+                        raise _os_error(errno.ENOENT, filename)
+                    cpu_buffers = [cpu_buffer]
+                nr_pages = self._nr_pages(value, filename)
+                for cpu_buffer in cpu_buffers:
+                    cpu_buffer.resize(nr_pages)
+            else:
+                raise _os_error(errno.ENOENT, filename)
+        return len(text)
+
+    def exists(self, filename):
+        try:
+            with self.lock:
+                buffer, relative = self._resolve(filename)
+            if relative is None:
+                return self.files.exists(filename)
+            if relative.startswith('per_cpu/'):
+                return self._per_cpu(buffer, relative, filename)[1] in SimulatedTracefs.per_cpu_files
+        except OSError:
+            return False
+        return relative in SimulatedTracefs.files or (relative == 'instances' and buffer is self.buffer)
+
+    def mkdir(self, filename):
+        name = self._instance_name(filename)
+        if name is None:
+            return self.files.mkdir(filename)
+        with self.lock:
+            if name in self.instances:
+                raise _os_error(errno.EEXIST, filename)
+            buffer = SimulatedRingBuffer(self.nr_cpus, self.nr_pages, self.page_size)
+            self.instances[name] = buffer
+
+    def rmdir(self, filename):
+        name = self._instance_name(filename)
+        if name is None:
+            return self.files.rmdir(filename)
+        with self.lock:
+            if name not in self.instances:
+                raise _os_error(errno.ENOENT, filename)
+            del self.instances[name]
+
+    def listdir(self, filename):
+        relative = self._relative(filename)
+        if relative is None:
+            return self.files.listdir(filename)
+        if relative != 'instances':
+            raise _os_error(errno.ENOENT, filename)
+        with self.lock:
+            return sorted(self.instances)
+
+    def open_text(self, filename, buffering=-1):
+        if self._relative(filename) is None:
+            return self.files.open_text(filename, buffering)
+        return io.StringIO(self.read(filename))
+
+    def read_line(self, filename):
+        return self.read(filename).split('\n', 1)[0]
+
+    def open_marker(self, filename):
+        with self.lock:
+            buffer, relative = self._resolve(filename)
+        if relative is None:
+            return self.files.open_marker(filename)
+        if relative != 'trace_marker':
+            raise _os_error(errno.ENOENT, filename)
+        return SimulatedMarker(self, buffer, filename)
+
+    def open_counter(self, filename):
+        relative = self._relative(filename)
+        if relative is None:
+            return self.files.open_counter(filename)
+        self.read(filename)
+        return SimulatedCounter(self, filename)
+
+    def open_pipe(self, filename):
+        with self.lock:
+            buffer, relative = self._resolve(filename)
+        if relative is None:
+            return self.files.open_pipe(filename)
+        if relative == 'trace_pipe':
+            return SimulatedPipeReader(self, buffer, None)
+        cpu_buffer, name = self._per_cpu(buffer, relative, filename)
+        if name != 'trace_pipe':
+            raise _os_error(errno.ENOENT, filename)
+        return SimulatedPipeReader(self, buffer, cpu_buffer.cpu)
+
+    def open_raw(self, filename):
+        with self.lock:
+            buffer, relative = self._resolve(filename)
+        if relative is None:
+            return self.files.open_raw(filename)
+        cpu_buffer, name = self._per_cpu(buffer, relative, filename)
+        if name != 'trace_pipe_raw':
+            raise _os_error(errno.ENOENT, filename)
+        return SimulatedRawReader(self, buffer, cpu_buffer.cpu)
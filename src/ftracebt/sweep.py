@@ -0,0 +1,227 @@
+import os
+import csv
+import json
+import argparse
+import platform
+from helper import ArgumentError
+from helper import Helpers
+from ftrace import BufferInternals
+from ftrace import Check
+from ftrace import CheckingEntriesOrderError
+from ftrace import CheckingMarkerPagesError
+from ftrace import FtraceManager
+from ftrace import UnexpectedCpuEntriesError
+from ftrace import WriteBuffer
+from multiwriter import MultiWriter
+from multiwriter import MultiWriterError
+from pacing import PacingProfile
+from parallelcheck import ParallelCheck
+from simtracefs import SimulatedTracefs
+from writer import marker_writer_names
+
+
+class Pacing:
+    # One value of the pacing axis: 'none' writes flat out, 'delay:US' waits
+    # a random time up to US microseconds between entries and 'rate:N'
+    # paces every writer to N entries per second.
+    def __init__(self, spec):
+        self.spec = spec.strip()
+        self.delay = 0
+        self.profile = None
+        kind, _, value = self.spec.partition(':')
+        try:
+            if kind == 'delay':
+                self.delay = int(value)
+            elif kind == 'rate':
+                self.profile = PacingProfile(float(value))
+            elif kind != 'none' or value:
+                raise ValueError('unknown pacing')
+        except ValueError as err:
+            raise ArgumentError('Wrong pacing "{}". Use "none", "delay:US" or "rate:ENTRIES_PER_SECOND". Details: {}'.format(spec, str(err)))
+
+    def __str__(self):
+        return self.spec
+
+
+class Sweep:
+    # Runs the marker writer scenarios for every buffer size, CPU set and
+    # pacing. The buffer is resized through buffer_size_kb and
+    # nr_pages_to_fillup_buffer follows it, so every scenario keeps its
+    # meaning. Each run is checked like the tests do it and the lost, torn,
+    # out of sequence and extra entries are recorded instead of failing.
+    def __init__(self, config, entries_per_page, write_mode='keep_open', writer_names=None, check_workers=1, page_size=4096):
+        self.config = config
+        self.entries_per_page = entries_per_page
+        self.write_mode = write_mode
+        self.writer_names = writer_names or marker_writer_names
+        self.check_workers = check_workers
+        self.page_size = page_size
+        self.manager = FtraceManager(config)
+
+    def config_for(self, buffer_size_kb):
+        config = dict(self.config)
+        config['nr_pages_to_fillup_buffer'] = FtraceManager.nr_pages_to_fillup(buffer_size_kb, self.page_size)
+        return config
+
+    def reset(self):
+        self.manager.set_tracer('nop')
+        self.manager.clear_buffer()
+        self.manager.set_tracing_on()
+
+    @staticmethod
+    def losses(report):
+        lost = 0
+        torn = 0
+        out_of_sequence = 0
+        extra = 0
+        for marker_report in report.marker_reports:
+            lost += len(marker_report.missing_pages) * marker_report.entries_per_page
+            for _, missing_entries, _ in marker_report.torn_pages:
+                lost += len(missing_entries)
+            torn += len(marker_report.torn_pages)
+            out_of_sequence += len(marker_report.out_of_sequence)
+            extra += len(marker_report.extra_entries)
+        return {'lost_entries': lost, 'torn_pages': torn, 'out_of_sequence_pages': out_of_sequence, 'extra_entries': extra,
+                'order_errors': len(report.order_errors)}
+
+    def run_point(self, buffer_size_kb, cpus, pacing, writer_name):
+        config = self.config_for(buffer_size_kb)
+        result = {'buffer_size_kb': buffer_size_kb, 'nr_pages': config['nr_pages_to_fillup_buffer'], 'cpus': cpus,
+                  'nr_cpus': len(cpus), 'pacing': str(pacing), 'writer': writer_name}
+        self.reset()
+        try:
+            write_report = MultiWriter(config, self.write_mode, pacing=pacing.profile, stats=True).write(writer_name, cpus, self.entries_per_page, pacing.delay)
+            result.update({'entries': write_report.nr_entries(), 'duration_ns': write_report.duration_ns(),
+                           'entries_per_second': write_report.entries_per_second(), 'start_skew_ns': write_report.start_skew_ns()})
+            for name in BufferInternals.stats_counters:
+                result[name] = sum(stats[name] for stats in write_report.stats.values())
+            nr_pages, first_page_id = Check.get_nr_pages_and_first_page_id(config, Check._get_nr_pages_from(config, writer_name))
+            report = ParallelCheck(config, self.check_workers).check(config['trace'], cpus, self.entries_per_page, nr_pages, first_page_id)
+        except (MultiWriterError, UnexpectedCpuEntriesError, CheckingMarkerPagesError, CheckingEntriesOrderError) as err:
+            result.update({'ok': False, 'error': '{}: {}'.format(type(err).__name__, err)})
+            return result
+        result.update(Sweep.losses(report))
+        result.update({'ok': report.ok(), 'error': None})
+        return result
+
+    def run(self, buffer_sizes_kb, cpu_sets, pacings, progress=None):
+        original_size_kb = self.manager.get_buffer_size_kb()
+        results = []
+        try:
+            for buffer_size_kb in buffer_sizes_kb:
+                self.manager.set_buffer_size_kb(buffer_size_kb)
+                for cpus in cpu_sets:
+                    for pacing in pacings:
+                        for writer_name in self.writer_names:
+                            result = self.run_point(buffer_size_kb, cpus, pacing, writer_name)
+                            if progress:
+                                progress(result)
+                            results.append(result)
+        finally:
+            self.manager.set_buffer_size_kb(original_size_kb)
+        return {
+            'python': platform.python_version(),
+            'entries_per_page': self.entries_per_page,
+            'write_mode': self.write_mode,
+            'dimensions': {'buffer_size_kb': list(buffer_sizes_kb), 'cpus': [list(cpus) for cpus in cpu_sets],
+                           'pacing': [str(pacing) for pacing in pacings], 'writer': list(self.writer_names)},
+            'results': results,
+            'curves': Sweep.curves(results),
+        }
+
+    @staticmethod
+    def curves(results):
+        # One curve per writer, CPU set and pacing: throughput and losses
+        # as the buffer grows, in the order of the buffer_size_kb axis.
+        curves = {}
+        for result in results:
+            key = '{} cpus={} pacing={}'.format(result['writer'], ','.join(str(cpu) for cpu in result['cpus']), result['pacing'])
+            curve = curves.setdefault(key, {'writer': result['writer'], 'cpus': result['cpus'], 'pacing': result['pacing'],
+                                            'buffer_size_kb': [], 'entries_per_second': [], 'lost_entries': [], 'ok': []})
+            curve['buffer_size_kb'].append(result['buffer_size_kb'])
+            curve['entries_per_second'].append(result.get('entries_per_second'))
+            curve['lost_entries'].append(result.get('lost_entries'))
+            curve['ok'].append(result['ok'])
+        return list(curves.values())
+
+    @staticmethod
+    def format_result(result):
+        line = '{:<22} {:>8} KB cpus: {:<12} pacing: {:<14}'.format(result['writer'], result['buffer_size_kb'], ','.join(str(cpu) for cpu in result['cpus']), result['pacing'])
+        if result['error']:
+            return '{} ERROR: {}'.format(line, result['error'].split('\n', 1)[0])
+        return '{} {:12.0f} entries/s lost: {:8} torn: {:4} out of sequence: {:4} extra: {:6} {}'.format(
+            line, result['entries_per_second'], result['lost_entries'], result['torn_pages'], result['out_of_sequence_pages'],
+            result['extra_entries'], 'OK' if result['ok'] else 'FAILED')
+
+    @staticmethod
+    def export(sweep, filename):
+        # JSON, or one CSV row per point when filename ends with .csv.
+        if not filename.endswith('.csv'):
+            with open(filename, 'w') as f:
+                json.dump(sweep, f, indent=2)
+            return
+        columns = ['writer', 'buffer_size_kb', 'nr_pages', 'cpus', 'nr_cpus', 'pacing', 'entries', 'duration_ns', 'entries_per_second', 'start_skew_ns',
+                   'overrun', 'commit_overrun', 'dropped_events', 'read_events', 'lost_entries', 'torn_pages', 'out_of_sequence_pages', 'extra_entries', 'order_errors', 'ok', 'error']
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, columns)
+            writer.writeheader()
+            for result in sweep['results']:
+                row = dict(result)
+                row['cpus'] = ' '.join(str(cpu) for cpu in result['cpus'])
+                writer.writerow(row)
+
+
+def _int_list(value, name):
+    try:
+        return [int(x.strip()) for x in value.split(',') if x.strip()]
+    except Exception as err:
+        raise ArgumentError('Error in argument "{}". Details: {}'.format(name, str(err)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sweep the ring buffer size, the writer CPUs and the write pacing and record where entries start to get lost or reordered.')
+    parser.add_argument("--config-file", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_buffer.ini"), help="Configuration file.")
+    parser.add_argument("--buffer-sizes-kb", default='32,64,128', help="Values written to buffer_size_kb, e.g. --buffer-sizes-kb 32,1024")
+    parser.add_argument("--cpu-sets", default='0', help="Writer CPU sets separated by ';', e.g. --cpu-sets '0;0,1;0,1,2,3'")
+    parser.add_argument("--pacings", default='none', help="Pacings separated by ';': 'none', 'delay:US' (random delay up to US microseconds) or 'rate:N' (N entries per second per writer), e.g. --pacings 'none;rate:100000'")
+    parser.add_argument("--writers", default=','.join(marker_writer_names), help="Comma separated marker scenarios. Available: {}".format(', '.join(marker_writer_names)))
+    parser.add_argument("--entries-per-page", type=int, help="Entries per marker page. Defaults to 'marker_entries_per_page' of the configuration file.")
+    parser.add_argument("--page-size", type=int, default=os.sysconf('SC_PAGE_SIZE'), help="Ring buffer page size, used to turn buffer_size_kb into pages.")
+    parser.add_argument("--write-mode", choices=WriteBuffer.write_modes, default='keep_open', help="How entries reach trace_marker.")
+    parser.add_argument("--check-workers", type=int, default=1, help="Number of forked workers used by the checks.")
+    parser.add_argument("--backend", choices=['real', 'sim'], default='real', help="'sim' runs the sweep on the simulated tracefs, e.g. to try the harness without root.")
+    parser.add_argument("--sim-cpus", type=int, default=4, help="Number of CPUs of the simulated tracefs.")
+    parser.add_argument("--output", help="Write the matrix to this file: JSON, or CSV when it ends with .csv.")
+    return parser.parse_args()
+
+
+def run_sweep(args, config):
+    writer_names = [name.strip() for name in args.writers.split(',') if name.strip()]
+    unknown = [name for name in writer_names if name not in marker_writer_names]
+    if unknown:
+        raise ArgumentError('Unknown writers: {}. Available: {}'.format(', '.join(unknown), ', '.join(marker_writer_names)))
+    cpu_sets = [_int_list(cpus, '--cpu-sets') for cpus in args.cpu_sets.split(';') if cpus.strip()]
+    pacings = [Pacing(spec) for spec in args.pacings.split(';') if spec.strip()]
+    entries_per_page = args.entries_per_page or int(config['marker_entries_per_page'])
+    sweep = Sweep(config, entries_per_page, args.write_mode, writer_names, args.check_workers, args.page_size)
+    return sweep.run(_int_list(args.buffer_sizes_kb, '--buffer-sizes-kb'), cpu_sets, pacings,
+                     progress=lambda result: print(Sweep.format_result(result), flush=True))
+
+
+def main():
+    args = parse_args()
+    config = Helpers.get_config(args.config_file)
+    if args.backend == 'sim':
+        with SimulatedTracefs(config, args.sim_cpus, page_size=args.page_size):
+            results = run_sweep(args, config)
+    else:
+        results = run_sweep(args, config)
+    if args.output:
+        Sweep.export(results, args.output)
+    failed = [result for result in results['results'] if not result['ok']]
+    print('Points: {} Failed: {}'.format(len(results['results']), len(failed)))
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
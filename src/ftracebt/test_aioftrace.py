@@ -0,0 +1,31 @@
+import asyncio
+from aioftrace import AsyncFtraceManager
+from ftrace import FtraceManager
+from ftrace import ReadBuffer
+from ftrace import WriteBuffer
+from online import OnlineChecker
+
+
+class TestAsyncFtraceManager:
+    def test_window_runs_tasks_while_tracing(self, sim, sim_config):
+        manager = AsyncFtraceManager(sim_config)
+        checker = OnlineChecker(sim_config, [0], 11)
+
+        async def write():
+            with WriteBuffer(sim_config) as writebuffer:
+                writebuffer.write_pages(3, 0, 11)
+            return 'written'
+
+        window = asyncio.run(manager.window('events', 250, [write, AsyncFtraceManager.started(checker.start, checker.stop)]))
+        written, report = window.results
+        assert written == 'written'
+        assert (report.entries(), report.lost(), report.sequences[0].duplicated, report.sequences[0].reordered) == (33, 0, 0, 0)
+        assert abs(window.error_ms()) < 50
+        assert not sim.buffer.tracing_on and not sim.buffer.events_on
+
+    def test_tracer_matrix(self, sim, sim_config):
+        ftrace_manager = FtraceManager(sim_config)
+        runs = asyncio.run(AsyncFtraceManager(sim_config).tracer_matrix(['function', 'events'], [10, 20], ftrace_manager.clear_buffer))
+        assert [(run.tracer_name, run.duration, run.error) for run in runs] == [
+            ('function', 10, None), ('function', 20, None), ('events', 10, None), ('events', 20, None)]
+        assert ReadBuffer(sim_config).is_empty()
@@ -0,0 +1,44 @@
+import pytest
+from ftrace import Check
+from ftrace import CheckingEntriesOrderError
+from ftrace import WriteBuffer
+from records import TraceRecords
+
+numpy = pytest.importorskip('numpy')
+from analytics import TimestampAnalytics
+
+
+def marker_records(timestamps_per_cpu, entries_per_page):
+    rows = []
+    for cpu, timestamps in timestamps_per_cpu.items():
+        for k, timestamp in enumerate(timestamps):
+            page_id, entry_nr = divmod(k, entries_per_page)
+            entry = WriteBuffer.generate_entry(cpu, page_id + 1, entry_nr) if entry_nr else WriteBuffer.generate_page_header_entry(page_id + 1)
+            rows.append((timestamp, cpu, 'tracing_mark_write: ' + entry))
+    records = TraceRecords()
+    for timestamp, cpu, payload in sorted(rows, key=lambda row: row[0]):
+        records.append('<...>', 1, cpu, '....', timestamp, payload)
+    return records
+
+
+class TestTimestampAnalytics:
+    def test_gaps_and_page_commit_durations(self):
+        records = marker_records({0: [0, 10, 20, 30, 1000, 1010, 1020, 1030], 1: [5, 105, 205, 305]}, 4)
+        summary = TimestampAnalytics(records, WriteBuffer.head_entry_beginning).as_dict()
+        assert summary['order_violations'] == 0
+        cpu0 = summary['cpus']['0']
+        assert cpu0['entries'] == 8
+        assert (cpu0['gaps_ns']['min'], cpu0['gaps_ns']['max']) == (10, 970)
+        assert (cpu0['page_commit_ns']['count'], cpu0['page_commit_ns']['max']) == (2, 30)
+        assert sum(cpu0['gaps_ns']['histogram']['counts']) == 7
+        assert summary['cpus']['1']['page_commit_ns']['min'] == 300
+
+    def test_order_violations(self):
+        records = marker_records({0: [0, 10, 20, 30], 2: [15, 25]}, 4)
+        records.timestamps[4] = 5
+        analytics = TimestampAnalytics(records)
+        assert list(analytics.global_order_violations()) == [4]
+        assert len(analytics.cpu_order_violations(0)) == 0
+        assert list(analytics.cpu_order_violations(2)) == [4]
+        with pytest.raises(CheckingEntriesOrderError):
+            Check.merged_buffers(records)
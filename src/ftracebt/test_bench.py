@@ -0,0 +1,26 @@
+import copy
+from bench import Benchmark
+from helper import Helpers
+
+
+class TestBenchmark:
+    def test_runs_every_case(self, sim_config, tmp_path):
+        backend = Helpers.backend
+        results = Benchmark(sim_config, 101, str(tmp_path), repeat=1).run([2, 4], [1, 2, 8], list(Benchmark.cases))
+        sizes = {(result['pages'], result['cpus']) for result in results['results']}
+        assert sizes == {(2, 1), (2, 2), (4, 1), (4, 2)}
+        assert len(results['results']) == len(sizes) * len(Benchmark.cases)
+        for result in results['results']:
+            assert result['entries'] == result['pages'] * 101
+            assert result['ns_per_entry'] > 0
+            assert result['peak_memory_bytes'] is not None
+        assert Helpers.backend is backend
+
+    def test_compare_with_baseline(self, sim_config, tmp_path):
+        baseline = Benchmark(sim_config, 11, str(tmp_path), repeat=1, memory=False).run([1], [1], ['merged_buffers', 'exact_marker_pages'])
+        assert Benchmark.compare(baseline, baseline) == []
+        current = copy.deepcopy(baseline)
+        current['results'][0]['ns_per_entry'] *= 1.5
+        regressions = Benchmark.compare(current, baseline, threshold=0.2)
+        assert len(regressions) == 1 and regressions[0].startswith('merged_buffers')
+        assert Benchmark.compare(current, baseline, threshold=0.6) == []
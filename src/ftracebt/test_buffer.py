@@ -1,7 +1,16 @@
+import os
 import pytest
+import asyncio
 from subprocess import Popen
 from ftrace import CheckingMarkerPagesError
+from ftrace import UnexpectedCpuEntriesError
+from ftrace import WriteBuffer
+from analytics import TimestampAnalytics
 from writer import marker_writer_names
+from pacing import Pacer
+from online import soak
+from aioftrace import AsyncFtraceManager
+from profiling import Spans
 
 
 class WriterProcessError(Exception):
@@ -21,49 +30,48 @@ def reset_rb(ftrace_manager, readbuffer):
 
 
 @pytest.fixture
-def check_writing_n_pages(config, max_writes_delay, writebuffer, readbuffer, buffercheck):
-    def _read_and_check_n_pages(config, entries_per_page, cpu, pages_written):
-        nr_pages, first_page_id = buffercheck.get_nr_pages_and_first_page_id(config, pages_written)
-        for trace_filename in config['trace']:
-            content_no_header = readbuffer.get_entries_noheader_nc(trace_filename)
-            try:
-                buffercheck.exact_marker_pages(content_no_header, entries_per_page, cpu, nr_pages, first_page_id)
-            except CheckingMarkerPagesError as err:
-                pytest.fail(str(err))
-
+def check_writing_n_pages(config, max_writes_delay, pacing_profile, fail_fast_checks, writebuffer, parallelcheck):
     def _check_writing_n_pages(nr_pages, cpu, entries_per_page):
-        writebuffer.write_pages(nr_pages, cpu, entries_per_page, delay=max_writes_delay)
-        _read_and_check_n_pages(config, entries_per_page, cpu, nr_pages)
+        pacer = Pacer(pacing_profile.with_seed(pacing_profile.seed + cpu)) if pacing_profile else None
+        writebuffer.write_pages(nr_pages, cpu, entries_per_page, delay=max_writes_delay, pacer=pacer)
+        try:
+            parallelcheck.exact_marker_pages(config['trace'], entries_per_page, cpu, nr_pages, fail_fast_checks)
+        except (CheckingMarkerPagesError, UnexpectedCpuEntriesError) as err:
+            pytest.fail(str(err))
         return True
 
     return _check_writing_n_pages
 
 
 @pytest.fixture
-def check_multiple_cpus(config, readbuffer, buffercheck, cpus_to_use, marker_entries_per_page):
+def check_multiple_cpus(config, parallelcheck, cpus_to_use, marker_entries_per_page, fail_fast_checks, timestamp_analytics):
     def _check_multiple_cpus(writer_name):
-        for trace_filename in config['trace']:
-            try:
-                content_no_header = readbuffer.get_entries_noheader_nc(trace_filename)
-                buffercheck.per_cpu_content(config, writer_name, content_no_header, cpus_to_use, marker_entries_per_page)
-                buffercheck.merged_buffers(content_no_header)
-            except Exception as err:
-                pytest.fail('Error while testing with marker and multiple cpus. Writer name: "{}". Trace filename: "{}". Details: {}'.format(writer_name, trace_filename, str(err)))
+        try:
+            report = parallelcheck.per_cpu_content(config['trace'], writer_name, cpus_to_use, marker_entries_per_page, fail_fast_checks)
+        except Exception as err:
+            pytest.fail('Error while testing with marker and multiple cpus. Writer name: "{}". Trace filenames: "{}". Details: {}'.format(writer_name, config['trace'], str(err)))
+        if timestamp_analytics:
+            for trace_filename, records in zip(report.trace_filenames, report.records):
+                print('\n{}:\n{}'.format(trace_filename, TimestampAnalytics(records, WriteBuffer.head_entry_beginning)))
 
     return _check_multiple_cpus
 
 
 class TestWithMarker:
     @staticmethod
-    def write_processes(config, write_name, cpus_to_use, max_writes_delay, cwd):
+    def write_processes(config, write_name, cpus_to_use, max_writes_delay, cwd, write_mode):
         process = []
         for cpu in cpus_to_use:
             write_cmd = config['writer_command'].format(cpu, write_name, cpu, max_writes_delay)
+            write_cmd += ' --write-mode {}'.format(write_mode)
+            if config.get('instance'):
+                write_cmd += ' --instance {}'.format(config['instance'])
             p = Popen(write_cmd.split(), cwd=cwd)
             process.append(p)
-        for p in process:
-            if p.wait():
-                raise WriterProcessError('Error while trying to execute the command: {}'.format(' '.join(p.args)))
+        with Spans.timed('write.processes'):
+            for p in process:
+                if p.wait():
+                    raise WriterProcessError('Error while trying to execute the command: {}'.format(' '.join(p.args)))
 
     @pytest.mark.usefixtures('reset_rb')
     def test_write_one_page(self, check_writing_n_pages, default_cpu, marker_entries_per_page):
@@ -107,10 +115,13 @@ class TestWithMarker:
         assert check_writing_n_pages(nr_pages + 4, default_cpu, marker_entries_per_page)
 
     @pytest.mark.usefixtures('reset_rb')
-    def test_marker_multiple_cpus(self, check_multiple_cpus, config, cpus_to_use, max_writes_delay, cwd, reset_rb):
+    def test_marker_multiple_cpus(self, check_multiple_cpus, config, cpus_to_use, max_writes_delay, cwd, write_mode, writer_engine, multiwriter, marker_entries_per_page, reset_rb):
         for writer_name in marker_writer_names:
             print('\nExecuting test on CPUS: {}. Test name: {}. '.format(str(cpus_to_use), writer_name), end='')
-            TestWithMarker.write_processes(config, writer_name, cpus_to_use, max_writes_delay, cwd)
+            if writer_engine == 'popen':
+                TestWithMarker.write_processes(config, writer_name, cpus_to_use, max_writes_delay, cwd, write_mode)
+            else:
+                multiwriter.write(writer_name, cpus_to_use, marker_entries_per_page, max_writes_delay)
             check_multiple_cpus(writer_name)
             print('PASSED', end='')
             reset_rb()
@@ -118,20 +129,22 @@ class TestWithMarker:
         assert 1
 
     @pytest.mark.usefixtures('reset_rb')
-    def test_with_the_tracers(self, config, ftrace_manager, reset_rb, buffercheck, readbuffer):
-        if not ('/sys/kernel/debug/tracing/persistent' in config['trace'] and len(config['trace']) > 1):
+    def test_online_soak(self, config, cpus_to_use, marker_entries_per_page, write_mode, pacing_profile, soak_seconds, soak_per_cpu_pipes):
+        if not soak_seconds:
+            pytest.skip('Online soak test disabled. Enable it with "--soak-seconds".')
+        report = soak(config, cpus_to_use, marker_entries_per_page, soak_seconds, write_mode=write_mode, pacing=pacing_profile, per_cpu_pipes=soak_per_cpu_pipes)
+        print('\n{}'.format(report))
+        if not report.ok(allow_lost=True):
+            pytest.fail('The online check found problems.\n{}'.format(report))
+
+    @pytest.mark.usefixtures('reset_rb')
+    def test_with_the_tracers(self, config, reset_rb):
+        if not (any(os.path.basename(filename) == 'persistent' for filename in config['trace']) and len(config['trace']) > 1):
             print('\nIgnoring "test_with_the_tracers" test because we don\'t have two files (normally "trace" and "persistent") to compare.')
             return
-        for tracer_name in config['test_with_tracers']:
-            for t in config['tracers_tests_times']:
-                try:
-                    print('\nExecuting tracer test. Tracer: "{}". Tracer was on: {} milliseconds. '.format(tracer_name, t), end='')
-                    ftrace_manager.activate_tracer(tracer_name, t)
-                    content1 = readbuffer.complete_read_nc(config['trace'][0])
-                    content2 = readbuffer.complete_read_nc(config['trace'][1])
-                    buffercheck.content_trace_files(content1, content2)
-                    print('PASSED ', end='')
-                    reset_rb()
-                except Exception as err:
-                    pytest.fail('\nExecuting tracer test. Tracer: "{}". Tracer was on: {} millisecondsi. Details: {}'.format(tracer_name, t, str(err)))
-
+        runs = asyncio.run(AsyncFtraceManager(config).tracer_matrix(config['test_with_tracers'], config['tracers_tests_times'], reset_rb))
+        for run in runs:
+            print('\nExecuting tracer test. {}'.format(run), end='')
+        failed = [run for run in runs if run.error is not None]
+        if failed:
+            pytest.fail('\n'.join('Executing tracer test. Tracer: "{}". Tracer was on: {} milliseconds. Details: {}'.format(run.tracer_name, run.duration, run.error) for run in failed))
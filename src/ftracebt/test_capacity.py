@@ -0,0 +1,27 @@
+from capacity import CapacityProbe
+from capacity import CapacitySearch
+from multiwriter import MultiWriterReport
+from online import CpuSequence
+from online import OnlineReport
+
+
+class TestCapacitySearch:
+    def test_rate_search_without_reader(self, sim, sim_config):
+        # Without a reader a probe overflows once it writes more pages than
+        # the buffer holds: 9 pages of 101 entries in 10 ms is 90900 entries/s.
+        search = CapacitySearch(sim_config, 101, duration=0.01, reader=False, tolerance=0.05)
+        report = search.run([0], low=10000)
+        result = report.results[0]
+        assert not result.writer_bound and not result.probes[0].ok
+        assert 0.95 * 90900 <= result.best.rate <= 90900
+        assert all(probe.ok == (probe.rate is not None and probe.rate <= 90900) for probe in result.probes)
+        assert report.as_dict()['cpus'] == [0]
+
+    def test_reader_losses_fail_a_probe(self):
+        write_report = MultiWriterReport([], {0: {'overrun': 0, 'dropped_events': 0}})
+        sequence = CpuSequence(0, 101)
+        assert CapacityProbe([0], 1000, write_report, OnlineReport([sequence], {}, 0, 1), ['overrun', 'dropped_events']).ok
+        sequence.lost = 5
+        probe = CapacityProbe([0], 1000, write_report, OnlineReport([sequence], {}, 0, 1, {0: 5}), ['overrun', 'dropped_events'])
+        assert (probe.ok, probe.losses, probe.reader_losses, probe.as_dict()['online_kernel_lost']) == (False, 0, 5, 5)
+        assert not CapacityProbe([0], 1000, write_report, OnlineReport([CpuSequence(0, 101)], {}, 1, 1), ['overrun']).ok
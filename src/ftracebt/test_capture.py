@@ -0,0 +1,53 @@
+import pytest
+from capture import TraceCapture
+from capture import save
+from ftrace import MarkerPagesReportError
+from ftrace import WriteBuffer
+from parallelcheck import ParallelCheck
+from records import TraceRecords
+from replay import replay
+
+
+def mixed_records():
+    records = TraceRecords()
+    timestamp = 1000
+    for page_id in [1, 2]:
+        for cpu in [0, 1]:
+            for entry in WriteBuffer.generate_page_entries(cpu, page_id, 5):
+                timestamp += 7
+                records.append('writer', 100 + cpu, cpu, '...1', timestamp, 'tracing_mark_write: ' + entry)
+        records.append('<idle>', 0, 1, 'd..2', timestamp, 'sched_switch: prev_comm=swapper next_comm=writer')
+    return records
+
+
+class TestTraceCapture:
+    def test_round_trip_and_index(self, tmp_path):
+        records = mixed_records()
+        header = ['# tracer: nop\n', '#\n']
+        filename = str(tmp_path / 'mixed.ftcap')
+        save(filename, records, header, {'source': 'trace'}, chunk_size=8)
+        with TraceCapture(filename) as capture:
+            assert len(capture) == len(records) and len(capture.chunks) == 3
+            loaded = capture.records()
+            assert [loaded.line(i) for i in range(len(loaded))] == [records.line(i) for i in range(len(records))]
+            assert list(capture.iter_lines())[:3] == header + [records.line(0) + '\n']
+            assert capture.line(17) == records.line(17)
+            assert capture.cpus() == {0: 10, 1: 12}
+            cpu1 = capture.records([1], 1000 + 7 * 15, 1000 + 7 * 30)
+            expected = [i for i in range(len(records)) if records.cpus[i] == 1 and 1000 + 7 * 15 <= records.timestamps[i] < 1000 + 7 * 30]
+            assert list(cpu1.payloads) == [records.payloads[i] for i in expected]
+
+    def test_checks_replay_from_captures(self, sim, sim_config, tmp_path):
+        sim.pin(0)
+        with WriteBuffer(sim_config) as writebuffer:
+            for page_id in [1, 3]:
+                writebuffer.write_page(0, page_id, 11)
+        parallelcheck = ParallelCheck(sim_config, 1, capture_dir=str(tmp_path))
+        parallelcheck.set_capture_name('missing')
+        live = parallelcheck.check(sim_config['trace'], [0], 11, 3)
+        captures = [str(tmp_path / 'missing-1-{}.ftcap'.format(name)) for name in ['trace', 'persistent']]
+        replayed = replay(captures)
+        assert [report.missing_pages for report in replayed.marker_reports] == [[2], [2]]
+        assert str(replayed).replace(captures[0], sim_config['trace'][0]).replace(captures[1], sim_config['trace'][1]) == str(live)
+        with pytest.raises(MarkerPagesReportError):
+            replayed.raise_errors()
@@ -0,0 +1,23 @@
+from entrycache import ExpectedEntryCache
+from ftrace import WriteBuffer
+
+
+class TestExpectedEntryCache:
+    def test_buffers_span_blocks(self):
+        cache = ExpectedEntryCache(WriteBuffer.generate_page_entries, pages_per_block=4)
+        buffers = [bytes(data).decode() for data in cache.buffers(7, 3, 6, 5)]
+        expected = [entry for page_id in range(3, 9) for entry in WriteBuffer.generate_page_entries(7, page_id, 5)]
+        assert buffers == expected
+        assert len(cache.blocks) == 2
+        assert cache.page_strings(7, 6, 5) == list(WriteBuffer.generate_page_entries(7, 6, 5))
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_least_recently_used_blocks_are_evicted(self):
+        cache = ExpectedEntryCache(WriteBuffer.generate_page_entries, pages_per_block=2)
+        block_size = cache.block(0, 1, 101).nbytes
+        cache.max_bytes = 2 * block_size
+        cache.block(0, 3, 101)
+        cache.block(0, 1, 101)
+        cache.block(0, 5, 101)
+        assert [key[1] for key in cache.blocks] == [1, 5]
+        assert cache.nr_bytes <= cache.max_bytes
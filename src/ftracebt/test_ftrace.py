@@ -0,0 +1,24 @@
+from ftrace import Check
+from ftrace import ReadBuffer
+from ftrace import WriteBuffer
+from records import TraceRecords
+
+
+class TestCheck:
+    def test_cpus_from_1000_on(self):
+        records = TraceRecords()
+        for page_id in [1, 3]:
+            for entry in WriteBuffer.generate_page_entries(1000, page_id, 11):
+                records.append('writer', 100, 1000, '....', 1000 + len(records), 'tracing_mark_write: ' + entry)
+        report = Check.marker_pages_report(records, 11, 1000, 3)
+        assert (report.pages_found, report.missing_pages, list(report.extra_entries)) == (2, [2], [])
+        assert [Check._marker_position(records.payloads[1], cpu) for cpu in [1000, 0, 100]] == [(1, 1), (None, None), (None, None)]
+
+
+class TestWriteBuffer:
+    def test_delay_without_entries_per_page(self, sim, sim_config):
+        entries = list(WriteBuffer.generate_page_entries(0, 1, 3))
+        with WriteBuffer(sim_config) as writebuffer:
+            writebuffer.write_buffers([entry.encode() for entry in entries], delay=1)
+        records = ReadBuffer(sim_config).get_records(sim_config['trace'][0])
+        assert Check.exact_marker_pages(records, 3, 0, 1)
@@ -0,0 +1,59 @@
+import threading
+import pytest
+import multiwriter
+from ftrace import Check
+from ftrace import FtraceManager
+from ftrace import ReadBuffer
+from multiwriter import MultiWriter
+from multiwriter import MultiWriterError
+
+
+def worker_failing_on(cpu, failure):
+    # The writer of cpu runs failure instead of writing.
+    writer_worker = multiwriter._writer_worker
+
+    def _worker(*args):
+        if args[4] == cpu:
+            return failure()
+        return writer_worker(*args)
+
+    return _worker
+
+
+@pytest.mark.parametrize('sim', [4], indirect=True)
+class TestMultiWriter:
+    def test_results_in_cpu_order(self, sim, sim_config):
+        report = MultiWriter(sim_config).write_pages(2, [3, 1, 2], 11)
+        assert [result.cpu for result in report.results] == [1, 2, 3]
+        assert report.nr_entries() == 3 * 2 * 11 and not report.errors()
+        assert 0 <= report.start_skew_ns() <= report.duration_ns()
+        records = ReadBuffer(sim_config).get_records(sim_config['trace'][0])
+        per_cpu, unexpected = records.split_per_cpu([1, 2, 3])
+        assert not unexpected
+        for cpu in [1, 2, 3]:
+            assert Check.exact_marker_pages(records, 11, cpu, 2, indexes=per_cpu[cpu])
+
+    def test_writer_errors_are_reported(self, sim, sim_config):
+        FtraceManager(sim_config).set_tracing_off()
+        with pytest.raises(MultiWriterError) as err:
+            MultiWriter(sim_config).write_pages(1, [0, 1], 11)
+        message = str(err.value)
+        assert 'CPU#: 000\tERROR: ' in message and 'CPU#: 001\tERROR: ' in message and 'FileWriteError' in message
+
+    def test_dead_writer_and_timeout(self, sim, sim_config, monkeypatch):
+        monkeypatch.setattr(multiwriter, '_writer_worker', worker_failing_on(1, lambda: None))
+        with pytest.raises(MultiWriterError, match=r'died without a result: CPU 1 '):
+            MultiWriter(sim_config, poll_interval=0.01).write_pages(1, [0, 1], 11)
+        stuck = threading.Event()
+        monkeypatch.setattr(multiwriter, '_writer_worker', worker_failing_on(1, stuck.wait))
+        try:
+            with pytest.raises(MultiWriterError, match=r'Timeout after 0.1 s waiting for the writers of CPUs \[1\]'):
+                MultiWriter(sim_config, timeout=0.1, poll_interval=0.01).write_pages(1, [0, 1], 11)
+        finally:
+            stuck.set()
+
+    def test_stats_error_releases_the_writers(self, sim, sim_config):
+        config = dict(sim_config, per_cpu_stats_file=sim_config['per_cpu_stats_file'].replace('stats', 'missing'))
+        with pytest.raises(OSError):
+            MultiWriter(config, stats=True).write_pages(1, [0, 1], 11)
+        assert ReadBuffer(sim_config).is_empty()
@@ -0,0 +1,72 @@
+import pytest
+from ftrace import WriteBuffer
+from online import CpuSequence
+from online import OnlineChecker
+from online import soak
+
+
+def feed_positions(sequence, positions):
+    for timestamp, (page_id, entry_nr) in enumerate(positions):
+        if entry_nr:
+            sequence.feed(timestamp, 'tracing_mark_write: ' + WriteBuffer.generate_entry(sequence.cpu, page_id, entry_nr))
+        else:
+            sequence.feed(timestamp, 'tracing_mark_write: ' + WriteBuffer.generate_page_header_entry(page_id))
+
+
+class TestCpuSequence:
+    def test_in_order(self):
+        sequence = CpuSequence(2, 3)
+        feed_positions(sequence, [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1)])
+        assert sequence.ok() and sequence.entries == 5
+
+    def test_lost_duplicated_and_reordered(self):
+        sequence = CpuSequence(1, 3)
+        feed_positions(sequence, [(1, 0), (1, 2), (2, 1), (1, 1), (1, 1), (2, 2)])
+        assert (sequence.lost, sequence.reordered, sequence.duplicated) == (1, 1, 1)
+        assert not sequence.ok(allow_lost=True)
+
+    def test_timestamp_regressions_and_foreign_entries(self):
+        sequence = CpuSequence(0, 3)
+        sequence.feed(10, 'tracing_mark_write: ' + WriteBuffer.generate_page_header_entry(1))
+        sequence.feed(5, 'tracing_mark_write: ' + WriteBuffer.generate_entry(0, 1, 1))
+        sequence.feed(6, 'tracing_mark_write: ' + WriteBuffer.generate_entry(3, 1, 2))
+        assert (sequence.timestamp_regressions, sequence.foreign) == (1, 1)
+
+    def test_cpus_from_1000_on(self):
+        payloads = ['tracing_mark_write: ' + entry for page_id in [1, 3] for entry in WriteBuffer.generate_page_entries(1000, page_id, 3)]
+        sequences = [CpuSequence(1000, 3), CpuSequence(0, 3)]
+        for sequence in sequences:
+            for timestamp, payload in enumerate(payloads):
+                sequence.feed(timestamp, payload)
+        # The page headers have no CPU field, they count for any CPU.
+        assert [(sequence.entries, sequence.lost, sequence.foreign) for sequence in sequences] == [(6, 3, 0), (2, 5, 4)]
+
+
+@pytest.mark.parametrize('sim', [4], indirect=True)
+class TestOnlineChecker:
+    @pytest.mark.parametrize('per_cpu_pipes', [False, True])
+    def test_drains_while_writing(self, sim, sim_config, per_cpu_pipes):
+        with OnlineChecker(sim_config, [0, 1], 11, per_cpu_pipes=per_cpu_pipes) as checker:
+            with WriteBuffer(sim_config) as writebuffer:
+                for page_id in range(1, 60):
+                    for cpu in [0, 1]:
+                        sim.pin(cpu)
+                        writebuffer.write_page(cpu, page_id, 11)
+        report = checker.report()
+        assert report.ok(), str(report)
+        assert report.entries() == 2 * 59 * 11
+
+    def test_lost_events_reported_by_the_kernel(self, sim, sim_config):
+        nr_pages = sim_config['nr_pages_to_fillup_buffer']
+        with WriteBuffer(sim_config) as writebuffer:
+            writebuffer.write_pages(nr_pages + 2, 0, 101)
+        with OnlineChecker(sim_config, [0], 101) as checker:
+            pass
+        report = checker.report()
+        assert (report.kernel_lost, report.unparsed_lines, report.lost()) == ({0: 2 * 101}, 0, 2 * 101)
+        assert report.ok(allow_lost=True) and not report.ok(), str(report)
+
+    def test_soak_runs_past_the_buffer_size(self, sim, sim_config):
+        report = soak(sim_config, [0, 1, 2], 11, 0.2, pages_per_round=4)
+        assert report.ok(allow_lost=True), str(report)
+        assert max(sequence.expected for sequence in report.sequences) > sim_config['nr_pages_to_fillup_buffer'] * 11
@@ -0,0 +1,78 @@
+import pytest
+from helper import ArgumentError
+from pacing import Pacer
+from pacing import PacingProfile
+
+
+class FakeClock:
+    # Sleeping moves the clock, every read while spinning moves it 1 us.
+    def __init__(self):
+        self.now = 1000000000
+        self.sleeps = []
+
+    def now_ns(self):
+        self.now += 1000
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += int(seconds * 1000000000)
+
+
+def schedule(profile, nr_entries, clock=None):
+    clock = clock or FakeClock()
+    pacer = Pacer(profile, now_ns=clock.now_ns, sleep=clock.sleep)
+    deadlines = []
+    for _ in range(nr_entries):
+        pacer.wait()
+        deadlines.append(pacer.schedule_ns)
+    return (pacer, deadlines)
+
+
+class TestPacing:
+    def test_ramp_follows_the_integral_of_the_rate(self):
+        profile = PacingProfile(100000, ramp_ms=10)
+        assert profile.time_of(profile.entries_at(10000000)) == pytest.approx(10000000)
+        assert profile.time_of(profile.entries_at(3000000)) == pytest.approx(3000000)
+        pacer, deadlines = schedule(profile, 100)
+        # 100 entries are due when 100000 / 0.01 * t^2 / 2 == 100.
+        assert deadlines[-1] == pytest.approx(4472136, abs=1000)
+        assert deadlines[:2] == [pytest.approx(447214, abs=1000), pytest.approx(632456, abs=1000)]
+        _, deadlines = schedule(profile, 600)
+        assert deadlines[-1] - deadlines[-2] == pytest.approx(10000, abs=1)
+
+    def test_bursts(self):
+        profile = PacingProfile(1000, burst_on_ms=5, burst_off_ms=15)
+        assert [profile.next_on(ms * 1000000) // 1000000 for ms in [3, 5, 6, 19, 20, 26]] == [3, 20, 20, 20, 20, 40]
+        _, deadlines = schedule(profile, 8)
+        starts = [0] + [deadline for deadline in deadlines[:-1]]
+        assert [profile.next_on(start) // 1000000 for start in starts] == [0, 1, 2, 3, 4, 20, 21, 22]
+        with pytest.raises(ArgumentError):
+            PacingProfile(1000, burst_on_ms=5)
+
+    def test_late_writers_catch_up(self):
+        clock = FakeClock()
+        pacer = Pacer(PacingProfile(1000), now_ns=clock.now_ns, sleep=clock.sleep)
+        pacer.wait()
+        clock.now += 5000000
+        nr_sleeps = len(clock.sleeps)
+        for _ in range(4):
+            pacer.wait()
+        # The entries 1 to 4 were due 1 ms apart, all of them before the stall ended.
+        assert len(clock.sleeps) == nr_sleeps
+        assert pacer.max_late_ns == pytest.approx(4000000, abs=10000)
+        assert pacer.late_ns == pytest.approx(4000000 + 3000000 + 2000000 + 1000000, abs=50000)
+        # The entry due at 5 ms is just late, the next one waits again.
+        pacer.wait()
+        pacer.wait()
+        assert len(clock.sleeps) == nr_sleeps + 1
+        report = pacer.report()
+        assert (report.nr_entries, report.target_rate()) == (7, pytest.approx(1000))
+
+    def test_seeded_schedule(self):
+        profile = PacingProfile(1000, jitter='poisson', seed=7)
+        _, first = schedule(profile, 50)
+        _, again = schedule(profile, 50)
+        _, other = schedule(profile.with_seed(8), 50)
+        assert first == again and first != other
+        assert first[-1] == pytest.approx(50000000, rel=0.5)
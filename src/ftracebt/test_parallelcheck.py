@@ -0,0 +1,100 @@
+import sys
+import threading
+import pytest
+from ftrace import FtraceManager
+from ftrace import MarkerPagesReportError
+from ftrace import VerifyMode
+from ftrace import WriteBuffer
+from parallelcheck import ParallelCheck
+
+
+def write_pages(sim, config, cpu, page_ids, entries_per_page):
+    sim.pin(cpu)
+    with WriteBuffer(config) as writebuffer:
+        for page_id in page_ids:
+            writebuffer.write_page(cpu, page_id, entries_per_page)
+
+
+@pytest.mark.parametrize('sim', [4], indirect=True)
+class TestParallelCheck:
+    def test_same_report_with_any_number_of_workers(self, sim, sim_config):
+        write_pages(sim, sim_config, 0, [1, 2, 3], 11)
+        write_pages(sim, sim_config, 1, [1, 3], 11)
+        write_pages(sim, sim_config, 2, [1, 2, 3], 11)
+        reports = [ParallelCheck(sim_config, workers).check(sim_config['trace'], [0, 1, 2], 11, 3) for workers in [1, 3]]
+        assert str(reports[0]) == str(reports[1])
+        failed = reports[1].failed_marker_reports()
+        assert [(report.source, report.cpu, report.missing_pages) for report in failed] == [(filename, 1, [2]) for filename in sim_config['trace']]
+        with pytest.raises(MarkerPagesReportError):
+            reports[1].raise_errors()
+
+    def test_per_cpu_content(self, sim, sim_config):
+        for cpu in [0, 3]:
+            write_pages(sim, sim_config, cpu, [1, 2], 7)
+        report = ParallelCheck(sim_config, 2).per_cpu_content(sim_config['trace'], 'write_two_pages', [0, 3], 7)
+        assert report.ok()
+        assert len(report.marker_reports) == 2 * len(sim_config['trace'])
+
+    def test_tiered_verification_finds_the_same_pages(self, sim, sim_config):
+        write_pages(sim, sim_config, 0, [1, 2], 11)
+        with WriteBuffer(sim_config) as writebuffer:
+            entries = list(WriteBuffer.generate_page_entries(0, 3, 11))
+            writebuffer.write_strings(entries[:5] + entries[6:])
+        write_pages(sim, sim_config, 0, [5, 6, 6], 11)
+        full = ParallelCheck(sim_config, 1).check(sim_config['trace'], [0], 11, 6)
+        tiered = ParallelCheck(sim_config, 1, verify_mode=VerifyMode('tiered')).check(sim_config['trace'], [0], 11, 6)
+        sampled = ParallelCheck(sim_config, 1, verify_mode=VerifyMode('tiered', 0.5, 3)).check(sim_config['trace'], [0], 11, 6)
+        for report in [tiered, sampled]:
+            assert [(r.missing_pages, r.torn_pages, r.out_of_sequence, list(r.extra_entries)) for r in report.marker_reports] == \
+                   [(r.missing_pages, r.torn_pages, r.out_of_sequence, list(r.extra_entries)) for r in full.marker_reports]
+        assert [(r.pages_hashed, r.pages_sampled) for r in tiered.marker_reports] == [(5, 0), (5, 0)]
+        assert sum(r.pages_hashed + r.pages_sampled for r in sampled.marker_reports) == 10
+
+    def test_checks_from_several_threads(self, sim, sim_config):
+        check = ParallelCheck(sim_config, 1)
+        write_pages(sim, sim_config, 0, [1, 2, 3], 11)
+        complete = check.read_records(sim_config['trace'])
+        FtraceManager(sim_config).clear_buffer()
+        write_pages(sim, sim_config, 0, [1, 3], 11)
+        missing = check.read_records(sim_config['trace'])
+        missing_pages = {}
+
+        def run(name, records):
+            missing_pages[name] = set()
+            for _ in range(500):
+                report = check.check_records(sim_config['trace'], records, [0], 11, 3)
+                missing_pages[name].update(tuple(r.missing_pages) for r in report.marker_reports)
+
+        # Switch threads often enough for the checks to overlap.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=run, args=args) for args in [('complete', complete), ('missing', missing)]]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+        assert missing_pages == {'complete': {()}, 'missing': {(2,)}}
+
+    def test_forks_once_the_files_are_read(self, sim, sim_config):
+        for cpu in [0, 1, 2]:
+            write_pages(sim, sim_config, cpu, [1, 2, 3], 11)
+        # A thread, e.g. the counter sampler, holds the lock of the simulated
+        # tracefs. Workers forked meanwhile would never get it.
+        held = threading.Event()
+        release = threading.Timer(0.05, lambda: None)
+
+        def hold():
+            with sim.lock:
+                held.set()
+                release.join()
+
+        holder = threading.Thread(target=hold)
+        release.start()
+        holder.start()
+        held.wait()
+        report = ParallelCheck(sim_config, 3).check(sim_config['trace'], [0, 1, 2], 11, 3)
+        holder.join()
+        assert report.ok()
@@ -0,0 +1,57 @@
+import json
+import pytest
+from ftrace import Check
+from ftrace import WriteBuffer
+from profiling import SpanReport
+from profiling import Spans
+from records import TraceRecords
+
+
+@pytest.fixture
+def spans():
+    enabled = Spans.enabled
+    saved = Spans.take()
+    yield Spans
+    Spans.enabled = enabled
+    Spans.totals, Spans.counters = saved
+
+
+def page_records(cpu, page_ids, entries_per_page):
+    records = TraceRecords()
+    for page_id in page_ids:
+        for entry in WriteBuffer.generate_page_entries(cpu, page_id, entries_per_page):
+            records.append('writer', 100, cpu, '....', 1000 + len(records), 'tracing_mark_write: ' + entry)
+    return records
+
+
+class TestSpans:
+    def test_spans_and_counters(self, spans):
+        records = page_records(0, [1, 2], 11)
+        spans.disable()
+        Check.marker_pages_report(records, 11, 0, 2)
+        with spans.timed('disabled'):
+            spans.count('disabled')
+        assert spans.take() == ({}, {})
+        spans.enable()
+        for _ in range(3):
+            Check.marker_pages_report(records, 11, 0, 2)
+        with spans.timed('block'):
+            pass
+        totals, counters = spans.take()
+        assert sorted(totals) == ['block', 'check.marker_pages']
+        calls, total_ns, max_ns = totals['check.marker_pages']
+        assert calls == 3 and 0 < max_ns <= total_ns
+        assert counters == {'check.pages': 6}
+
+    def test_report(self, tmp_path):
+        report = SpanReport()
+        report.add('test_a', 5000, {'read': [2, 3000, 2000], 'write': [1, 1000, 1000]}, {'read.records': 10})
+        report.add('test_b', 2000, {'read': [1, 1500, 1500]}, {'read.records': 4})
+        assert report.phases() == {'read': {'calls': 3, 'total_ns': 4500, 'max_ns': 2000}, 'write': {'calls': 1, 'total_ns': 1000, 'max_ns': 1000}}
+        lines = report.summary_lines()
+        assert lines[1].split()[:2] == ['read', '3'] and lines[-2].startswith('     0.005 ms test_a (read 0.003 ms')
+        filename = str(tmp_path / 'spans.json')
+        report.export(filename)
+        with open(filename) as f:
+            exported = json.load(f)
+        assert exported['duration_ns'] == 7000 and exported['counters'] == {'read.records': 14} and sorted(exported['tests']) == ['test_a', 'test_b']
@@ -0,0 +1,98 @@
+import struct
+import pytest
+from ftrace import Check
+from ftrace import WriteBuffer
+from rawtrace import RawBufferReader
+from rawtrace import RawEvents
+from rawtrace import RawPage
+from rawtrace import RawPageBuilder
+from rawtrace import RawPrint
+
+
+PAGE_SIZE = 4096
+ENTRIES_PER_PAGE = 101
+
+
+def marker_pages(cpu, nr_pages, first_ts, ts_step=1000, pid=1234):
+    pages = []
+    ts = first_ts
+    for page_id in range(1, nr_pages + 1):
+        builder = RawPageBuilder(PAGE_SIZE, ts)
+        for entry in WriteBuffer.generate_page_entries(cpu, page_id, ENTRIES_PER_PAGE):
+            assert builder.add_print(ts, pid, entry)
+            ts += ts_step
+        pages.append(builder.to_bytes())
+    return pages
+
+
+@pytest.fixture
+def raw_files(tmp_path):
+    def _raw_files(pages_per_cpu):
+        config = {'trace_pipe_raw_file': str(tmp_path / 'cpu{}.raw')}
+        for cpu, pages in pages_per_cpu.items():
+            (tmp_path / 'cpu{}.raw'.format(cpu)).write_bytes(b''.join(pages))
+        return RawBufferReader(config, PAGE_SIZE, RawPrint.event_id)
+    return _raw_files
+
+
+@pytest.fixture
+def config_no_kernel():
+    return {'nr_pages_to_fillup_buffer': 9}
+
+
+class TestRawBufferReader:
+    def test_marker_entries_per_page(self):
+        builder = RawPageBuilder(PAGE_SIZE, 0)
+        entries = list(WriteBuffer.generate_page_entries(0, 1, ENTRIES_PER_PAGE + 1))
+        for entry in entries[:-1]:
+            assert builder.add_print(0, 1, entry)
+        assert not builder.add_print(0, 1, entries[-1])
+
+    def test_decode_page_header_and_prints(self):
+        builder = RawPageBuilder(PAGE_SIZE, 5000)
+        builder.add_print(5010, 42, 'hello', flags=RawPrint.irqs_off | RawPrint.hardirq, preempt_count=2)
+        builder.add_print(5030, 43, 'world\n')
+        page = RawPage.decode(memoryview(builder.to_bytes()))
+        assert page.timestamp == 5000
+        assert page.missed_events is None
+        events = [(ts, RawPrint.decode(data)) for ts, data in RawEvents.iter_page(page)]
+        assert events == [(5010, (RawPrint.event_id, 0x09, 2, 42, 'hello')), (5030, (RawPrint.event_id, 0, 0, 43, 'world'))]
+        assert RawPrint.lat_flags(0x09, 2) == 'd.h2'
+
+    def test_time_extend_padding_and_long_events(self):
+        builder = RawPageBuilder(PAGE_SIZE, 0)
+        long_text = 'x' * 200
+        builder.add_print(10, 1, 'a')
+        builder.add_padding(16)
+        builder.add_print(10 + (5 << 27) + 3, 1, long_text)
+        builder.add_print(10 + (5 << 27) + 7, 1, 'b')
+        page = RawPage.decode(builder.to_bytes())
+        events = [(ts, RawPrint.decode(data)[4]) for ts, data in RawEvents.iter_page(page)]
+        assert events == [(10, 'a'), (10 + (5 << 27) + 3, long_text), (10 + (5 << 27) + 7, 'b')]
+
+    def test_absolute_time_stamp_and_null_padding(self):
+        builder = RawPageBuilder(PAGE_SIZE, 100)
+        builder.add_print(100, 1, 'a')
+        struct.pack_into('<II', builder.page, builder.offset, RawEvents.time_stamp | ((777 & ((1 << 27) - 1)) << 5), 777 >> 27)
+        builder.offset += 8
+        builder.last_timestamp = 777
+        builder.add_print(780, 1, 'b')
+        struct.pack_into('<II', builder.page, builder.offset, RawEvents.padding, 0)
+        builder.offset += 8
+        page = RawPage.decode(builder.to_bytes())
+        assert [(ts, RawPrint.decode(data)[4]) for ts, data in RawEvents.iter_page(page)] == [(100, 'a'), (780, 'b')]
+
+    def test_missed_events(self):
+        builder = RawPageBuilder(PAGE_SIZE, 0)
+        builder.add_print(1, 1, 'a')
+        builder.missed_events = 17
+        assert RawPage.decode(builder.to_bytes()).missed_events == 17
+
+    def test_marker_pages_from_raw_files(self, raw_files, config_no_kernel):
+        reader = raw_files({0: marker_pages(0, 3, 1000), 1: marker_pages(1, 3, 1500)})
+        records = reader.read_cpus([0, 1])
+        assert len(records) == 2 * 3 * ENTRIES_PER_PAGE
+        assert list(records.timestamps) == sorted(records.timestamps)
+        Check.per_cpu_content(config_no_kernel, 'write_three_pages', records, [0, 1], ENTRIES_PER_PAGE)
+        Check.merged_buffers(records)
+        assert Check.exact_marker_pages(reader.read_cpu(1), ENTRIES_PER_PAGE, 1, 3)
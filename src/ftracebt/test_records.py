@@ -0,0 +1,22 @@
+import pytest
+from capture import TraceCapture
+from capture import save
+from ftrace import Check
+from ftrace import UnexpectedCpuEntriesError
+from records import TraceRecords
+
+
+class TestTraceRecords:
+    def test_lines_as_read_are_reported(self, sim_config, tmp_path):
+        # Nanosecond timestamps, with and without the irq-info column.
+        lines = ['          writer-100     [000] ...1  1234.000000101: tracing_mark_write: 000-00000001-000\n',
+                 '          writer-101     [002]  1234.000000202: tracing_mark_write: 002-00000001-000\n']
+        records = TraceRecords.parse(lines)
+        assert [records.line(i) + '\n' for i in range(len(records))] == lines
+        with pytest.raises(UnexpectedCpuEntriesError) as err:
+            Check.per_cpu_content(sim_config, 'write_two_pages', records, [0], 11)
+        assert str(err.value).endswith('First one at index 1: ' + lines[1].rstrip('\n'))
+        filename = str(tmp_path / 'lines.ftcap')
+        save(filename, records, [], {})
+        with TraceCapture(filename) as capture:
+            assert capture.line(1) + '\n' == lines[1]
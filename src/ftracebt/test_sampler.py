@@ -0,0 +1,53 @@
+import json
+import pytest
+from ftrace import FtraceManager
+from ftrace import WriteBuffer
+from helper import ArgumentError
+from sampler import CounterSampler
+
+
+class TestCounterSampler:
+    def test_series_follow_the_writes(self, sim, sim_config):
+        sampler = CounterSampler(sim_config, [0, 1], capacity=16)
+        sampler.open()
+        with WriteBuffer(sim_config) as writebuffer:
+            for page_id in range(1, 4):
+                writebuffer.write_page(0, page_id, 101)
+                sampler.sample()
+        sampler.close()
+        _, readable_pages = sampler.series(0, 'nr_readable_pages')
+        assert list(readable_pages) == [1, 2, 3]
+        assert [value for _, value in sampler.changes(1, 'commit_page_commit')] == [0]
+
+    def test_ring_keeps_the_newest_samples(self, sim, sim_config, tmp_path):
+        sampler = CounterSampler(sim_config, [0], capacity=4, counters=['nr_entries_commit_page'])
+        sampler.open()
+        with WriteBuffer(sim_config) as writebuffer:
+            for entry_nr in range(1, 11):
+                writebuffer.write_entry(0, 1, entry_nr)
+                sampler.sample()
+        sampler.close()
+        timestamps, values = sampler.series(0, 'nr_entries_commit_page')
+        assert list(values) == [7, 8, 9, 10]
+        assert list(timestamps) == sorted(timestamps)
+        assert sampler.dropped() == 6
+        sampler.export(str(tmp_path / 'samples.json'))
+        with open(str(tmp_path / 'samples.json')) as f:
+            assert json.load(f)['values']['0']['nr_entries_commit_page'] == [7, 8, 9, 10]
+
+    def test_background_thread(self, sim, sim_config):
+        with CounterSampler(sim_config, [0, 1], interval=0.0005) as sampler:
+            with WriteBuffer(sim_config) as writebuffer:
+                writebuffer.write_pages(4, 0, 101)
+        timestamps, _ = sampler.series(1, 'nr_readable_pages')
+        assert len(timestamps) == sampler.nr_samples > 0
+
+    def test_instances_without_the_counter_files(self, sim, sim_config):
+        # What conftest.py does with --ftrace-instances and --sample-counters-us.
+        with FtraceManager(sim_config).create_instance('sampled') as instance:
+            with CounterSampler(instance.config, [0, 1], interval=0.0005) as sampler:
+                with WriteBuffer(instance.config) as writebuffer:
+                    writebuffer.write_pages(2, 0, 101)
+            assert sampler.counters == [] and sampler.nr_samples > 0
+            with pytest.raises(ArgumentError):
+                CounterSampler(instance.config, [0], counters=['nr_readable_pages'])
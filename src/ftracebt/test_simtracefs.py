@@ -0,0 +1,135 @@
+import threading
+import pytest
+from ftrace import BufferInternals
+from ftrace import Check
+from ftrace import FtraceInstanceError
+from ftrace import FtraceManager
+from ftrace import ReadBuffer
+from ftrace import StatsPhase
+from ftrace import WriteBuffer
+from helper import FileWriteError
+from helper import Helpers
+from rawtrace import RawBufferReader
+
+
+class TestSimulatedTracefs:
+    def test_overwrites_oldest_pages(self, sim, sim_config, marker_entries_per_page):
+        nr_pages = sim_config['nr_pages_to_fillup_buffer']
+        with WriteBuffer(sim_config) as writebuffer:
+            writebuffer.write_pages(nr_pages + 2, 0, marker_entries_per_page)
+        records = ReadBuffer(sim_config).get_records(sim_config['trace'][0])
+        assert Check.exact_marker_pages(records, marker_entries_per_page, 0, nr_pages, 3)
+        info = BufferInternals(sim_config).get_info(0)
+        assert info['nr_readable_pages'] == nr_pages
+        assert info['nr_entries_commit_page'] == marker_entries_per_page
+
+    def test_clear_and_tracing_off(self, sim, sim_config):
+        readbuffer = ReadBuffer(sim_config)
+        ftrace_manager = FtraceManager(sim_config)
+        with WriteBuffer(sim_config) as writebuffer:
+            writebuffer.write_pages(1, 0, 5)
+            assert not readbuffer.is_empty()
+            ftrace_manager.clear_buffer()
+            assert readbuffer.is_empty()
+            ftrace_manager.set_tracing_off()
+            with pytest.raises(FileWriteError):
+                writebuffer.write_pages(1, 0, 5)
+
+    def test_trace_pipe_raw_consumes_pages(self, sim, sim_config, marker_entries_per_page):
+        sim.pin(1)
+        with WriteBuffer(sim_config, 'batched') as writebuffer:
+            writebuffer.write_pages(3, 1, marker_entries_per_page)
+        records = RawBufferReader(sim_config).read_cpu(1)
+        assert Check.exact_marker_pages(records, marker_entries_per_page, 1, 3)
+        assert BufferInternals(sim_config).get_nr_readable_pages(1) == 0
+
+    def test_buffer_size_kb_resizes_the_buffer(self, sim, sim_config):
+        # buffer_size_kb shows the data size of the pages, 4080 bytes each.
+        ftrace_manager = FtraceManager(sim_config)
+        assert ftrace_manager.get_buffer_size_kb() == 9 * 4080 // 1024
+        ftrace_manager.set_buffer_size_kb(10)
+        assert ftrace_manager.get_buffer_size_kb() == 3 * 4080 // 1024
+        assert [FtraceManager.nr_pages_to_fillup(size_kb, 4096) for size_kb in [1020, 1024, 1408]] == [256, 258, 354]
+        ftrace_manager.set_buffer_size_kb(1408)
+        assert ftrace_manager.get_buffer_size_kb() == 1410
+        ftrace_manager.set_buffer_size_kb(1024)
+        nr_pages = FtraceManager.nr_pages_to_fillup(1024, 4096)
+        config = dict(sim_config, nr_pages_to_fillup_buffer=nr_pages)
+        with WriteBuffer(config) as writebuffer:
+            writebuffer.write_pages(nr_pages + 1, 0, 101)
+        assert Check.exact_marker_pages(ReadBuffer(config).get_records(config['trace'][0]), 101, 0, nr_pages, 2)
+        Helpers.write2file('/sys/kernel/debug/tracing/per_cpu/cpu1/buffer_size_kb', '4')
+        assert Helpers.backend.read_line(sim_config['buffer_size_kb_file']) == 'X'
+        with pytest.raises(FileWriteError):
+            ftrace_manager.set_buffer_size_kb(0)
+
+    def test_stats_overrun_and_dropped_events(self, sim, sim_config):
+        nr_pages = sim_config['nr_pages_to_fillup_buffer']
+        with StatsPhase(sim_config, [0, 1]) as phase:
+            with WriteBuffer(sim_config) as writebuffer:
+                writebuffer.write_pages(nr_pages + 2, 0, 101)
+        assert phase.delta()[0] == {'overrun': 2 * 101, 'commit_overrun': 0, 'dropped_events': 0, 'read_events': 0}
+        assert phase.total('overrun') == 2 * 101
+        stats = BufferInternals(sim_config).get_stats(0)
+        assert (stats['entries'], stats['bytes'] > 0, stats['oldest_event_ts'] <= stats['now_ts']) == (nr_pages * 101, True, True)
+        ftrace_manager = FtraceManager(sim_config)
+        ftrace_manager.set_overwrite(False)
+        ftrace_manager.clear_buffer()
+        with phase:
+            with WriteBuffer(sim_config) as writebuffer:
+                writebuffer.write_pages(nr_pages + 2, 0, 101)
+        assert (phase.total('overrun'), phase.total('dropped_events')) == (0, 2 * 101)
+        records = ReadBuffer(sim_config).get_records(sim_config['trace'][0])
+        assert Check.exact_marker_pages(records, 101, 0, nr_pages, 1)
+
+    def test_instances_have_their_own_buffer(self, sim, sim_config):
+        ftrace_manager = FtraceManager(sim_config)
+        ftrace_manager.set_buffer_size_kb(8)
+        with ftrace_manager.create_instance('a') as a, ftrace_manager.create_instance('b') as b:
+            assert ftrace_manager.list_instances() == ['a', 'b']
+            assert a.config['trace'] == ['/sys/kernel/debug/tracing/instances/a/trace']
+            assert 'nr_readable_pages_file' not in a.config and a.config['per_cpu_stats_file'] == '/sys/kernel/debug/tracing/instances/a/per_cpu/cpu{}/stats'
+            assert FtraceManager(a.config).get_buffer_size_kb() == 11
+            with WriteBuffer(a.config) as writebuffer:
+                writebuffer.write_pages(2, 0, 11)
+            FtraceManager(b.config).set_tracing_off()
+            with WriteBuffer(sim_config) as writebuffer:
+                writebuffer.write_pages(1, 0, 11)
+            assert Check.exact_marker_pages(ReadBuffer(a.config).get_records(a.config['trace'][0]), 11, 0, 2)
+            assert Check.exact_marker_pages(ReadBuffer(sim_config).get_records(sim_config['trace'][0]), 11, 0, 1)
+            assert ReadBuffer(b.config).is_empty() and sim.buffer.tracing_on
+            with pytest.raises(FtraceInstanceError):
+                ftrace_manager.create_instance('a')
+        assert ftrace_manager.list_instances() == []
+        with pytest.raises(FileWriteError):
+            FtraceManager(a.config).clear_buffer()
+
+    def test_instances_written_concurrently(self, sim, sim_config):
+        ftrace_manager = FtraceManager(sim_config)
+        instances = [ftrace_manager.create_instance(name) for name in ['a', 'b']]
+        barrier = threading.Barrier(len(instances))
+        errors = []
+
+        def write(config, nr_pages, entries_per_page):
+            try:
+                sim.pin(1)
+                barrier.wait()
+                with WriteBuffer(config) as writebuffer:
+                    for page_id in range(1, nr_pages + 1):
+                        writebuffer.write_page(1, page_id, entries_per_page)
+            except Exception as err:
+                errors.append(err)
+
+        writers = [threading.Thread(target=write, args=(instance.config, nr_pages, entries_per_page))
+                   for instance, nr_pages, entries_per_page in zip(instances, [3, 5], [11, 7])]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        assert not errors
+        for instance, nr_pages, entries_per_page in zip(instances, [3, 5], [11, 7]):
+            records = ReadBuffer(instance.config).get_records(instance.config['trace'][0])
+            assert len(records) == nr_pages * entries_per_page
+            assert Check.exact_marker_pages(records, entries_per_page, 1, nr_pages)
+            instance.remove()
+        assert ReadBuffer(sim_config).is_empty()
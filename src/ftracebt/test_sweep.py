@@ -0,0 +1,24 @@
+import pytest
+from ftrace import FtraceManager
+from helper import ArgumentError
+from sweep import Pacing
+from sweep import Sweep
+
+
+class TestSweep:
+    def test_matrix(self, sim, sim_config):
+        sweep = Sweep(sim_config, 101, writer_names=['write_one_page', 'fillup_plus_one_page'])
+        results = sweep.run([8, 16], [[0], [0, 1]], [Pacing('none'), Pacing('rate:1000000')])
+        assert len(results['results']) == 2 * 2 * 2 * 2
+        assert {result['buffer_size_kb']: result['nr_pages'] for result in results['results']} == {8: 3, 16: 5}
+        assert all(result['ok'] and result['lost_entries'] == 0 for result in results['results'])
+        fillup = [result for result in results['results'] if result['writer'] == 'fillup_plus_one_page' and result['cpus'] == [0, 1]]
+        assert [result['entries'] for result in fillup] == [2 * 4 * 101, 2 * 4 * 101, 2 * 6 * 101, 2 * 6 * 101]
+        assert [result['overrun'] for result in fillup] == [2 * 101] * 4
+        assert len(results['curves']) == 2 * 2 * 2
+        assert results['curves'][0]['buffer_size_kb'] == [8, 16]
+        assert FtraceManager(sim_config).get_buffer_size_kb() == 35
+
+    def test_wrong_pacing(self):
+        with pytest.raises(ArgumentError):
+            Pacing('fast')
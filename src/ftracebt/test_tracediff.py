@@ -0,0 +1,47 @@
+import pytest
+from ftrace import Check
+from ftrace import CompareTraceFiles
+from tracediff import TraceDiff
+
+
+def trace_lines(nr_lines, entries_line='# entries-in-buffer/entries-written: 10/10   #P:4\n'):
+    header = ['# tracer: nop\n', '#\n', entries_line]
+    return header + ['          <...>-1       [000] ....   100.{:06}: tracing_mark_write: line {}\n'.format(i, i) for i in range(nr_lines)]
+
+
+class TestTraceDiff:
+    def test_equal_content(self):
+        trace = trace_lines(5000)
+        persistent = trace_lines(5000, '# entries-in-buffer/entries-written: 10/99   #P:4\n')
+        trace.insert(1000, '##### CPU 2 buffer started ####\n')
+        report = TraceDiff(chunk_size=64).compare(iter(trace), iter(persistent))
+        assert report.ok()
+        assert report.nr_equal_lines == 5002
+
+    def test_reports_every_divergent_range(self):
+        trace = trace_lines(3000)
+        persistent = trace_lines(3000)
+        persistent[100] = 'changed\n'
+        del persistent[1500:1510]
+        persistent.insert(2500, 'inserted\n')
+        report = TraceDiff(chunk_size=256, context=2).compare(iter(trace), iter(persistent))
+        assert report.nr_ranges == 3
+        changed, deleted, inserted = report.ranges
+        assert (changed.nr_trace_lines, changed.nr_persistent_lines) == (1, 1)
+        assert changed.trace_lines[0][0] == 100 and changed.persistent_lines[0][1] == 'changed\n'
+        assert [line for _, line in changed.before] == trace[98:100]
+        assert [line for _, line in changed.after] == trace[101:103]
+        assert (deleted.nr_trace_lines, deleted.nr_persistent_lines) == (10, 0)
+        assert (deleted.trace_start, deleted.persistent_start) == (1500, 1500)
+        assert (inserted.nr_trace_lines, inserted.nr_persistent_lines) == (0, 1)
+        assert inserted.persistent_lines[0] == (2500, 'inserted\n')
+
+    def test_longer_content(self):
+        report = TraceDiff(chunk_size=16).compare(iter(trace_lines(100)), iter(trace_lines(90)))
+        assert report.nr_ranges == 1
+        assert (report.ranges[0].nr_trace_lines, report.ranges[0].nr_persistent_lines) == (10, 0)
+
+    def test_content_trace_files(self):
+        assert Check.content_trace_files(iter(trace_lines(10)), iter(trace_lines(10))).ok()
+        with pytest.raises(CompareTraceFiles, match='Divergent ranges: 1'):
+            Check.content_trace_files(iter(trace_lines(10)), iter(trace_lines(11)))
@@ -0,0 +1,185 @@
+from collections import deque
+from itertools import islice
+
+
+class _LineStream:
+    # Numbered lines of one file with the lines that are allowed to differ
+    # left out. Lines put back with push_back() are served first.
+    entries_line = '# entries-in-buffer/entries-written: '
+    annotation = ' buffer started ####'
+
+    def __init__(self, lines, skip_annotations):
+        self.lines = _LineStream._filter(lines, skip_annotations)
+        self.pending = deque()
+        self.exhausted = False
+
+    @staticmethod
+    def _filter(lines, skip_annotations):
+        for i, line in enumerate(lines):
+            if i == 2 and line.find(_LineStream.entries_line) != -1:
+                continue
+            if skip_annotations and line.find(_LineStream.annotation) != -1:
+                continue
+            yield (i, line)
+
+    def fill(self, n):
+        if len(self.pending) < n and not self.exhausted:
+            before = len(self.pending)
+            self.pending.extend(islice(self.lines, n - before))
+            self.exhausted = len(self.pending) < n
+        return len(self.pending)
+
+    def take(self, n):
+        self.fill(n)
+        return [self.pending.popleft() for _ in range(min(n, len(self.pending)))]
+
+    def push_back(self, items):
+        self.pending.extendleft(reversed(items))
+
+    def window(self, n):
+        self.fill(n)
+        return list(islice(self.pending, n))
+
+    def consume(self, n):
+        for _ in range(n):
+            self.pending.popleft()
+
+
+class DivergentRange:
+    def __init__(self, before, trace_start, trace_lines, nr_trace_lines, persistent_start, persistent_lines, nr_persistent_lines, after):
+        self.before = before
+        self.trace_start = trace_start
+        self.persistent_start = persistent_start
+        self.trace_lines = trace_lines
+        self.nr_trace_lines = nr_trace_lines
+        self.persistent_lines = persistent_lines
+        self.nr_persistent_lines = nr_persistent_lines
+        self.after = after
+
+    @staticmethod
+    def _span(start, nr_lines):
+        if start is None:
+            return 'end+{}'.format(nr_lines)
+        return '{}+{}'.format(start, nr_lines)
+
+    def __str__(self):
+        out = ['@@ trace {} persistent {} @@'.format(DivergentRange._span(self.trace_start, self.nr_trace_lines),
+                                                     DivergentRange._span(self.persistent_start, self.nr_persistent_lines))]
+        out.extend('  {}'.format(line.rstrip('\n')) for _, line in self.before)
+        out.extend('- {}'.format(line.rstrip('\n')) for _, line in self.trace_lines)
+        if self.nr_trace_lines > len(self.trace_lines):
+            out.append('- ... {} more lines'.format(self.nr_trace_lines - len(self.trace_lines)))
+        out.extend('+ {}'.format(line.rstrip('\n')) for _, line in self.persistent_lines)
+        if self.nr_persistent_lines > len(self.persistent_lines):
+            out.append('+ ... {} more lines'.format(self.nr_persistent_lines - len(self.persistent_lines)))
+        out.extend('  {}'.format(line.rstrip('\n')) for _, line in self.after)
+        return '\n'.join(out)
+
+
+class TraceDiffReport:
+    def __init__(self):
+        self.ranges = []
+        self.nr_ranges = 0
+        self.nr_equal_lines = 0
+
+    def ok(self):
+        return self.nr_ranges == 0
+
+    def __str__(self):
+        if self.ok():
+            return 'trace and persistent content match. Lines compared: {}.'.format(self.nr_equal_lines)
+        details = ['trace and persistent content differ. Divergent ranges: {}. Equal lines: {}.'.format(self.nr_ranges, self.nr_equal_lines)]
+        details.extend(str(divergent_range) for divergent_range in self.ranges)
+        if self.nr_ranges > len(self.ranges):
+            details.append('... {} more divergent ranges'.format(self.nr_ranges - len(self.ranges)))
+        return '\n'.join(details)
+
+
+class TraceDiff:
+    # Compares trace and persistent content in lockstep chunks. Aligned
+    # chunks that are equal are skipped with a single list comparison. At a
+    # mismatch both sides are realigned within a window of lines, using an
+    # index of the lines of one side, and every divergent range is reported
+    # with its context. Memory depends on the chunk, window and report
+    # limits, not on the size of the files.
+    def __init__(self, chunk_size=1024, window=4096, context=3, sync_lines=3, max_ranges=20, max_range_lines=10):
+        self.chunk_size = chunk_size
+        self.window = window
+        self.context = context
+        self.sync_lines = sync_lines
+        self.max_ranges = max_ranges
+        self.max_range_lines = max_range_lines
+
+    def compare(self, trace_content, persistent_content):
+        trace = _LineStream(trace_content, skip_annotations=True)
+        persistent = _LineStream(persistent_content, skip_annotations=False)
+        report = TraceDiffReport()
+        before = deque(maxlen=self.context)
+        while True:
+            trace_chunk = trace.take(self.chunk_size)
+            persistent_chunk = persistent.take(self.chunk_size)
+            if not trace_chunk and not persistent_chunk:
+                return report
+            trace_lines = [line for _, line in trace_chunk]
+            persistent_lines = [line for _, line in persistent_chunk]
+            if trace_lines == persistent_lines:
+                report.nr_equal_lines += len(trace_lines)
+                before.extend(trace_chunk[-self.context:] if self.context else ())
+                continue
+            n = 0
+            for trace_line, persistent_line in zip(trace_lines, persistent_lines):
+                if trace_line != persistent_line:
+                    break
+                n += 1
+            report.nr_equal_lines += n
+            before.extend(trace_chunk[max(n - self.context, 0):n] if self.context else ())
+            trace.push_back(trace_chunk[n:])
+            persistent.push_back(persistent_chunk[n:])
+            self._realign(trace, persistent, before, report)
+
+    def _synced(self, trace, persistent, trace_window, persistent_window, i, j):
+        a = [line for _, line in trace_window[i:i + self.sync_lines]]
+        b = [line for _, line in persistent_window[j:j + self.sync_lines]]
+        if a != b:
+            return False
+        if len(a) == self.sync_lines:
+            return True
+        # Shorter than sync_lines: only good if both files end here.
+        return (trace.exhausted and persistent.exhausted and len(trace.pending) == len(trace_window) and len(persistent.pending) == len(persistent_window)
+                and i + len(a) == len(trace_window) and j + len(b) == len(persistent_window))
+
+    def _find_sync(self, trace, persistent, trace_window, persistent_window):
+        positions = {}
+        for j, (_, line) in enumerate(persistent_window):
+            positions.setdefault(line, []).append(j)
+        best = None
+        for i, (_, line) in enumerate(trace_window):
+            if best is not None and i >= sum(best):
+                break
+            for j in positions.get(line, ()):
+                if best is not None and i + j >= sum(best):
+                    break
+                if self._synced(trace, persistent, trace_window, persistent_window, i, j):
+                    best = (i, j)
+                    break
+        return best
+
+    def _realign(self, trace, persistent, before, report):
+        trace_window = trace.window(self.window)
+        persistent_window = persistent.window(self.window)
+        sync = self._find_sync(trace, persistent, trace_window, persistent_window)
+        if sync is None:
+            i, j = (len(trace_window), len(persistent_window))
+            after = []
+        else:
+            i, j = sync
+            after = trace_window[i:i + self.context] if self.context else []
+        report.nr_ranges += 1
+        if len(report.ranges) < self.max_ranges:
+            trace_start = trace_window[0][0] if trace_window else None
+            persistent_start = persistent_window[0][0] if persistent_window else None
+            report.ranges.append(DivergentRange(list(before), trace_start, trace_window[:min(i, self.max_range_lines)], i,
+                                                persistent_start, persistent_window[:min(j, self.max_range_lines)], j, after))
+        trace.consume(i)
+        persistent.consume(j)
+        before.clear()
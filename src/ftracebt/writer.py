@@ -1,6 +1,10 @@
 import argparse
 from helper import Helpers
+from ftrace import FtraceInstance
 from ftrace import WriteBuffer
+from multiwriter import MultiWriter
+from pacing import Pacer
+from pacing import PacingProfile
 
 
 marker_writer_names = ['write_one_page', 'write_two_pages', 'write_three_pages', 'write_four_pages', 'fillup_buffer', 'fillup_plus_one_page', 'fillup_plus_two_page', 'fillup_plus_three_page', 'fillup_plus_four_page']
@@ -11,42 +15,80 @@ def parse_args():
     parser.add_argument('--write-name', choices=marker_writer_names,
                         help="The name of what will be written to the ftrace's buffer.", required=True)
     parser.add_argument("--config-file", default="test_buffer.ini", help="Configuration file.")
+    parser.add_argument("--instance",
+            help="Write to the trace_marker of this ftrace instance, instances/INSTANCE of the tracing directory, instead of the top level one.")
     parser.add_argument("--cpu", type=int,
             help="The CPU where to write the entries. This parameter has meaning just for a few 'write-name' values.")
+    parser.add_argument("--cpus",
+            help="List of CPUs to write to at the same time, e.g. --cpus 0,1,3. One pinned worker is forked per CPU and all of them start writing together. Overrides --cpu.")
     parser.add_argument("--entries-per-page", type=int, default=101,
             help="The number of entries to write per page. This could vary depending on the page size. For 4k page size the default value fills up one page. This parameter has meaning just for a few 'write-name' values.")
     parser.add_argument("--max-delay", type=int,
             help="The max amount of microseconds to wait between the writing of entries. The delay will be picked randomly from 0 to this value. This parameter has meaning just for a few 'write-name' values.")
+    parser.add_argument("--write-mode", choices=WriteBuffer.write_modes, default='keep_open',
+            help="How entries reach trace_marker. 'reopen' opens the file for every entry, 'keep_open' keeps it open and issues one write per entry, 'batched' sends many entries per writev call (one write per entry when --max-delay is set).")
+    parser.add_argument("--batch-size", type=int,
+            help="Max number of entries per call in 'batched' write mode. Defaults to the system IOV_MAX.")
+    parser.add_argument("--rate", type=float,
+            help="Target number of entries per second. Writes are paced against perf_counter_ns deadlines with a hybrid sleep/spin wait instead of --max-delay.")
+    parser.add_argument("--burst-on-ms", type=float, default=0, help="Length of the writing periods of a burst profile. Needs --rate and --burst-off-ms.")
+    parser.add_argument("--burst-off-ms", type=float, default=0, help="Length of the idle periods of a burst profile. Needs --rate and --burst-on-ms.")
+    parser.add_argument("--ramp-ms", type=float, default=0, help="Time to ramp up linearly from --ramp-from to --rate.")
+    parser.add_argument("--ramp-from", type=float, default=0, help="Entries per second at the beginning of the ramp.")
+    parser.add_argument("--jitter", choices=PacingProfile.jitter_distributions, default='none',
+            help="Distribution of the jitter applied to the write deadlines. 'poisson' makes the intervals exponentially distributed.")
+    parser.add_argument("--jitter-us", type=float, default=0, help="Jitter width (uniform) or standard deviation (normal) in microseconds.")
+    parser.add_argument("--seed", type=int, help="Seed of the jitter distribution. Each CPU uses seed + CPU number.")
     return parser.parse_args()
 
 
+def pacing_profile(args):
+    if not args.rate:
+        return None
+    return PacingProfile(args.rate, args.burst_on_ms, args.burst_off_ms, args.ramp_ms, args.ramp_from, args.jitter, args.jitter_us, args.seed)
+
+
 def write_with_marker(args):
     config = Helpers.get_config(args.config_file)
-    writebuffer = WriteBuffer(config)
+    if args.instance:
+        config = FtraceInstance.instance_config(config, args.instance)
+    if args.cpus:
+        cpus = [int(cpu.strip()) for cpu in args.cpus.split(',')]
+        multiwriter = MultiWriter(config, args.write_mode, args.batch_size, pacing_profile(args))
+        print(multiwriter.write(args.write_name, cpus, args.entries_per_page, args.max_delay))
+        return
+    profile = pacing_profile(args)
+    pacer = Pacer(profile) if profile else None
+    with WriteBuffer(config, args.write_mode, args.batch_size) as writebuffer:
+        _write_with_marker(args, config, writebuffer, pacer)
+    if pacer:
+        print(pacer.report())
+
 
+def _write_with_marker(args, config, writebuffer, pacer):
     if args.write_name == 'write_one_page':
-        writebuffer.write_pages(1, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(1, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'write_two_pages':
-        writebuffer.write_pages(2, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(2, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'write_three_pages':
-        writebuffer.write_pages(3, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(3, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'write_four_pages':
-        writebuffer.write_pages(4, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(4, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'fillup_buffer':
         nr_pages = config['nr_pages_to_fillup_buffer']
-        writebuffer.write_pages(nr_pages, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(nr_pages, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'fillup_plus_one_page':
         nr_pages = config['nr_pages_to_fillup_buffer']
-        writebuffer.write_pages(nr_pages + 1, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(nr_pages + 1, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'fillup_plus_two_page':
         nr_pages = config['nr_pages_to_fillup_buffer']
-        writebuffer.write_pages(nr_pages + 2, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(nr_pages + 2, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'fillup_plus_three_page':
         nr_pages = config['nr_pages_to_fillup_buffer']
-        writebuffer.write_pages(nr_pages + 3, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(nr_pages + 3, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
     elif args.write_name == 'fillup_plus_four_page':
         nr_pages = config['nr_pages_to_fillup_buffer']
-        writebuffer.write_pages(nr_pages + 4, args.cpu, args.entries_per_page, delay=args.max_delay)
+        writebuffer.write_pages(nr_pages + 4, args.cpu, args.entries_per_page, delay=args.max_delay, pacer=pacer)
 
 
 def main():